@@ -19,6 +19,7 @@
 """
 
 import logging
+import multiprocessing
 
 from LicCommonImports import *
 
@@ -32,6 +33,15 @@ import LicTreeModel
 import LicImporters
 import LicDialogs
 import LicModel
+import LicParallelExport
+import LicAutosave
+import LicBenchmark
+import LicPackingBenchmark
+import LicModelGenerator
+import LicInstrumentation
+import LicImportWorker
+import LicPerfHarness
+import LicBookLayout
 
 def __recompileResources():
     # Handy personal function for rebuilding LicResources.py package (which contains the app's icons)
@@ -55,7 +65,7 @@ __version__ = "0.6.0"
 _debug = True
 
 MagicNumber = 0x14768126
-FileVersion = 23
+FileVersion = 29
 
 if _debug:
     from modeltest import ModelTest
@@ -308,6 +318,7 @@ class LicWindow(QMainWindow):
         
         self.undoStack = QUndoStack()
         self.connect(self.undoStack, SIGNAL("cleanChanged(bool)"), lambda isClean: self.setWindowModified(not isClean))
+        self.connect(self.undoStack, SIGNAL("indexChanged(int)"), lambda unused: LicHelpers.notifyModelChanged())  # Catch-all for commands that edit model lists directly
 
         self.glWidget = QGLWidget(LicGLHelpers.getGLFormat(), self)
         self.treeWidget = LicTreeWidget(self)
@@ -331,6 +342,10 @@ class LicWindow(QMainWindow):
         self.mainSplitter.restoreState(self.splitterState)
         self.setCentralWidget(self.mainSplitter)
 
+        self.statsDock = LicInstrumentation.StatsDock(self)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.statsDock)
+        self.statsDock.hide()
+
         self.initMenu()
         self.initToolBars()
 
@@ -363,6 +378,8 @@ class LicWindow(QMainWindow):
         # Need to notify the Model when a particular index was deleted
         self.treeModel.connect(self.scene, SIGNAL("itemDeleted"), self.treeModel.deletePersistentItem)
 
+        self.autosave = LicAutosave.AutosaveManager(self, FileVersion, MagicNumber, self.autosaveInterval)
+
         self.filename = ""   # This will trigger __setFilename below
 
     def getSettingsFile(self):
@@ -397,6 +414,9 @@ class LicWindow(QMainWindow):
         self.pagesToDisplay = settings.value("PageView", 1).toInt()[0]
         self.snapToGuides = settings.value("SnapToGuides").toBool()
         self.snapToItems = settings.value("SnapToItems").toBool()
+        self.useLibraryReferences = settings.value("UseLibraryReferences").toBool()
+        LicBookLayout.PARALLEL_LAYOUT = settings.value("ParallelLayout").toBool()
+        self.autosaveInterval = settings.value("AutosaveInterval", 5).toInt()[0]
 
         LDrawPath = str(settings.value("LDrawPath").toString())
 
@@ -431,6 +451,9 @@ class LicWindow(QMainWindow):
         settings.setValue("PageView", QVariant(str(self.scene.pagesToDisplay)))
         settings.setValue("SnapToGuides", QVariant(str(self.scene.snapToGuides)))
         settings.setValue("SnapToItems", QVariant(str(self.scene.snapToItems)))
+        settings.setValue("UseLibraryReferences", QVariant(str(self.useLibraryReferences)))
+        settings.setValue("ParallelLayout", QVariant(str(LicBookLayout.PARALLEL_LAYOUT)))
+        settings.setValue("AutosaveInterval", QVariant(str(self.autosave.interval)))
         settings.setValue("LDrawPath", QVariant(LicConfig.LDrawPath))
         
         customColorList = [x for x in self.instructions.colorDict.values() if x and (x.rgba != x.originalRGBA or x.edgeColor.rgba != [0,0,0,1])]
@@ -514,6 +537,9 @@ class LicWindow(QMainWindow):
         self.fileSaveAction = self.makeAction("&Save", self.fileSave, QKeySequence.Save, "Save the Instruction book")
         self.fileSaveAsAction = self.makeAction("Save &As...", self.fileSaveAs, None, "Save the Instruction book using a new filename")
         fileImportAction = self.makeAction("&Import Model", self.fileImport, None, "Import an existing Model into a new Instruction book")
+        fileLibraryReferencesAction = self.makeAction("Save LDraw Parts as References", self.setUseLibraryReferences, None, 
+                                                      "Save only a reference to official LDraw parts instead of their full geometry", "toggled(bool)", True)
+        fileLibraryReferencesAction.setChecked(self.useLibraryReferences)
 
         fileSaveTemplateAction = self.makeAction("Save Template", self.fileSaveTemplate, None, "Save only the Template")
         fileSaveTemplateAsAction = self.makeAction("Save Template As...", self.fileSaveTemplateAs, None, "Save only the Template using a new filename")
@@ -522,7 +548,7 @@ class LicWindow(QMainWindow):
         fileExitAction = self.makeAction("E&xit", SLOT("close()"), "Ctrl+Q", "Exit Lic")
 
         self.fileMenuActions = (fileOpenAction, self.fileOpenRecentMenu, self.fileCloseAction, None, 
-                                self.fileSaveAction, self.fileSaveAsAction, fileImportAction, None, 
+                                self.fileSaveAction, self.fileSaveAsAction, fileLibraryReferencesAction, fileImportAction, None, 
                                 fileSaveTemplateAction, fileSaveTemplateAsAction, fileLoadTemplateAction, fileResetTemplateAction, None,
                                 fileExitAction)
         
@@ -553,8 +579,13 @@ class LicWindow(QMainWindow):
 
         setPathsAction = self.makeAction("Paths...", self.configurePaths, None, "Set paths to LDraw parts library")
         setColorsAction = self.makeAction("Brick &Colors...", self.configureColors, None, "Change the Colors Lic uses for each element")
+        self.mergeCalloutsAction = self.makeAction("&Merge Identical Callouts", self.mergeIdenticalCallouts, None, "Merge Callouts with the same parts in each Step into one Callout with a quantity")
+        self.mergeSubmodelsAction = self.makeAction("Merge Identical &Submodels", self.mergeIdenticalSubmodels, None, "Replace Submodels with the same parts by one Submodel with a quantity")
+        parallelLayoutAction = self.makeAction("Lay Out Pages in Parallel", self.setParallelLayout, None, 
+                                               "Lay out books of %d or more pages on one background process per CPU" % LicBookLayout.PARALLEL_PAGES_MIN, "toggled(bool)", True)
+        parallelLayoutAction.setChecked(LicBookLayout.PARALLEL_LAYOUT)
 
-        editActions = (self.undoAction, self.redoAction, None, snapMenu, None, setPathsAction, setColorsAction)
+        editActions = (self.undoAction, self.redoAction, None, snapMenu, None, self.mergeCalloutsAction, self.mergeSubmodelsAction, None, setPathsAction, setColorsAction, parallelLayoutAction)
         self.addActions(editMenu, editActions)
 
         # View Menu
@@ -584,7 +615,8 @@ class LicWindow(QMainWindow):
         
         viewActions = (addHGuide, addVGuide, removeGuides, None, 
                        zoom100, zoomToFit, zoomIn, zoomOut, None, 
-                       onePage, twoPages, continuous, continuousFacing)
+                       onePage, twoPages, continuous, continuousFacing, None,
+                       self.statsDock.toggleViewAction())
         self.addActions(self.viewMenu, viewActions)
 
         # Export Menu
@@ -592,11 +624,20 @@ class LicWindow(QMainWindow):
         self.exportToImagesAction = self.makeAction("&Generate Final Images", self.exportImages, None, "Generate final images of each page in this Instruction book")
         self.exportToPDFAction = self.makeAction("Generate &PDF", self.exportToPDF, None, "Create a PDF from this instruction book")
         self.exportToMPDAction = self.makeAction("Generate &MPD", self.exportToMPD, None, "Generate an LDraw MPD file from the parts & steps in this Instruction book")
-        self.addActions(self.exportMenu, (self.exportToImagesAction, self.exportToPDFAction, None, self.exportToMPDAction))
+        self.exportToImagesParallelAction = self.makeAction("Generate Final Images in Parallel", self.exportImagesParallel, None, "Generate final images using one background Lic process per CPU")
+        self.exportToPDFParallelAction = self.makeAction("Generate PDF in Parallel", self.exportToPDFParallel, None, "Create a PDF using one background Lic process per CPU")
+        self.addActions(self.exportMenu, (self.exportToImagesAction, self.exportToPDFAction, None, 
+                                          self.exportToImagesParallelAction, self.exportToPDFParallelAction, None, self.exportToMPDAction))
 
     def zoom(self, factor):
         self.graphicsView.scaleView(factor)
         
+    def setUseLibraryReferences(self, useReferences):
+        self.useLibraryReferences = useReferences
+
+    def setParallelLayout(self, parallel):
+        LicBookLayout.PARALLEL_LAYOUT = parallel
+
     def setSnapToGuides(self, snap):
         self.snapToGuides = self.scene.snapToGuides = snap
 
@@ -670,11 +711,20 @@ class LicWindow(QMainWindow):
             
             # Need to explicitly disconnect this signal, because the scene emits a selectionChanged right before it's deleted
             self.disconnect(self.scene, SIGNAL("selectionChanged()"), self.scene.selectionChangedHandler)
+            self.autosave.clear()  # Clean exit, so no need to offer recovery next launch
             self.glWidget.doneCurrent()  # Avoid a crash when exiting
             event.accept()
         else:
             event.ignore()
 
+    def mergeIdenticalCallouts(self):
+        count = self.instructions.mainModel.mergeIdenticalCallouts()
+        self.statusBar().showMessage("Merged %d set(s) of identical Callouts" % count, 3000)
+
+    def mergeIdenticalSubmodels(self):
+        count = self.instructions.mainModel.mergeIdenticalSubmodels()
+        self.statusBar().showMessage("Merged %d set(s) of identical Submodels" % count, 3000)
+
     def fileClose(self, offerSave = True):
         if offerSave and not self.offerSave():
             return False
@@ -683,6 +733,7 @@ class LicWindow(QMainWindow):
         self.treeModel.reset()
         self.treeModel.root = None
         self.scene.clear()
+        self.autosave.clear()
         self.filename = LicConfig.filename = ""
         self.scene.emit(SIGNAL("layoutChanged()"))
         return True
@@ -720,6 +771,9 @@ class LicWindow(QMainWindow):
         progress = LicDialogs.LicProgressDialog(self, "Importing " + os.path.basename(filename))
         progress.setValue(2)  # Try and force dialog to show up right away
 
+        if not LicImportWorker.prefetchModelFiles(self, filename, progress):
+            return  # Cancelled while reading files: nothing has been imported yet
+
         loader = self.instructions.importModel(filename)
         try:
             progress.setMaximum(loader.next())  # First value yielded after load is # of progress steps
@@ -756,14 +810,8 @@ class LicWindow(QMainWindow):
             # Could not load default template, so load template stored in resource bundle
             template = LicBinaryReader.loadLicTemplate(":/default_template", self.instructions, FileVersion, MagicNumber)
         
-        template.filename = ""  # Do not preserve default template filename
-        progress.incr("Adding Part List Page")
-        self.instructions.template = template
-        self.instructions.mainModel.partListPages = LicCustomPages.PartListPage.createPartListPages(self.instructions)
-        template.applyFullTemplate(False)  # Template should apply to part list but not title pages
-
-        progress.incr("Adding Title Page")
-        self.instructions.mainModel.createNewTitlePage(False)
+        for label in self.instructions.addTemplate(template):
+            progress.incr(label)
 
         self.scene.emit(SIGNAL("layoutChanged()"))
         self.scene.selectPage(1)
@@ -822,6 +870,8 @@ class LicWindow(QMainWindow):
         self.fileCloseAction.setEnabled(enabled)
         self.fileSaveAction.setEnabled(enabled)
         self.fileSaveAsAction.setEnabled(enabled)
+        self.mergeCalloutsAction.setEnabled(enabled)
+        self.mergeSubmodelsAction.setEnabled(enabled)
         self.viewMenu.setEnabled(enabled)
         self.exportMenu.setEnabled(enabled)
         self.treeWidget.treeToolBar.setEnabled(enabled)
@@ -851,7 +901,7 @@ class LicWindow(QMainWindow):
             if os.path.isfile(tmpXName):
                 os.remove(tmpXName)
 
-            LicBinaryWriter.saveLicFile(tmpXName, self.instructions, FileVersion, MagicNumber)
+            LicBinaryWriter.saveLicFile(tmpXName, self.instructions, FileVersion, MagicNumber, self.useLibraryReferences)
 
             if os.path.isfile(tmpName):
                 os.remove(tmpName)
@@ -860,6 +910,7 @@ class LicWindow(QMainWindow):
             os.rename(tmpXName, self.filename)
 
             self.undoStack.setClean()
+            self.autosave.clear()
             self.addRecentFile(self.filename)
             self.statusBar().showMessage("Saved to: " + self.filename)
             return True
@@ -968,6 +1019,79 @@ class LicWindow(QMainWindow):
         self.glWidget.makeCurrent()
         self.statusBar().showMessage("Exported PDF to: " + filename)
                  
+    def getShardedExporter(self):
+        # Export workers load the book from disk, so make sure what's on disk is current
+        if (self.isWindowModified() or not self.filename) and not self.fileSave():
+            return None
+        if getattr(sys, 'frozen', False):
+            command = [sys.executable]
+        else:
+            command = [sys.executable, os.path.abspath(__file__)]
+        return LicParallelExport.ShardedExporter(self.instructions, self.filename, command)
+
+    def exportImagesParallel(self):
+        exporter = self.getShardedExporter()
+        if exporter is None:
+            return
+
+        progress = LicDialogs.LicProgressDialog(self, "Exporting Final Images")
+        progress.setValue(2)  # Try and force dialog to show up right away
+
+        loader = exporter.exportImages()
+        progress.setMaximum(loader.next() + 2)  # +2 because we're already at 2
+
+        try:
+            for label in loader:
+                if progress.wasCanceled():
+                    loader.close()
+                    self.statusBar().showMessage("Image Export aborted")
+                    return
+                if label is None:  # No page finished yet - keep the dialog responsive
+                    QCoreApplication.processEvents()
+                    continue
+                label = "Rendering " + os.path.splitext(os.path.basename(label))[0].replace('_', ' ')
+                progress.incr(label)
+        except IOError, e:
+            progress.cancel()
+            QMessageBox.warning(self, "Lic - Export Error", "Failed to export images: %s" % e)
+            return
+
+        self.glWidget.makeCurrent()
+        self.statusBar().showMessage("Exported images to: " + LicConfig.finalImageCachePath())
+
+    def exportToPDFParallel(self):
+        exporter = self.getShardedExporter()
+        if exporter is None:
+            return
+
+        loader = exporter.exportToPDF()
+        filename = loader.next()
+        title = "Exporting " + os.path.splitext(os.path.basename(filename))[0] + " to PDF"
+
+        progress = LicDialogs.LicProgressDialog(self, title)
+        progress.setValue(2)  # Try and force dialog to show up right away
+        progress.setMaximum(loader.next() + 2)  # +2 because we're already at 2
+
+        try:
+            for label in loader:
+                if progress.wasCanceled():
+                    loader.close()
+                    self.statusBar().showMessage("PDF Export aborted")
+                    return
+                if label is None:  # No page finished yet - keep the dialog responsive
+                    QCoreApplication.processEvents()
+                    continue
+                progress.incr(label)
+        except IOError, e:
+            progress.cancel()
+            QMessageBox.warning(self, "Lic - Export Error", "Failed to export PDF: %s" % e)
+            return
+
+        progress.setValue(progress.maximum())
+
+        self.glWidget.makeCurrent()
+        self.statusBar().showMessage("Exported PDF to: " + filename)
+
     def exportToMPD(self):
         f = self.filename if self.filename else self.instructions.getModelName()
         f = os.path.splitext(f)[0] + "_lic.mpd"
@@ -1010,6 +1134,8 @@ def real_main():
     if window.needPathConfiguration:
         window.configurePaths(True)
 
+    window.autosave.offerRecovery()
+
     # Load a particular file on Lic launch - handy for debugging
     filename = ""
     #filename = unicode("C:/lic/viper.mpd")
@@ -1071,6 +1197,23 @@ def profile_main():
 if __name__ == '__main__':
     #pylint --init-hook="import sys; sys.path.append('C:\\lic\\src')" --include-ids=y C:\lic\src\Lic.py > lic_pylint.txt
     #pylint --help-msg=W0401
+
+    multiprocessing.freeze_support()  # Frozen builds start LicBookLayout's workers through this same executable
     
+    if len(sys.argv) > 1 and sys.argv[1] == LicParallelExport.ShardFlag:
+        sys.exit(LicParallelExport.runExportShard(sys.argv[2:], FileVersion, MagicNumber))
+
+    if len(sys.argv) > 1 and sys.argv[1] == LicBenchmark.BenchmarkFlag:
+        sys.exit(LicBenchmark.runBenchmark(sys.argv[2:], FileVersion, MagicNumber))
+
+    if len(sys.argv) > 1 and sys.argv[1] == LicPackingBenchmark.PackBenchmarkFlag:
+        sys.exit(LicPackingBenchmark.runPackingBenchmark(sys.argv[2:], FileVersion, MagicNumber))
+
+    if len(sys.argv) > 1 and sys.argv[1] == LicModelGenerator.GenerateFlag:
+        sys.exit(LicModelGenerator.runGenerator(sys.argv[2:]))
+
+    if len(sys.argv) > 1 and sys.argv[1] == LicPerfHarness.PerfFlag:
+        sys.exit(LicPerfHarness.runHarness(sys.argv[2:], FileVersion, MagicNumber))
+
     real_main()
     #profile_main()
@@ -0,0 +1,161 @@
+"""
+    Lic - Instruction Book Creation software
+    Copyright (C) 2010 Remi Gagne
+
+    This file (LicAutoStep.py) is part of Lic.
+
+    Lic is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Lic is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/
+"""
+
+# Automatic steps for models imported without any.  Parts are sorted once, bottom layer first,
+# then swept layer by layer: each pass takes the next few parts off the front of what's left
+# and makes a Step of them.  Only reads Parts - returns which parts go in which Step, and
+# leaves creating Pages and Steps and moving the Parts into them to the caller.
+
+PARTS_PER_STEP_MAX = 5
+LAYER_TOP_TOLERANCE = 6.0     # Parts whose tops are this close sort as one layer - 6 to handle technic pins in holes
+LAYER_BOTTOM_TOLERANCE = 4.0  # Within a layer, parts whose bottoms are this close sort back to front, left to right
+LAYER_HEIGHT_TOLERANCE = 4.0  # Parts with the same bottom and heights this close can share a Step
+STACK_TOLERANCE = 4.0         # A part whose bottom is this close to the previous part's top is stacked on it
+DISPLACE_TOLERANCE = 2.0      # A stacked part this close to being right above the previous part gets an up displacement
+
+def sortParts(parts):
+    # Returns parts' indices in build order, and parts' bounding boxes.  Same order as sorting
+    # with LicHelpers.compareParts, but as precomputed keys, so the order is the same every time
+    boxes = [p.getPartBoundingBox() for p in parts]
+    keys = [None] * len(parts)
+
+    layers = []
+    top = None
+    for i in sorted(range(len(parts)), key = lambda i: -boxes[i].y1):
+        if top is None or abs(boxes[i].y1 - top) >= LAYER_TOP_TOLERANCE:
+            top = boxes[i].y1
+            layers.append([])
+        layers[-1].append(i)
+
+    order = []
+    for layer in layers:
+        layer.sort(key = lambda i: -boxes[i].y2)
+        band, bottom = 0, None
+        for i in layer:
+            if bottom is None or abs(boxes[i].y2 - bottom) >= LAYER_BOTTOM_TOLERANCE:
+                band, bottom = band + 1, boxes[i].y2
+            keys[i] = (band, -boxes[i].z1, boxes[i].x1)  # back to front, left to right
+        layer.sort(key = keys.__getitem__)
+        order += layer
+
+    return order, boxes
+
+def partitionSteps(parts, partsPerStepMax = None):
+    """
+    Split parts into Steps.  Returns ([[Part]], [Part]): the parts in each Step, in build order,
+    and the parts that should get an up displacement in their Step.
+    """
+
+    maxParts = partsPerStepMax or PARTS_PER_STEP_MAX
+    order, boxes = sortParts(parts)
+    parts = [parts[i] for i in order]
+    boxes = [boxes[i] for i in order]
+    count = len(parts)
+
+    # Parts are never re-sorted: allocated parts are just skipped.  nextFree[i] leads to
+    # the first part at or after i that is not yet in a Step, with count as the end marker
+    nextFree = range(count + 1)
+
+    def find(i):
+        root = i
+        while nextFree[root] != root:
+            root = nextFree[root]
+        while nextFree[i] != root:
+            nextFree[i], i = root, nextFree[i]
+        return root
+
+    def following(i):
+        i = find(i + 1)
+        return i if i < count else None
+
+    submodels = {}  # {submodel filename: [index]}, to put identical submodels in the same Step
+    for i, part in enumerate(parts):
+        if part.isSubmodel:
+            submodels.setdefault(part.filename, []).append(i)
+
+    steps, displaced = [], []
+    remaining = count
+    head = 0
+    while remaining:
+        head = find(head)
+        keep = [head]  # Indices of the parts that go in this Step
+        splitLayer = False
+
+        if remaining > 1:
+
+            # Advance forward until we find the next 'layer' of parts
+            bottom, height = boxes[head].y2, boxes[head].ySize()
+            i = following(head)
+            while i is not None and boxes[i].y2 == bottom and abs(height - boxes[i].ySize()) <= LAYER_HEIGHT_TOLERANCE:
+                keep.append(i)
+                i = following(i)
+
+            if len(keep) > maxParts:
+
+                # Have lots of parts in this layer: keep most popular part here, bump rest to next step
+                partCounts = {}
+                for i in keep:
+                    name = parts[i].abstractPart.name
+                    partCounts[name] = partCounts.get(name, 0) + 1
+                popularPartName = max(partCounts, key = partCounts.get)
+                keep = [i for i in keep if parts[i].abstractPart.name == popularPartName]
+                splitLayer = True
+
+            elif len(keep) == 1 and not parts[head].isSubmodel:
+
+                # Have only one part in this layer: search forward until we hit a layer with several parts
+                keep.append(following(head))
+                while abs(boxes[keep[-2]].y1 - boxes[keep[-1]].y2) <= STACK_TOLERANCE and \
+                      len(keep) < maxParts and len(keep) < remaining:
+                    keep.append(following(keep[-1]))
+
+                if len(keep) > 2:
+                    # Add an up displacement to last part, if it's basically above previous part
+                    p1, p2 = parts[keep[-2]], parts[keep[-1]]
+                    if abs(p1.x() - p2.x()) < DISPLACE_TOLERANCE and abs(p1.z() - p2.z()) < DISPLACE_TOLERANCE:
+                        displaced.append(p2)
+                else:
+                    keep.pop()
+
+            if len(keep) < remaining and not splitLayer:
+
+                # Want submodels to be inserted in their own Step, so split those off
+                partList = [i for i in keep if not parts[i].isSubmodel]
+                if partList and len(partList) != len(keep):
+                    keep = partList
+
+                # Want all identical submodels inserted in same step, so group them all
+                elif parts[head].isSubmodel:
+                    keep = [i for i in submodels[parts[head].filename] if find(i) == i]
+
+        if len(keep) >= remaining:
+            keep = []
+            i = find(head)
+            while i < count:
+                keep.append(i)
+                i = find(i + 1)
+
+        keep.sort()
+        steps.append([parts[i] for i in keep])
+        for i in keep:
+            nextFree[i] = i + 1
+        remaining -= len(keep)
+
+    return steps, displaced
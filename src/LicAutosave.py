@@ -0,0 +1,388 @@
+"""
+    Lic - Instruction Book Creation software
+    Copyright (C) 2010 Remi Gagne
+
+    This file (LicAutosave.py) is part of Lic.
+
+    Lic is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Lic is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/
+"""
+
+# Background autosave.  The model is serialized into in-memory sections on the UI thread,
+# then a helper thread compresses those and writes them to one of a few rotating recovery
+# files.  Between snapshots, each undo stack change is appended to a journal.
+#
+# Scene items can only be read on the UI thread, so serializing can't move to the helper thread.
+# Instead it runs a part or page at a time (LicBinaryWriter.iterSnapshot), in slices of at most
+# sliceTime between UI events.  If the model changes part way through, the half-built snapshot is
+# thrown away and started over.  Part geometry, the bulk of a book, is only encoded the first time
+# round; see LicBinaryWriter.geometryBlocks.  Compressing and writing stay on the helper thread,
+# and nothing ever waits on that thread.
+#
+# The journal is not replayed: undo commands hold live scene items, and can't be rebuilt from a
+# file.  A recovery loads the last snapshot, then lists the actions made after it, which are lost.
+#
+# Each running Lic keeps its recovery files in its own session folder, holding a lock on a file
+# in there for as long as it runs.  Only sessions whose lock is free - their Lic has exited or
+# crashed - are offered for recovery, so one Lic never recovers or deletes another's autosaves.
+
+import logging
+import shutil
+import threading
+import time
+import Queue
+
+from LicCommonImports import *
+
+import LicBinaryWriter
+import LicHelpers
+
+def recoveryPath():
+    return LicConfig.checkPath('Recovery', LicConfig.rootCachePath())
+
+def lockFile(fh):
+    # Take an exclusive lock on open file fh, without waiting.  Released when fh is closed or its process dies
+    try:
+        if sys.platform.startswith('win'):
+            import msvcrt
+            msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except IOError:
+        return False
+
+class RecoverySession(object):
+    """ One Lic instance's folder of recovery files, with the lock that shows its owner is still running. """
+
+    lockName = 'session.lock'
+
+    def __init__(self, path):
+        self.path = path
+        self.infoFile = os.path.join(path, 'autosave.info')
+        self.journalFile = os.path.join(path, 'autosave.journal')
+        self.lock = None
+
+    @staticmethod
+    def create():
+        # New session folder for this process, locked until the process exits
+        path = os.path.join(recoveryPath(), "%d_%d" % (os.getpid(), int(time.time())))
+        if not os.path.isdir(path):
+            os.mkdir(path)
+        session = RecoverySession(path)
+        session.acquire()
+        return session
+
+    @staticmethod
+    def findOrphans():
+        # Sessions whose owner is gone, locked by us now, newest first
+        sessions = []
+        root = recoveryPath()
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if os.path.isdir(path):
+                session = RecoverySession(path)
+                if session.acquire():
+                    sessions.append((os.path.getmtime(path), session))
+        sessions.sort(reverse = True)
+        return [session for unused, session in sessions]
+
+    def acquire(self):
+        try:
+            self.lock = open(os.path.join(self.path, self.lockName), 'a+')
+            self.lock.seek(0)  # Every process must lock the same byte
+        except IOError:
+            return False
+        if not lockFile(self.lock):
+            self.lock.close()
+            self.lock = None
+            return False
+        return True
+
+    def slotFilename(self, slot):
+        return os.path.join(self.path, 'autosave_%d.lic' % slot)
+
+    def remove(self):
+        # Delete an orphaned session's folder, lock file included
+        if self.lock is not None:
+            self.lock.close()
+            self.lock = None
+        shutil.rmtree(self.path, True)
+
+class AutosaveManager(QObject):
+
+    maxRecoveryFiles = 3
+    maxJournalLength = 25  # Snapshot early once this many actions have been journaled
+    pollInterval = 500     # How often (ms) to check on a running background write
+    sliceTime = 0.005      # Longest (s) to serialize for before letting the UI run again
+
+    def __init__(self, window, FileVersion, MagicNumber, interval = 5):
+        QObject.__init__(self, window)
+        self.window = window
+        self.FileVersion = FileVersion
+        self.MagicNumber = MagicNumber
+
+        self.session = RecoverySession.create()
+        self.infoFile = self.session.infoFile
+        self.journalFile = self.session.journalFile
+
+        self.snapshotter = None  # LicBinaryWriter.iterSnapshot generator, while a snapshot is being built
+        self.snapshotState = None  # (undo index, LicHelpers.modelVersion) the snapshot being built started from
+        self.worker = None
+        self.results = Queue.Queue()
+        self.lock = threading.Lock()  # Guards generation, and the recovery files the worker swaps in
+        self.generation = 0  # Bumped by clear(), so a write still running then throws its result away
+        self.nextSlot = 0
+        self.snapshotIndex = None  # Undo stack index captured by the last snapshot
+        self.journalLength = 0
+
+        self.timer = QTimer(self)
+        self.connect(self.timer, SIGNAL("timeout()"), self.autosave)
+        self.sliceTimer = QTimer(self)
+        self.connect(self.sliceTimer, SIGNAL("timeout()"), self.continueSnapshot)
+        self.pollTimer = QTimer(self)
+        self.connect(self.pollTimer, SIGNAL("timeout()"), self.checkWorker)
+        self.connect(window.undoStack, SIGNAL("indexChanged(int)"), self.journalCommand)
+        self.setInterval(interval)
+
+    def setInterval(self, minutes):
+        # An interval of 0 turns autosave off
+        self.interval = minutes
+        if minutes > 0:
+            self.timer.start(int(minutes * 60 * 1000))
+        else:
+            self.timer.stop()
+
+    def isDirty(self):
+        if self.window.instructions.mainModel is None or not self.window.isWindowModified():
+            return False
+        return self.snapshotIndex != self.window.undoStack.index()
+
+    def autosave(self):
+        if self.snapshotter is not None or self.worker is not None or not self.isDirty():
+            return
+
+        self.snapshotter = LicBinaryWriter.iterSnapshot(self.window.instructions, self.window.useLibraryReferences)
+        self.snapshotState = (self.window.undoStack.index(), LicHelpers.modelVersion)
+        self.sliceTimer.start(0)
+
+    def stopSnapshot(self):
+        self.sliceTimer.stop()
+        self.snapshotter = self.snapshotState = None
+
+    def continueSnapshot(self):
+        # Runs from sliceTimer: serialize for up to sliceTime, then let the UI catch up
+        if self.snapshotState != (self.window.undoStack.index(), LicHelpers.modelVersion):
+            self.stopSnapshot()  # Model changed under the snapshot: start again from scratch
+            self.autosave()
+            return
+
+        deadline = time.time() + self.sliceTime
+        try:
+            for snapshot in self.snapshotter:
+                if snapshot is not None:
+                    self.stopSnapshot()
+                    self.startWriter(snapshot)
+                    return
+                if time.time() > deadline:
+                    return
+        except Exception, e:
+            logging.warning("Autosave failed: %s", e)
+        self.stopSnapshot()
+
+    def startWriter(self, snapshot):
+        self.snapshotIndex = self.window.undoStack.index()
+        self.writeJournal("S", self.snapshotIndex)  # Actions after this line are not in the snapshot
+        self.journalLength = 0
+
+        filename = self.session.slotFilename(self.nextSlot)
+        self.nextSlot = (self.nextSlot + 1) % self.maxRecoveryFiles
+
+        args = (filename, snapshot, self.window.filename, self.snapshotIndex, self.generation)
+        self.worker = threading.Thread(target = self.writeSnapshot, args = args)
+        self.worker.setDaemon(True)
+        self.worker.start()
+        self.pollTimer.start(self.pollInterval)
+
+    def writeSnapshot(self, filename, snapshot, originalFilename, undoIndex, generation):
+        # Runs on the helper thread: compress, write to a temp file, then swap it in
+        try:
+            tmpName = filename + ".x"
+            LicBinaryWriter.writeSnapshot(tmpName, snapshot, self.FileVersion, self.MagicNumber)
+
+            self.lock.acquire()
+            try:
+                if generation != self.generation:  # File was saved or closed meanwhile: nothing to recover
+                    os.remove(tmpName)
+                else:
+                    if os.path.isfile(filename):
+                        os.remove(filename)
+                    os.rename(tmpName, filename)
+                    self.writeInfo(filename, originalFilename, undoIndex)
+            finally:
+                self.lock.release()
+            self.results.put((generation, None))
+        except (IOError, OSError), e:
+            self.results.put((generation, e))
+
+    def writeInfo(self, filename, originalFilename, undoIndex):
+        f = open(self.infoFile, 'w')
+        f.write("%s\n%s\n%d\n" % (os.path.basename(filename), unicode(originalFilename).encode('utf-8'), undoIndex))
+        f.close()
+
+    def checkWorker(self):
+        try:
+            generation, error = self.results.get_nowait()
+        except Queue.Empty:
+            return
+
+        # Only one write runs at a time, so this is the current worker finishing
+        self.pollTimer.stop()
+        self.worker = None
+        if generation != self.generation:
+            return  # Result of a write that clear() has since cancelled
+
+        if error is None:
+            self.window.statusBar().showMessage("Autosaved", 2000)
+        else:
+            logging.warning("Autosave failed: %s", error)
+            self.snapshotIndex = None  # Try again next time round
+
+    def journalCommand(self, index):
+        if self.window.instructions.mainModel is None:
+            return
+
+        stack = self.window.undoStack
+        if index > 0 and index <= stack.count():
+            text = stack.text(index - 1)
+        else:
+            text = ""
+
+        self.writeJournal("A", index, text)
+        self.journalLength += 1
+        if self.journalLength >= self.maxJournalLength:
+            self.autosave()
+
+    def writeJournal(self, kind, index, text = ""):
+        f = open(self.journalFile, 'a')
+        f.write("%s\t%d\t%d\t%s\n" % (kind, time.time(), index, unicode(text).encode('utf-8')))
+        f.close()
+
+    def resetJournal(self):
+        if os.path.isfile(self.journalFile):
+            os.remove(self.journalFile)
+        self.journalLength = 0
+
+    def clear(self):
+        # Called whenever the user saves or closes their file: nothing left to recover.
+        # Doesn't wait for a running write; that write sees the new generation and discards itself.
+        # Until checkWorker sees it finish, self.worker stays set, so no second write starts alongside it
+        self.stopSnapshot()
+        self.lock.acquire()
+        try:
+            self.generation += 1
+            self.snapshotIndex = None
+            self.resetJournal()
+            for name in [self.infoFile] + [self.session.slotFilename(i) for i in range(self.maxRecoveryFiles)]:
+                if os.path.isfile(name):
+                    os.remove(name)
+        finally:
+            self.lock.release()
+
+    def readRecoveryInfo(self, session):
+        # Returns (recovery filename, original filename, undo index), or None if session has nothing to recover
+        if not os.path.isfile(session.infoFile):
+            return None
+        try:
+            f = open(session.infoFile, 'r')
+            filename, originalFilename, undoIndex = [line.rstrip('\n') for line in f.readlines()[:3]]
+            f.close()
+            filename = os.path.join(session.path, filename)
+            if not os.path.isfile(filename):
+                return None
+            return filename, originalFilename.decode('utf-8'), int(undoIndex)
+        except (IOError, ValueError):
+            return None
+
+    def readJournal(self, session, undoIndex):
+        # Returns the text of each action taken after the snapshot at undoIndex, in order
+        if not os.path.isfile(session.journalFile):
+            return []
+
+        actions = None  # Stays None until we reach the line marking this snapshot
+        f = open(session.journalFile, 'r')
+        for line in f:
+            try:
+                kind, unused, index, text = line.rstrip('\n').split('\t', 3)
+                index = int(index)
+            except ValueError:
+                continue  # Partially written last line
+            if kind == "S":
+                if index == undoIndex:
+                    actions, lastIndex = [], index
+            elif actions is not None:
+                actions.append(text.decode('utf-8') if index > lastIndex else "Undo")
+                lastIndex = index
+        f.close()
+        return actions if actions else []
+
+    def offerRecovery(self):
+        # Offer each session left behind by a Lic that's no longer running, newest first, until one is recovered
+        orphans = RecoverySession.findOrphans()
+        while orphans:
+            session = orphans.pop(0)
+            info = self.readRecoveryInfo(session)
+            if info is None:
+                session.remove()  # Exited cleanly, or crashed before its first autosave
+                continue
+
+            filename, originalFilename, undoIndex = info
+            name = os.path.basename(originalFilename) if originalFilename else "an unsaved model"
+            s = "Lic did not shut down cleanly.  Recover the autosaved copy of %s?" % name
+            if QMessageBox.question(self.window, "Lic - Recover File", s, QMessageBox.Yes | QMessageBox.No) == QMessageBox.No:
+                session.remove()
+                continue
+
+            self.recover(session, filename, originalFilename, undoIndex)
+            for other in orphans:  # Leave the rest for the next launch, and for other Lics to offer
+                other.lock.close()
+            return True
+        return False
+
+    def recover(self, session, filename, originalFilename, undoIndex):
+        lostActions = self.readJournal(session, undoIndex)
+        self.window.loadLicFile(filename)
+        self.window.recentFiles.removeAll(QString(filename))  # Don't list the recovery file itself
+        self.window.filename = originalFilename
+        self.window.setWindowModified(True)
+        if not originalFilename:
+            self.window.enableMenus(True)
+
+        # Adopt the recovered file as this session's latest autosave, so it stays recoverable until the next one
+        try:
+            adopted = self.session.slotFilename(0)
+            os.rename(filename, adopted)
+            self.snapshotIndex = self.window.undoStack.index()
+            self.nextSlot = 1
+            self.writeJournal("S", self.snapshotIndex)
+            self.writeInfo(adopted, originalFilename, self.snapshotIndex)
+            session.remove()
+        except (IOError, OSError), e:
+            logging.warning("Could not adopt recovery file %s: %s", filename, e)
+            session.lock.close()  # Leave it where it is
+
+        if lostActions:
+            s = "The last %d action(s) were made after the last autosave, and could not be recovered:\n\n" % len(lostActions)
+            QMessageBox.information(self.window, "Lic - Recover File", s + "\n".join(lostActions[-20:]))
+        return True
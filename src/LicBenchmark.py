@@ -0,0 +1,325 @@
+"""
+    Lic - Instruction Book Creation software
+    Copyright (C) 2010 Remi Gagne
+
+    This file (LicBenchmark.py) is part of Lic.
+
+    Lic is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Lic is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/
+"""
+
+# Save / load benchmark and round trip check.  Builds a synthetic instruction book
+# of the requested size with LicModelGenerator (and / or loads existing .lic files), then
+# saves and reloads each through LicBinaryWriter and LicBinaryReader.  Reports timings,
+# throughput, peak memory and file size, and fails if any reloaded book differs from the
+# one that was saved.
+#
+# LicBinaryWriter only writes the current format version, so readers of older versions are
+# only covered by existing files: pass older .lic files to time them.  Lic's own default
+# template is still in an older format, so its load time is reported with the synthetic book.
+#
+# No window is shown, but part and CSI dimensions are measured with OpenGL, which needs a
+# display to create its context on.  On a machine without one, run under a virtual X server.
+#
+# Run with:  python Lic.py --benchmark [options] [file.lic | folder ...]
+# or:        xvfb-run -a python Lic.py --benchmark [options] [file.lic | folder ...]
+
+import optparse
+import shutil
+import tempfile
+import time
+
+from LicCommonImports import *
+
+import LicModelGenerator
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows: peak memory is just not reported
+
+BenchmarkFlag = "--benchmark"
+DefaultTemplate = ":/default_template"
+
+def peakMemory():
+    # Peak resident memory of this process so far, in MB, or None if unknown
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform.startswith('darwin') else peak / 1024.0
+
+def fileVersion(filename):
+    # Format version of a .lic or .lit file, from its header
+    fh = QFile(filename)
+    if not fh.open(QIODevice.ReadOnly):
+        return "-"
+    stream = QDataStream(fh)
+    stream.setVersion(QDataStream.Qt_4_3)
+    stream.readInt32()  # Magic number
+    version = stream.readInt16()
+    fh.close()
+    return version
+
+def createInstructions(glWidget):
+    import LicGraphicsWidget
+    import LicInstructions
+
+    scene = LicGraphicsWidget.LicGraphicsScene(None)
+    scene.undoStack = QUndoStack()
+    return LicInstructions.Instructions(None, scene, glWidget)
+
+def importSyntheticBook(instructions, filename, FileVersion, MagicNumber):
+    # The same steps LicWindow.importModel takes, minus the UI
+    import LicBinaryReader
+
+    for unused in instructions.importModel(filename):
+        pass
+
+    template = LicBinaryReader.loadLicTemplate(DefaultTemplate, instructions, FileVersion, MagicNumber)
+    for unused in instructions.addTemplate(template):
+        pass
+
+def addCallouts(instructions, count):
+    # Move the first part of each of the first count multi-part steps into a new callout
+    added = 0
+    for page in instructions.mainModel.getFullPageList():
+        for step in [s for s in page.steps if len(s.csi.getPartList()) > 1]:
+            if added >= count:
+                return
+            callout = step.addBlankCalloutSignal(False, False)
+            callout.addPart(step.csi.getPartList()[0])
+            added += 1
+
+def addAnnotations(instructions, count):
+    # Spread count annotations over the book's pages, using just a few distinct images
+    import LicCustomPages
+
+    pages = instructions.mainModel.getFullPageList()
+    colors = [Qt.red, Qt.green, Qt.blue]
+    for i in range(count):
+        page = pages[i % len(pages)]
+        pixmap = QPixmap(64, 64)
+        pixmap.fill(QColor(colors[i % len(colors)]))
+        annotation = LicCustomPages.PageAnnotation(page, pixmap, "bench_logo_%d.png" % (i % len(colors)), QPointF(20, 20 + 70 * (i // len(pages))))
+        page.annotations.append(annotation)
+        page.addChild(len(page.children), annotation)
+
+def bookSignature(instructions):
+    # Everything a save / load round trip must preserve, as nested tuples, so books can be compared with ==
+
+    def colorCode(color):
+        return color.ldrawCode if color else None
+
+    def partSignature(part):
+        return (part.filename, colorCode(part.color), tuple([round(x, 3) for x in part.matrix]), part.inverted)
+
+    def stepSignature(step):
+        pli = None
+        if step.pli:
+            pli = sorted([(i.abstractPart.filename, colorCode(i.color), i.quantity) for i in step.pli.pliItems])
+        return (step.number, sorted([partSignature(p) for p in step.csi.getPartList()]), pli,
+                [(c.number, [stepSignature(s) for s in c.steps]) for c in step.callouts])
+
+    def pageSignature(page):
+        annotations = [(a.filename, round(a.pos().x(), 2), round(a.pos().y(), 2), a.getImageData()[0]) for a in page.annotations]
+        return (page.number, page._row, [stepSignature(s) for s in page.steps], annotations)
+
+    def modelSignature(model):
+        return (model.filename, [pageSignature(p) for p in model.pages], [modelSignature(m) for m in model.submodels])
+
+    mainModel = instructions.mainModel
+    parts = sorted([(name, len(p.primitives), len(p.edges), len(p.parts)) for name, p in instructions.partDictionary.items()])
+    return (parts, modelSignature(mainModel), len(mainModel.partListPages), mainModel.hasTitlePage())
+
+class Result(object):
+
+    def __init__(self, name, partCount):
+        self.name = name
+        self.partCount = partCount
+        self.rows = []  # [(phase, format version, best seconds, mean seconds, file size, peak memory)]
+        self.errors = []
+
+    def add(self, phase, version, times, size):
+        self.rows.append((phase, version, min(times), sum(times) / len(times), size, peakMemory()))
+
+    def report(self):
+        print "\n%s (%d parts)" % (self.name, self.partCount)
+        print "  %-22s %4s %9s %9s %11s %9s %9s %9s" % ("Phase", "Ver", "Best (s)", "Mean (s)", "Parts / s", "Size (KB)", "MB / s", "Peak (MB)")
+        for phase, version, best, mean, size, peak in self.rows:
+            partRate = self.partCount / best if best else 0.0
+            sizeRate = (size / (1024.0 * 1024.0)) / best if best and size else 0.0
+            print "  %-22s %4s %9.3f %9.3f %11.0f %9s %9s %9s" % (phase, version, best, mean, partRate,
+                                                           "%.1f" % (size / 1024.0) if size else "-",
+                                                           "%.2f" % sizeRate if size else "-",
+                                                           "%.0f" % peak if peak is not None else "-")
+        for error in self.errors:
+            print "  FAILED: " + error
+
+def roundTrip(result, instructions, workDir, repeat, glWidget, FileVersion, MagicNumber):
+    import LicBinaryReader
+    import LicBinaryWriter
+
+    expected = bookSignature(instructions)
+
+    for mode, useLibraryReferences in [("embedded parts", False), ("library references", True)]:
+        filename = os.path.join(workDir, "roundtrip.lic")
+
+        times = []
+        for unused in range(repeat):
+            start = time.time()
+            LicBinaryWriter.saveLicFile(filename, instructions, FileVersion, MagicNumber, useLibraryReferences)
+            times.append(time.time() - start)
+        result.add("save, " + mode, FileVersion, times, os.path.getsize(filename))
+
+        times = []
+        for unused in range(repeat):
+            loaded = createInstructions(glWidget)
+            LicConfig.filename = filename
+            start = time.time()
+            for unused in LicBinaryReader.loadLicFile(filename, loaded, FileVersion, MagicNumber):
+                pass
+            times.append(time.time() - start)
+        result.add("load, " + mode, FileVersion, times, os.path.getsize(filename))
+
+        if bookSignature(loaded) != expected:
+            result.errors.append("book loaded from %s does not match the book saved" % mode)
+
+def loadOldTemplate(result, instructions, repeat, FileVersion, MagicNumber):
+    # Time the default template, as the one older format file that's always around
+    import LicBinaryReader
+
+    times = []
+    for unused in range(repeat):
+        start = time.time()
+        LicBinaryReader.loadLicTemplate(DefaultTemplate, instructions, FileVersion, MagicNumber)
+        times.append(time.time() - start)
+    result.add("load default template", fileVersion(DefaultTemplate), times, None)
+
+def benchmarkSyntheticBook(options, workDir, glWidget, FileVersion, MagicNumber):
+    libraryDir = os.path.join(workDir, "LDraw")
+    os.mkdir(libraryDir)
+    LicModelGenerator.writeStandInLibrary(libraryDir)
+    setLDrawPath(libraryDir)
+
+    modelFilename = os.path.join(workDir, "synthetic.mpd")
+    LicModelGenerator.writeModel(modelFilename, partCount = options.parts, depth = 1 if options.submodels else 0,
+                                 branching = options.submodels, partsPerStep = max(1, options.parts // max(1, options.steps)))
+
+    instructions = createInstructions(glWidget)
+    LicConfig.filename = modelFilename
+    start = time.time()
+    importSyntheticBook(instructions, modelFilename, FileVersion, MagicNumber)
+    importTime = time.time() - start
+
+    addCallouts(instructions, options.callouts)
+    addAnnotations(instructions, options.annotations)
+
+    name = "Synthetic book: %d steps, %d submodels, %d callouts, %d annotations" % (options.steps, options.submodels, options.callouts, options.annotations)
+    result = Result(name, len(instructions.mainModel.getFullPartList()))
+    result.add("import", "-", [importTime], None)
+    roundTrip(result, instructions, workDir, options.repeat, glWidget, FileVersion, MagicNumber)
+    loadOldTemplate(result, instructions, options.repeat, FileVersion, MagicNumber)
+    return result
+
+def benchmarkLicFile(filename, options, workDir, glWidget, FileVersion, MagicNumber):
+    import LicBinaryReader
+
+    instructions = createInstructions(glWidget)
+    LicConfig.filename = filename
+    start = time.time()
+    for unused in LicBinaryReader.loadLicFile(filename, instructions, FileVersion, MagicNumber):
+        pass
+    loadTime = time.time() - start
+
+    result = Result(filename, len(instructions.mainModel.getFullPartList()))
+    result.add("load original", instructions.licFileVersion, [loadTime], os.path.getsize(filename))
+    roundTrip(result, instructions, workDir, options.repeat, glWidget, FileVersion, MagicNumber)
+    return result
+
+def findLicFiles(paths):
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, unused, files in os.walk(path):
+                filenames += [os.path.join(root, f) for f in sorted(files) if f.endswith('.lic')]
+        else:
+            filenames.append(path)
+    return filenames
+
+def savedLDrawPath():
+    # LDraw path from Lic's own settings, needed to load files that store parts as library references
+    settings = QSettings(QString(os.path.join(os.path.dirname(sys.argv[0]), 'Lic.ini')), QSettings.IniFormat)
+    return str(settings.value("LDrawPath").toString()) or LicConfig.LDrawPath
+
+def setLDrawPath(path):
+    import LicImporters
+    LicConfig.LDrawPath = LicImporters.LDrawImporter.LDrawPath = path
+
+def createGLWidget(flag):
+    # QApplication and a current GL context, for the benchmarks.  (None, None) if there's no display to create them on
+    if os.name == 'posix' and sys.platform != 'darwin' and not os.environ.get('DISPLAY'):
+        print "No X display found.  OpenGL needs one, so run under a virtual X server:"
+        print "    xvfb-run -a python %s %s ..." % (sys.argv[0], flag)
+        return None, None
+
+    app = QApplication(sys.argv)
+    glWidget = QGLWidget(LicGLHelpers.getGLFormat())
+    glWidget.makeCurrent()
+    return app, glWidget
+
+def runBenchmark(args, FileVersion, MagicNumber):
+
+    parser = optparse.OptionParser(usage = "python Lic.py %s [options] [file.lic | folder ...]" % BenchmarkFlag)
+    parser.add_option("--parts", type = "int", default = 500, help = "parts in the synthetic book [%default]")
+    parser.add_option("--steps", type = "int", default = 60, help = "steps in the synthetic book [%default]")
+    parser.add_option("--submodels", type = "int", default = 4, help = "submodels in the synthetic book [%default]")
+    parser.add_option("--callouts", type = "int", default = 5, help = "callouts in the synthetic book [%default]")
+    parser.add_option("--annotations", type = "int", default = 20, help = "annotations in the synthetic book [%default]")
+    parser.add_option("--repeat", type = "int", default = 3, help = "times to repeat each save and load [%default]")
+    parser.add_option("--no-synthetic", action = "store_false", dest = "synthetic", default = True, help = "only benchmark the given .lic files")
+    parser.add_option("--ldraw", default = savedLDrawPath(), help = "LDraw library, for loading .lic files [%default]")
+    parser.add_option("--keep", action = "store_true", default = False, help = "keep the generated files")
+    options, paths = parser.parse_args(args)
+
+    app, glWidget = createGLWidget(BenchmarkFlag)
+    if glWidget is None:
+        return 1
+
+    workDir = tempfile.mkdtemp(prefix = "lic_benchmark_")
+    results = []
+    try:
+        if options.synthetic:
+            results.append(benchmarkSyntheticBook(options, workDir, glWidget, FileVersion, MagicNumber))
+
+        setLDrawPath(options.ldraw)
+        for filename in findLicFiles(paths):
+            try:
+                results.append(benchmarkLicFile(filename, options, workDir, glWidget, FileVersion, MagicNumber))
+            except IOError, e:
+                result = Result(filename, 0)
+                result.errors.append(str(e))
+                results.append(result)
+    finally:
+        if options.keep:
+            print "Generated files kept in " + workDir
+        else:
+            shutil.rmtree(workDir, True)
+
+    for result in results:
+        result.report()
+
+    failures = len([r for r in results if r.errors])
+    print "\n%d book(s) checked, %d failed" % (len(results), failures)
+
+    del app
+    return 1 if failures else 0
@@ -19,12 +19,16 @@
 """
 
 import logging
+import mmap
+from array import array
 
 from LicCommonImports import *
 
 from LicModel import *
 import LicTemplate
 import LicCustomPages
+import LicPartCache
+import LicPacking
 
 def ro(targetType):
     def tmp(self):
@@ -52,6 +56,172 @@ QDataStream.readQSize = ro(QSize)
 # Having these global here avoids having to pass them as arguments to every single method in here
 partDict = {}
 colorDict = None
+pendingPages = []  # Pages read in but not yet added to the scene
+mappedFiles = []  # LazyGeometryFile instances still holding their file open
+
+class GeometryIndex(object):
+    """
+    Table of where each part's geometry lies, as written by LicBinaryWriter.GeometryTable.
+    Parts are read before this table, so each looks itself up in here only on first use.
+    """
+
+    def __init__(self):
+        self.entries = {}  # {part filename: (offset, length)}
+        self.source = None
+        self.dataStart = 0
+        self.pending = 0  # Number of parts that have not yet read their geometry
+
+    def readIndex(self, stream):
+        for unused in range(stream.readInt32()):
+            filename = str(stream.readQString())
+            self.entries[filename] = (stream.readUInt32(), stream.readUInt32())
+
+    def setSource(self, source, dataStart = 0):
+        self.source = source
+        self.dataStart = dataStart
+
+    def read(self, filename):
+        offset, length = self.entries[filename]
+        data = self.source.read(self.dataStart + offset, length)
+        self.pending -= 1
+        if self.pending < 1:
+            self.source.close()  # Everything's loaded - let go of the data
+        return data
+
+class LazyGeometryBuffer(object):
+    """ Holds on to part geometry in memory, until read out of it on demand.  Compressed data is only expanded on first read. """
+
+    def __init__(self, data, compressed = False):
+        self.data = data
+        self.compressed = compressed
+
+    def read(self, offset, length):
+        if self.compressed:
+            self.data = qUncompress(self.data)
+            self.compressed = False
+        return self.data.mid(offset, length)
+
+    def close(self):
+        self.data = None
+
+class LicSectionTable(object):
+    """ Reads the section table of a sectioned .lic file, and opens individual sections on demand. """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.sections = {}
+        for unused in range(stream.readInt32()):
+            name = str(stream.readQString())
+            self.sections[name] = (stream.readInt32(), stream.readInt32())
+        self.dataStart = stream.device().pos()
+        self.annotationPixmaps = None
+        self.annotationImages = None
+        self.geometryIndex = None
+
+    def readRaw(self, name):
+        # Named section, still compressed
+        offset, length = self.sections[name]
+        self.stream.device().seek(self.dataStart + offset)
+        return QByteArray(self.stream.readRawData(length))
+
+    def open(self, name, shareSections = True):
+        data = qUncompress(self.readRaw(name))
+
+        stream = QDataStream(data)
+        stream.setVersion(QDataStream.Qt_4_3)
+        stream.licFileVersion = self.stream.licFileVersion
+        stream.data = data  # Keep the buffer alive as long as the stream
+        if shareSections:
+            stream.sections = self
+            stream.geometry = self.getGeometryIndex()
+            if stream.licFileVersion >= 28:
+                stream.annotationImages = self.getAnnotationImages()
+            else:
+                stream.annotationPixmaps = self.getAnnotationPixmaps()
+        return stream
+
+    def getGeometryIndex(self):
+        if self.geometryIndex is None:
+            self.geometryIndex = GeometryIndex()
+            self.geometryIndex.readIndex(self.open('geometry index', False))
+            self.geometryIndex.setSource(LazyGeometryBuffer(self.readRaw('geometry'), True))
+        return self.geometryIndex
+
+    def getAnnotationPixmaps(self):
+        if self.annotationPixmaps is None:
+            stream = self.open('annotations', False)
+            self.annotationPixmaps = [stream.readQPixmap() for unused in range(stream.readInt32())]
+        return self.annotationPixmaps
+
+    def getAnnotationImages(self):
+        if self.annotationImages is None:
+            self.annotationImages = AnnotationImageStore(self.open('annotations', False))
+        return self.annotationImages
+
+class AnnotationImageStore(object):
+    """
+    Annotation images from one .lic file, keyed by content hash.  Images stay
+    as PNG data until first needed, then one pixmap is shared by every annotation using it.
+    """
+
+    def __init__(self, stream):
+        self.images = {}
+        self.sizes = {}
+        self.pixmaps = {}
+        for unused in range(stream.readInt32()):
+            key = str(stream.readQString())
+            data = QByteArray()
+            stream >> data
+            self.images[key] = data
+
+    def getData(self, key):
+        return self.images[key]
+
+    def getSize(self, key):
+        if key not in self.sizes:
+            buffer = QBuffer(self.images[key])
+            buffer.open(QIODevice.ReadOnly)
+            self.sizes[key] = QImageReader(buffer, "PNG").size()  # Reads just the image header
+        return self.sizes[key]
+
+    def getPixmap(self, key):
+        if key not in self.pixmaps:
+            pixmap = QPixmap()
+            pixmap.loadFromData(self.images[key], "PNG")
+            self.pixmaps[key] = pixmap
+        return self.pixmaps[key]
+
+class LazyGeometryFile(object):
+    """ Memory maps a .lic file so part geometry can be read out of it on demand, after loading is done. """
+
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+        self.fh = open(filename, 'rb')
+        self.data = mmap.mmap(self.fh.fileno(), 0, access = mmap.ACCESS_READ)
+        mappedFiles.append(self)
+
+    def read(self, offset, length):
+        return self.data[offset:offset + length]
+
+    def close(self):
+        if self.fh is not None:
+            self.data.close()
+            self.fh.close()
+            self.fh = None
+            mappedFiles.remove(self)
+        self.data = None
+
+    def detach(self):
+        # Copy the rest of the file into memory and unmap it, so the file itself can be overwritten
+        if self.fh is not None:
+            data = self.data[:]
+            self.close()
+            self.data = data
+
+def releaseMappedFile(filename):
+    # Must be called before filename is overwritten: truncating a file that's still mapped crashes any later read
+    for source in [s for s in mappedFiles if s.filename == os.path.abspath(filename)]:
+        source.detach()
 
 def loadLicFile(filename, instructions, FileVersion, MagicNumber):
     
@@ -62,7 +232,13 @@ def loadLicFile(filename, instructions, FileVersion, MagicNumber):
     else:
         yield 500  # Some entirely arbitrary, made up sky number, for older files
 
-    template = __readTemplate(stream, instructions)
+    if stream.licFileVersion >= 27:
+        stream.sections = LicSectionTable(stream)
+        template = __readTemplate(stream.sections.open('template', False), instructions)
+    else:
+        template = __readTemplate(stream, instructions)
+        if not filename.startswith(':'):
+            stream.mappedFile = filename  # Leave the book's geometry in the file, until needed
     yield
 
     for unused in __readInstructions(stream, instructions):
@@ -82,6 +258,8 @@ def loadLicFile(filename, instructions, FileVersion, MagicNumber):
 def loadLicTemplate(filename, instructions, FileVersion, MagicNumber):
 
     fh, stream = __createStream(filename, FileVersion, MagicNumber, True)
+    if stream.licFileVersion >= 27:
+        stream = LicSectionTable(stream).open('template', False)
     template = __readTemplate(stream, instructions)
     if fh is not None:
         fh.close()
@@ -95,6 +273,12 @@ def loadLicTemplateSettings(filename, instructions, FileVersion, MagicNumber):
     if fh is not None:
         fh.close()
 
+def __nextSection(stream, name):
+    # Switch to reading the named section, if this stream is part of a sectioned file.
+    if hasattr(stream, 'sections'):
+        return stream.sections.open(name)
+    return stream
+
 def __createStream(filename, FileVersion, MagicNumber, template = False):
 
     fh = QFile(filename)
@@ -123,16 +307,29 @@ def __readTemplate(stream, instructions):
     if stream.licFileVersion >= 16:
         LicTemplate.TemplatePLI.includeSubmodels = stream.readBool()
 
+    if stream.licFileVersion >= 29:
+        PLI.packingMethod = str(stream.readQString())
+        LicCustomPages.PartListPLI.packingMethod = str(stream.readQString())
+    else:
+        PLI.packingMethod = LicPacking.Rows
+        LicCustomPages.PartListPLI.packingMethod = LicPacking.Columns
+
     # Read in the entire abstractPart dictionary
-    global partDict, colorDict
+    global partDict, colorDict, pendingPages
     colorDict = instructions.colorDict
     partDict = {}
+    pendingPages = []
+    stream.geometry = GeometryIndex()
     for unused in __readPartDictionary(stream, instructions):
         pass
 
     submodelPart = __readSubmodel(stream, None)
+    if stream.licFileVersion >= 25:
+        __readGeometryTable(stream)
+
     template = __readPage(stream, instructions.mainModel, instructions, submodelPart)
     template.submodelPart = submodelPart
+    __addPendingPages(instructions.scene)
 
     if stream.licFileVersion >= 12:
         class T(object):
@@ -185,10 +382,15 @@ def __readStaticInfo(stream, instructions, page, csi, pli, smp):
 
 def __readInstructions(stream, instructions):
 
-    global partDict, colorDict
+    global partDict, colorDict, pendingPages
     partDict = instructions.partDictionary
     colorDict = instructions.colorDict
+    pendingPages = []
+
+    if not hasattr(stream, 'sections'):
+        stream.geometry = GeometryIndex()  # Read in after the main model
 
+    stream = __nextSection(stream, 'parts')
     filename = str(stream.readQString())
     instructions.filename = filename
 
@@ -202,7 +404,10 @@ def __readInstructions(stream, instructions):
             model = __readSubmodel(stream, instructions)
             partDict[model.filename] = model
 
+    stream = __nextSection(stream, 'pages')
     instructions.mainModel = __readSubmodel(stream, instructions, True)
+    if stream.licFileVersion >= 25 and not hasattr(stream, 'sections'):
+        __readGeometryTable(stream)
 
     instructions.mainModel.titlePage = __readTitlePage(stream, instructions)
     if instructions.mainModel.titlePage is not None:
@@ -212,10 +417,19 @@ def __readInstructions(stream, instructions):
         newPage = __readPartListPage(stream, instructions)
         instructions.mainModel.partListPages.append(newPage)
 
+    stream = __nextSection(stream, 'guides')
     for unused in range(stream.readInt32()):
         instructions.scene.addGuide(stream.readInt32(), stream.readQPointF())
 
     __linkModelPartNames(instructions.mainModel)
+    __addPendingPages(instructions.scene)  # Only now that every part has been placed in its CSI
+    LicHelpers.notifyModelChanged()
+
+    # Parts with lazy geometry get display list IDs now, but are only compiled when first drawn
+    instructions.glContext.makeCurrent()
+    for abstractPart in partDict.values():
+        if abstractPart.geometryLoader and not abstractPart.isSubmodel:
+            abstractPart.reserveGLDisplayList()
 
     for submodel in [p for p in partDict.values() if p.isSubmodel]:
         if submodel._parent == "":
@@ -232,6 +446,12 @@ def __readInstructions(stream, instructions):
         item = instructions.mainModel.titlePage.submodelItem
         item.abstractPart.createGLDisplayList(False)
 
+def __addPendingPages(scene):
+    global pendingPages
+    for page in pendingPages:
+        scene.addItem(page)
+    pendingPages = []
+
 def __readSubmodel(stream, instructions, createMainmodel = False):
 
     submodel = __readAbstractPart(stream, True, createMainmodel)
@@ -284,6 +504,7 @@ def __readPartDictionary(stream, instructions):
         yield
 
     if stream.licFileVersion >= 6:
+        stream = __nextSection(stream, 'submodels')
         for unused in range(stream.readInt32()):
             abstractPart = __readSubmodel(stream, instructions)
             partDict[abstractPart.filename] = abstractPart
@@ -293,6 +514,8 @@ def __readPartDictionary(stream, instructions):
     # not yet have valid AbstractParts of their own.  Create those now.
     for abstractPart in partDict.values():
         for part in abstractPart.parts:
+            if part.filename not in partDict:  # Library part changed since save, and now uses a new sub-part
+                partDict[part.filename] = instructions.getAbstractPart(part.filename)
             part.abstractPart = partDict[part.filename]
 
 def __readAbstractPart(stream, createSubmodel = False, createMainmodel = False):
@@ -317,15 +540,85 @@ def __readAbstractPart(stream, createSubmodel = False, createMainmodel = False):
     part.pliScale = stream.readFloat()
     part.pliRotation = [stream.readFloat(), stream.readFloat(), stream.readFloat()]
 
-    for unused in range(stream.readInt32()):
-        p = __readPrimitive(stream)
-        part.addPrimitive(p)
+    if stream.licFileVersion >= 26 and stream.readBool():  # Geometry comes from the LDraw library, not this file
+        LicPartCache.loadLibraryPart(part, str(stream.readQString()), colorDict)
+        return part
+
+    if stream.licFileVersion >= 25:
+        __readGeometry(stream, part)
+    elif stream.licFileVersion >= 24:
+        __readPrimitiveBlock(stream, part)
+    else:
+        for unused in range(stream.readInt32()):
+            p = __readPrimitive(stream)
+            part.addPrimitive(p)
 
     for unused in range(stream.readInt32()):
         p = __readPart(stream)
         part.parts.append(p)
     return part
 
+def __readArray(stream, typecode, count):
+    # Read a whole block of little-endian values in one go, rather than one stream call per value
+    data = array(typecode)
+    if count > 0:
+        data.fromstring(stream.readRawData(count * data.itemsize))
+        if sys.byteorder == 'big':
+            data.byteswap()
+    return data
+
+def __readGeometry(stream, part):
+    # Geometry is stored apart from the part, and only read in when first used
+    stream.geometry.pending += 1
+    part.geometryLoader = __createGeometryLoader(stream.geometry, part.filename, stream.licFileVersion)
+
+def __readGeometryTable(stream):
+    # Index and data of a LicBinaryWriter.GeometryTable, for files or sections without a geometry section of their own
+    index = stream.geometry
+    index.readIndex(stream)
+    length = stream.readUInt32()
+    mappedFile = getattr(stream, 'mappedFile', None)
+    if mappedFile:
+        index.setSource(LazyGeometryFile(mappedFile), stream.device().pos())
+        stream.skipRawData(length)
+    else:
+        index.setSource(LazyGeometryBuffer(QByteArray(stream.readRawData(length))))
+
+def __createGeometryLoader(index, filename, licFileVersion):
+    licColorDict = colorDict
+
+    def loader(part):
+        global colorDict
+        colorDict = licColorDict  # Global may have moved on to another file since
+        stream = __createBlockStream(index.read(filename), licFileVersion)
+        __readPrimitiveBlock(stream, part)
+    return loader
+
+def __createBlockStream(data, licFileVersion):
+    block = QByteArray(data)
+    stream = QDataStream(block)
+    stream.setVersion(QDataStream.Qt_4_3)
+    stream.licFileVersion = licFileVersion
+    stream.block = block  # Keep the buffer alive as long as the stream
+    return stream
+
+def __readPrimitiveBlock(stream, part):
+
+    primitiveCount = stream.readInt32()
+    colors = [__readLicColor(stream) for unused in range(stream.readInt32())]
+    colorIndices = __readArray(stream, 'h', primitiveCount)
+    types = __readArray(stream, 'h', primitiveCount)
+    windings = __readArray(stream, 'i', primitiveCount)
+    points = __readArray(stream, 'f', stream.readInt32())
+
+    sizes = {GL.GL_LINES: 6, GL.GL_TRIANGLES: 9, GL.GL_QUADS: 12}
+    offset = 0
+    for i in range(primitiveCount):
+        type = types[i]
+        count = sizes[type]
+        part.addPrimitive(Primitive(colors[colorIndices[i]], points[offset:offset + count].tolist(), type, windings[i]))
+        offset += count
+
 def __readPrimitive(stream):
     color = __readLicColor(stream)
     type = stream.readInt16()
@@ -350,8 +643,11 @@ def __readPart(stream):
     color = __readLicColor(stream)
     matrix = []
 
-    for unused in range(16):
-        matrix.append(stream.readFloat())
+    if stream.licFileVersion >= 24:
+        matrix = __readArray(stream, 'f', 16).tolist()
+    else:
+        for unused in range(16):
+            matrix.append(stream.readFloat())
 
     inCallout = stream.readBool()
     pageNumber = stream.readInt32()
@@ -397,10 +693,19 @@ def __readPart(stream):
 
 def __readAnnotationSet(stream, page):
     for unused in range(stream.readInt32()):
-        pixmap = stream.readQPixmap()
+        key = None
+        if hasattr(stream, 'annotationImages'):
+            key = str(stream.readQString())
+            pixmap = QPixmap()
+        elif hasattr(stream, 'annotationPixmaps'):
+            pixmap = stream.annotationPixmaps[stream.readInt32()]
+        else:
+            pixmap = stream.readQPixmap()
         filename = str(stream.readQString())
         pos = stream.readQPointF()
         annotation = LicCustomPages.PageAnnotation(page, pixmap, filename, pos)
+        if key is not None:
+            annotation.setStoredImage(stream.annotationImages, key)
         page.annotations.append(annotation)
         page.addChild(len(page.children), annotation)
 
@@ -418,7 +723,8 @@ def __readPage(stream, parent, instructions, templateModel = None):
         if page.submodel is None:
             page.submodel = templateModel
     else:
-        page = LicCustomPages.Page(parent, instructions, number, row)
+        page = LicCustomPages.Page.createForLoad(parent, instructions, number, row)
+        pendingPages.append(page)
 
     __readRoundedRectItem(stream, page)
     if stream.licFileVersion < 20:
@@ -471,7 +777,8 @@ def __readTitlePage(stream, instructions):
     if not stream.readBool():
         return None
 
-    page = LicCustomPages.TitlePage(instructions)
+    page = LicCustomPages.TitlePage.createForLoad(instructions)
+    pendingPages.append(page)
 
     __readRoundedRectItem(stream, page)
     if stream.licFileVersion < 20:
@@ -491,7 +798,8 @@ def __readTitlePage(stream, instructions):
 
 def __readPartListPage(stream, instructions):
 
-    page = LicCustomPages.PartListPage(instructions, stream.readInt32(), stream.readInt32())
+    page = LicCustomPages.PartListPage.createForLoad(instructions, stream.readInt32(), stream.readInt32())
+    pendingPages.append(page)
 
     __readRoundedRectItem(stream, page)
     if stream.licFileVersion < 20:
@@ -513,7 +821,7 @@ def __readStep(stream, parent):
     pliExists = stream.readBool()
     hasNumberItem = stream.readBool()
     
-    step = Step(parent, stepNumber, pliExists, hasNumberItem)
+    step = Step.createForLoad(parent, stepNumber, pliExists, hasNumberItem)
     
     step.setPos(stream.readQPointF())
     step.setRect(stream.readQRectF())
@@ -575,6 +883,7 @@ def __readCallout(stream, parent):
         step = callout.getStepByNumber(part.stepNumber)
         step.addPart(part)
 
+    callout.resetPartSignature()
     return callout
 
 def __readSubmodelItem(stream, page):
@@ -632,7 +941,7 @@ def __readPLI(stream, parent, makePartListPLI = False):
 
     for unused in range(stream.readInt32()):
         pliItem = __readPLIItem(stream, pli)
-        pli.pliItems.append(pliItem)
+        pli.addPLIItem(pliItem)
 
     return pli
 
@@ -678,6 +987,7 @@ def __linkModelPartNames(model):
         newSubmodel = partDict[modelName]
         newSubmodel.used = True
         model.submodels.append(newSubmodel)
+    model.invalidatePageIndex()
 
     for m in model.submodels:
         __linkModelPartNames(m)
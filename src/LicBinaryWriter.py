@@ -18,23 +18,64 @@
     along with this program.  If not, see http://www.gnu.org/licenses/
 """
 
+import weakref
+from array import array
+
 from LicCommonImports import *
 
-from LicCustomPages import Page
+from LicCustomPages import Page, PartListPLI
 from LicTemplate import TemplatePage, TemplatePLI
 from LicModel import Arrow, CSI, PLI, SubmodelPreview
+import LicBinaryReader
+import LicPartCache
 
-def saveLicFile(filename, instructions, FileVersion, MagicNumber):
+# {AbstractPart: its encoded geometry block}.  Part geometry never changes once loaded, so each
+# part is only encoded once, however many times the book is saved or autosaved
+geometryBlocks = weakref.WeakKeyDictionary()
 
-    fh, stream = __createStream(filename, FileVersion, MagicNumber)
+def saveLicFile(filename, instructions, FileVersion, MagicNumber, useLibraryReferences = False):
 
     # Need to explicitly de-select parts so they refresh the CSI pixmap
     instructions.scene.clearSelectedParts()
 
-    stream.writeInt32(instructions.getQuantitativeSizeMeasure())
+    # Everything is serialized before filename is opened, since part geometry may still be mapped from it
+    snapshot = createSnapshot(instructions, useLibraryReferences)
+    LicBinaryReader.releaseMappedFile(filename)
+    writeSnapshot(filename, snapshot, FileVersion, MagicNumber)
+
+def createSnapshot(instructions, useLibraryReferences = False):
+    """
+    Serialize instructions into uncompressed in-memory sections.  This is the only part of
+    a save that touches the model, so must run on the UI thread; the returned snapshot can
+    then be handed to writeSnapshot on any thread.
+    """
+
+    for snapshot in iterSnapshot(instructions, useLibraryReferences):
+        pass
+    return snapshot
+
+def iterSnapshot(instructions, useLibraryReferences = False):
+    # createSnapshot a little at a time: yields None after each part and each page, then the finished
+    # snapshot.  Lets LicAutosave serialize between UI events.  The model must not change meanwhile
+
+    sections = LicSectionWriter(useLibraryReferences)
+    sections.sizeMeasure = instructions.getQuantitativeSizeMeasure()
+
+    __writeTemplate(sections.begin('template', False), instructions.template)
+    yield None
+
+    for unused in __writeInstructions(sections, instructions):
+        yield None
 
-    __writeTemplate(stream, instructions.template)
-    __writeInstructions(stream, instructions)
+    sections.close()
+    yield sections
+
+def writeSnapshot(filename, snapshot, FileVersion, MagicNumber):
+    # Compress and write out a snapshot from createSnapshot.  Safe to call off the UI thread.
+
+    fh, stream = __createStream(filename, FileVersion, MagicNumber)
+    stream.writeInt32(snapshot.sizeMeasure)
+    snapshot.write(stream)
 
     if fh is not None:
         fh.close()
@@ -43,7 +84,10 @@ def saveLicTemplate(template, FileVersion, MagicNumber):
     
     fh, stream = __createStream(template.filename, FileVersion, MagicNumber)
 
-    __writeTemplate(stream, template)
+    sections = LicSectionWriter()
+    __writeTemplate(sections.begin('template', False), template)
+    sections.close()
+    sections.write(stream)
 
     if fh is not None:
         fh.close()
@@ -57,6 +101,107 @@ def saveLicTemplateSettings(templateSettings, FileVersion, MagicNumber):
     if fh is not None:
         fh.close()
 
+class LicSectionWriter(object):
+    """
+    Collects each section of a .lic file in its own buffer, then writes them all out
+    individually compressed, behind a table of section names, offsets and lengths.
+    """
+
+    def __init__(self, useLibraryReferences = False):
+        self.useLibraryReferences = useLibraryReferences
+        self.sections = []
+        self.annotationImages = []  # [(content hash, PNG data)].  Annotations reference these by hash
+        self.annotationKeys = set()
+        self.geometry = GeometryTable()
+
+    def begin(self, name, shareSections = True):
+        data = QByteArray()
+        stream = QDataStream(data, QIODevice.WriteOnly)
+        stream.setVersion(QDataStream.Qt_4_3)
+        stream.useLibraryReferences = self.useLibraryReferences
+        if shareSections:
+            stream.sections = self
+            stream.geometry = self.geometry
+        else:
+            stream.geometry = GeometryTable()  # Caller must write this out itself
+        self.sections.append((name, data, stream))
+        return stream
+
+    def addAnnotationImage(self, annotation):
+        # Store annotation's image once, no matter how many annotations use it.  Returns its content hash
+        key, data = annotation.getImageData()
+        if key not in self.annotationKeys:
+            self.annotationKeys.add(key)
+            self.annotationImages.append((key, data))
+        return key
+
+    def close(self):
+        # Finish the last section.  Everything after this, in write(), is safe off the UI thread
+        stream = self.begin('annotations', False)
+        stream.writeInt32(len(self.annotationImages))
+        for key, data in self.annotationImages:
+            stream << QString(key)
+            stream << data
+
+        self.geometry.writeIndex(self.begin('geometry index', False))
+        self.sections.append(('geometry', self.geometry.getData(), None))
+
+    def write(self, stream):
+
+        blocks = [(name, qCompress(data)) for name, data, unused in self.sections]
+
+        stream.writeInt32(len(blocks))
+        offset = 0
+        for name, block in blocks:
+            stream << QString(name)
+            stream.writeInt32(offset)  # Offsets are relative to the end of this table
+            stream.writeInt32(block.size())
+            offset += block.size()
+
+        for name, block in blocks:
+            stream.writeRawData(block.data())
+
+class GeometryTable(object):
+    """
+    Collects the encoded geometry of each part, to be written out after the parts themselves,
+    behind a table of part filenames, offsets and lengths.  Readers seek straight to a part's
+    geometry the first time that part is used.
+    """
+
+    def __init__(self):
+        self.blocks = []  # [(part filename, encoded geometry)]
+
+    def add(self, filename, block):
+        self.blocks.append((filename, block))
+
+    def writeIndex(self, stream):
+        stream.writeInt32(len(self.blocks))
+        offset = 0
+        for filename, block in self.blocks:
+            stream << QString(filename)
+            stream.writeUInt32(offset)  # Offsets are relative to the start of the geometry data
+            stream.writeUInt32(block.size())
+            offset += block.size()
+
+    def getData(self):
+        data = QByteArray()
+        for unused, block in self.blocks:
+            data.append(block)
+        return data
+
+    def write(self, stream):
+        # Index and data together, for streams without sections of their own
+        self.writeIndex(stream)
+        data = self.getData()
+        stream.writeUInt32(data.size())
+        stream.writeRawData(data.data())
+
+def __nextSection(stream, name):
+    # Start writing a new section, if this stream is part of a sectioned file.
+    if hasattr(stream, 'sections'):
+        return stream.sections.begin(name)
+    return stream
+
 def __createStream(filename, FileVersion, MagicNumber):
     
     fh = QFile(filename)
@@ -80,8 +225,13 @@ def __writeTemplate(stream, template):
     stream << QString(os.path.basename(template.filename))
     stream.writeBool(TemplatePage.separatorsVisible)
     stream.writeBool(TemplatePLI.includeSubmodels)
-    __writePartDictionary(stream, partDictionary)
-    __writeSubmodel(stream, template.submodelPart)
+    stream << QString(PLI.packingMethod)
+    stream << QString(PartListPLI.packingMethod)
+    for unused in __writePartDictionary(stream, partDictionary):
+        pass
+    for unused in __writeSubmodel(stream, template.submodelPart):
+        pass
+    stream.geometry.write(stream)
     __writePage(stream, template)
 
     __writeStaticInfo(stream)  # Need to save PageSize, PLI|CSI size, etc, so we can apply these on template load
@@ -96,16 +246,20 @@ def __writeStaticInfo(stream):
     stream.writeFloat(Page.Resolution)
     stream << QString(Page.NumberPos)
 
-def __writeInstructions(stream, instructions):
+def __writeInstructions(sections, instructions):
 
+    stream = sections.begin('parts')
     stream << QString(instructions.mainModel.filename)
 
     __writeStaticInfo(stream)
 
     partDictionary = instructions.partDictionary
-    __writePartDictionary(stream, partDictionary)
+    for unused in __writePartDictionary(stream, partDictionary):
+        yield
 
-    __writeSubmodel(stream, instructions.mainModel)
+    stream = sections.begin('pages')
+    for unused in __writeSubmodel(stream, instructions.mainModel):
+        yield
 
     __writeTitlePage(stream, instructions.mainModel.titlePage)
 
@@ -113,6 +267,7 @@ def __writeInstructions(stream, instructions):
     for page in instructions.mainModel.partListPages:
         __writePartListPage(stream, page)
 
+    stream = sections.begin('guides')
     stream.writeInt32(len(instructions.scene.guides))
     for guide in instructions.scene.guides:
         stream.writeInt32(guide.orientation)
@@ -125,6 +280,7 @@ def __writeSubmodel(stream, submodel):
     stream.writeInt32(len(submodel.pages))
     for page in submodel.pages:
         __writePage(stream, page)
+        yield
 
     stream.writeInt32(len(submodel.submodels))
     for model in submodel.submodels:
@@ -152,11 +308,14 @@ def __writePartDictionary(stream, partDictionary):
     stream.writeInt32(len(partList))
     for part in partList:
         __writeAbstractPart(stream, part)
+        yield
 
+    stream = __nextSection(stream, 'submodels')
     submodelList = [p for p in partDictionary.values() if p.isSubmodel]
     stream.writeInt32(len(submodelList))
     for model in submodelList:
-        __writeSubmodel(stream, model)
+        for unused in __writeSubmodel(stream, model):
+            yield
 
 def __writeAbstractPart(stream, part):
 
@@ -172,32 +331,65 @@ def __writeAbstractPart(stream, part):
     stream.writeFloat(part.pliRotation[0])
     stream.writeFloat(part.pliRotation[1])
     stream.writeFloat(part.pliRotation[2])
+
+    # Official LDraw parts can be stored as just a reference into the library
+    checksum = None
+    if getattr(stream, 'useLibraryReferences', False) and not part.isSubmodel:
+        checksum = LicPartCache.getLibraryChecksum(part.filename)
+    stream.writeBool(checksum is not None)
+    if checksum is not None:
+        stream << QString(checksum)
+        return
     
-    stream.writeInt32(len(part.primitives) + len(part.edges))
-    for primitive in part.primitives:
-        __writePrimitive(stream, primitive)
-    for primitive in part.edges:
-        __writePrimitive(stream, primitive)
+    # Geometry goes in the stream's GeometryTable, so readers can load it on demand
+    block = geometryBlocks.get(part)
+    if block is None:
+        block = QByteArray()
+        blockStream = QDataStream(block, QIODevice.WriteOnly)
+        blockStream.setVersion(QDataStream.Qt_4_3)
+        __writePrimitiveBlock(blockStream, part.primitives + part.edges)
+        geometryBlocks[part] = block
+    stream.geometry.add(part.filename, block)
         
     stream.writeInt32(len(part.parts))
     for part in part.parts:
         __writePart(stream, part)
 
-def __writePrimitive(stream, primitive):
-    __writeLicColor(stream, primitive.color)
-    stream.writeInt16(primitive.type)
-    stream.writeInt32(primitive.winding)
-
-    for point in primitive.points:
-        stream.writeFloat(point)
+def __writeArray(stream, typecode, values):
+    # Write values as one raw block of little-endian data; see LicBinaryReader.__readArray
+    data = array(typecode, values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    stream.writeRawData(data.tostring())
+
+def __writePrimitiveBlock(stream, primitiveList):
+
+    colors, colorIndices, colorLookup = [], [], {}
+    points = []
+    for primitive in primitiveList:
+        key = id(primitive.color)
+        if key not in colorLookup:
+            colorLookup[key] = len(colors)
+            colors.append(primitive.color)
+        colorIndices.append(colorLookup[key])
+        points += primitive.points
+
+    stream.writeInt32(len(primitiveList))
+    stream.writeInt32(len(colors))
+    for color in colors:
+        __writeLicColor(stream, color)
+
+    __writeArray(stream, 'h', colorIndices)
+    __writeArray(stream, 'h', [p.type for p in primitiveList])
+    __writeArray(stream, 'i', [p.winding for p in primitiveList])
+    stream.writeInt32(len(points))
+    __writeArray(stream, 'f', points)
 
 def __writePart(stream, part):
     stream << QString(part.abstractPart.filename)
     stream.writeBool(part.inverted)
     __writeLicColor(stream, part.color)
-
-    for point in part.matrix:
-        stream.writeFloat(point)
+    __writeArray(stream, 'f', part.matrix)
 
     stream.writeBool(part.calloutPart != None)
 
@@ -228,7 +420,10 @@ def __writePart(stream, part):
 def __writeAnnotationSet(stream, page):
     stream.writeInt32(len(page.annotations))
     for annotation in page.annotations:
-        stream << annotation.pixmap()
+        if hasattr(stream, 'sections'):
+            stream << QString(stream.sections.addAnnotationImage(annotation))
+        else:
+            stream << annotation.pixmap()
         stream << QString(annotation.filename)
         stream << annotation.pos()
         stream.writeBool(annotation.isAnnotation)
@@ -0,0 +1,90 @@
+"""
+    Lic - Instruction Book Creation software
+    Copyright (C) 2010 Remi Gagne
+
+    This file (LicBookLayout.py) is part of Lic.
+
+    Lic is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Lic is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/
+"""
+
+# Book-wide relayout, for page size and template changes.  Works in three passes: each Page's
+# layout inputs - grid settings and the size of everything in each Step - are read from the scene,
+# LicLayoutEngine lays out all Pages at once, optionally on a pool of worker processes, and the
+# resulting positions are applied back to the scene.  The first and last pass touch Qt items, so
+# they stay on the UI thread; only plain records cross to the workers.  The whole relayout is one
+# tree model change, rather than one or two per Page.
+
+import atexit
+import multiprocessing
+import pickle
+
+from PyQt4.QtCore import *
+
+import LicHelpers
+import LicLayoutEngine
+
+# Laying out a Page takes about a tenth of a millisecond, less than pickling its records to and from
+# a worker, so the pool only pays off when the layouts themselves get more expensive.  Off by default;
+# the "Lay Out Pages in Parallel" setting in Lic's Edit menu turns it on
+PARALLEL_LAYOUT = False
+PARALLEL_PAGES_MIN = 64  # Fewer Pages are always laid out right here
+PAGES_PER_TASK = 16
+
+_pool = None
+
+def getPool():
+    # Worker pool, started on first use and kept for the rest of the session.  None if processes can't be started here
+    global _pool
+    if _pool is None:
+        try:
+            _pool = multiprocessing.Pool(LicHelpers.workerCount(PARALLEL_PAGES_MIN))
+            atexit.register(_pool.terminate)
+        except (OSError, ImportError):
+            _pool = False
+    return _pool or None
+
+def layoutPages(records, parallel = None):
+    # LicLayoutEngine.layoutBook, spread over the worker pool when there's enough to do
+    parallel = PARALLEL_LAYOUT if parallel is None else parallel
+    pool = getPool() if parallel and len(records) >= PARALLEL_PAGES_MIN else None
+    if pool:
+        try:
+            return pool.map(LicLayoutEngine.layoutPage, records, PAGES_PER_TASK)
+        except (OSError, IOError, pickle.PicklingError):
+            pass  # Lay out here instead
+    return LicLayoutEngine.layoutBook(records)
+
+def relayoutPages(pages, parallel = None):
+    # Same result as calling initLayout on each of pages
+    if not pages:
+        return
+
+    scene = pages[0].scene()
+    scene.emit(SIGNAL("layoutAboutToBeChanged()"))  # Scene drops the nested signals each Page sends
+
+    jobs = []
+    for page in pages:
+        if not page.hasStepGrid:
+            page.initLayout()  # Nothing to batch, so lay out right away
+            continue
+        pliItems = page.prepareLayout()
+        if pliItems is not None:
+            jobs.append((page, page.getLayoutRecord(pliItems), pliItems))
+
+    layouts = layoutPages([record for page, record, pliItems in jobs], parallel)
+
+    for (page, record, pliItems), layout in zip(jobs, layouts):
+        page.applyLayout(layout, pliItems)
+
+    scene.emit(SIGNAL("layoutChanged()"))
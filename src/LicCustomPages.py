@@ -18,6 +18,8 @@
     along with this program.  If not, see http://www.gnu.org/licenses/
 """
 
+import hashlib
+
 from LicCommonImports import *
 
 from LicUndoActions import *
@@ -25,6 +27,8 @@ from LicTreeModel import *
 from LicQtWrapper import *
 from LicModel import *
 import LicDialogs
+import LicLayoutEngine
+import LicPacking
 
 __all__ = ["BasePage", "Page", "StepSeparator"]
 
@@ -93,8 +97,9 @@ class Page(PageTreeManager, BasePage):
     """ A single page in an instruction book.  Contains one or more Steps. """
 
     itemClassName = "Page"
+    hasStepGrid = True  # False if LicBookLayout can't batch this Page's layout, and must call initLayout instead
 
-    def __init__(self, submodel, instructions, number, row):
+    def __init__(self, submodel, instructions, number, row, addToScene = True):
 
         BasePage.__init__(self, instructions)
 
@@ -116,11 +121,19 @@ class Page(PageTreeManager, BasePage):
         self.resetPageNumberPosition()
         
         # Need to explicitly add this page to scene, since it has no parent
-        instructions.scene.addItem(self)
+        if addToScene:
+            instructions.scene.addItem(self)
+
+    @staticmethod
+    def createForLoad(submodel, instructions, number, row):
+        # Page that is not yet in the scene: the loader fills it in, then adds it once complete
+        return Page(submodel, instructions, number, row, False)
 
     def _setNumber(self, number):
         self._number = number
         self.numberItem.setText("%d" % self._number)
+        if self.submodel:
+            self.submodel.invalidatePageIndex()
 
     def _getNumber(self):
         return self._number
@@ -182,6 +195,9 @@ class Page(PageTreeManager, BasePage):
         self.steps.append(step)
         self.steps.sort(key = lambda x: x._number)
         step.setParentItem(self)
+        if self.submodel:
+            self.submodel.invalidateStepIndex()
+        LicHelpers.notifyModelChanged()
 
         i = 0
         for i in range(len(self.children) - 1, -1, -1):
@@ -234,6 +250,7 @@ class Page(PageTreeManager, BasePage):
             self.steps.append(step)
 
         self.children.insert(row, step)
+        LicHelpers.notifyModelChanged()
         self.scene().emit(SIGNAL("layoutChanged()"))
 
         self.submodel.syncStepNumbers()
@@ -256,6 +273,8 @@ class Page(PageTreeManager, BasePage):
         self.scene().removeItem(step)
         self.steps.remove(step)
         self.children.remove(step)
+        self.submodel.invalidateStepIndex()
+        LicHelpers.notifyModelChanged()
         self.submodel.updateStepNumbers(step.number, -1)
 
     def isEmpty(self):
@@ -383,6 +402,54 @@ class Page(PageTreeManager, BasePage):
 
         return label
 
+    def prepareLayout(self):
+        """
+        Batch version of initLayout, in three parts - see LicBookLayout.  Readies everything on this Page for layout, and
+        returns [PLI items of each Step] for getLayoutRecord and applyLayout, or None if there's nothing left to lay out.
+        """
+
+        self.lockIcon.resetPosition()
+        if self.lockIcon.isLocked:
+            return None  # Don't make any layout changes to locked pages
+
+        self.resetPageNumberPosition()
+        if self.submodelItem:
+            self.submodelItem.initLayout()
+        self.removeAllSeparators()
+        if len(self.steps) <= 0:
+            return None
+
+        return [step.prepareLayout() for step in self.steps]
+
+    def getLayoutRecord(self, pliItems):
+        # LicLayoutEngine.PageRecord of this Page, once prepareLayout has readied it.  Changes nothing
+        steps = [step.getLayoutRecord(items) for step, items in zip(self.steps, pliItems)]
+
+        fixedMember = None
+        if self.submodelItem:
+            r = self.submodelItem.rect()
+            fixedMember = (r.x(), r.y(), r.width(), r.height())
+
+        r = self.insetRect()
+        record = LicLayoutEngine.PageRecord((r.x(), r.y(), r.width(), r.height()), (self.rect().width(), self.rect().height()),
+                                            (Page.margin.x(), Page.margin.y()), (PLI.margin.x(), PLI.margin.y()), steps,
+                                            fixedMember, self.layout.orientation, self.layout.rowCount, self.layout.colCount)
+        return record
+
+    def applyLayout(self, pageLayout, pliItems):
+        # Last part of the batch initLayout: put everything where LicLayoutEngine.layoutPage says
+        members = [self.submodelItem] if self.submodelItem else []
+        if self.submodelItem:
+            self.submodelItem.initLayout(QRectF(*pageLayout.fixedCell))
+
+        for step, (cell, layout), items in zip(self.steps, pageLayout.steps, pliItems):
+            step.applyLayout(layout, items, QRectF(*cell))
+
+        length = self.insetRect().getOrientedSize(self.layout.orientation)
+        self.layout.setSeparators(members + self.steps, pageLayout.separators, length)
+        for index, rect in self.layout.separators:
+            self.addStepSeparator(index, rect)
+
     def updateSubmodel(self):
         if self.submodel and self.submodel.pages and self.submodel.pages[0].submodelItem:
             self.submodel.pages[0].submodelItem.resetPixmap()
@@ -641,6 +708,58 @@ class PageAnnotation(QGraphicsPixmapItem):
         if pos:
             self.setPos(pos)
 
+        self.imageStore = None  # Set while this annotation's image is still waiting to be decoded
+        self.imageKey = None    # Content hash of this annotation's image
+        self.imageData = None   # This annotation's image as PNG data
+
+    def setStoredImage(self, imageStore, key):
+        # Use an image from a .lic file's image store, but only decode it when first drawn
+        self.prepareGeometryChange()
+        self.imageStore = imageStore
+        self.imageKey = key
+        self.imageData = imageStore.getData(key)
+
+    def loadStoredImage(self):
+        if self.imageStore:
+            QGraphicsPixmapItem.setPixmap(self, self.imageStore.getPixmap(self.imageKey))
+            self.imageStore = None
+
+    def getImageData(self):
+        # Returns (content hash, PNG data) for this annotation's image, computed only once
+        if self.imageKey is None:
+            image = QGraphicsPixmapItem.pixmap(self).toImage().convertToFormat(QImage.Format_ARGB32)
+            pixels = image.bits().asstring(image.numBytes())
+            self.imageKey = hashlib.sha1("%dx%d:" % (image.width(), image.height()) + pixels).hexdigest()
+            self.imageData = QByteArray()
+            buffer = QBuffer(self.imageData)
+            buffer.open(QIODevice.WriteOnly)
+            image.save(buffer, "PNG")
+        return self.imageKey, self.imageData
+
+    def pixmap(self):
+        self.loadStoredImage()
+        return QGraphicsPixmapItem.pixmap(self)
+
+    def setPixmap(self, pixmap):
+        QGraphicsPixmapItem.setPixmap(self, pixmap)
+        self.imageStore = self.imageKey = self.imageData = None
+
+    def boundingRect(self):
+        if self.imageStore:
+            return QRectF(self.offset(), QSizeF(self.imageStore.getSize(self.imageKey)))
+        return QGraphicsPixmapItem.boundingRect(self)
+
+    def shape(self):
+        if self.imageStore:
+            path = QPainterPath()
+            path.addRect(self.boundingRect())
+            return path
+        return QGraphicsPixmapItem.shape(self)
+
+    def paint(self, painter, option, widget = None):
+        self.loadStoredImage()
+        QGraphicsPixmapItem.paint(self, painter, option, widget)
+
     def data(self, index):
         return "Annotation: " + os.path.basename(self.filename)
     
@@ -710,6 +829,7 @@ class LockIcon(QGraphicsPixmapItem):
     
 class PartListPLI(PLI):
     itemClassName = "PartListPLI"
+    packingMethod = LicPacking.Columns  # Set by the template
 
     def __init__(self, parent):
         PLI.__init__(self, parent)
@@ -736,51 +856,38 @@ class PartListPLI(PLI):
     
         partList = list(self.pliItems)
         partList.sort(key = lambda x: (x.color.sortKey(), x.rect().width()))
-        
-        columnWidth = 0
-        mx, my = PLI.margin.x(), PLI.margin.y() 
-        x, y = mx, my
-        
-        for item in partList:
-            
-            newHeight = item.rect().height() + my
 
-            if y + newHeight > self.rect().height():  # Start new column
-                x += columnWidth + (mx * 2)
-                y = my
-                columnWidth = item.rect().width()
-                
-            if x + item.rect().width() > self.rect().width():  # This item overflowed the right edge of page - abort
-                index = partList.index(item)
-                return partList[index:]
-
-            item.setPos(x, y)
-            y += newHeight
-            columnWidth = max(columnWidth, item.rect().width())
+        sizes = [(item.rect().width(), item.rect().height()) for item in partList]
+        margin = (PLI.margin.x(), PLI.margin.y())
+        positions = LicPacking.packArea(sizes, self.rect().width(), self.rect().height(), margin, PartListPLI.packingMethod)
 
-        return []  # All items fit on this page
+        overflow = []
+        for item, pos in zip(partList, positions):
+            if pos is None:  # Doesn't fit on this page
+                overflow.append(item)
+            else:
+                item.setPos(*pos)
+        return overflow
 
 class PartListPage(PartListPageTreeManager, Page):
+
+    hasStepGrid = False
     
-    def __init__(self, instructions, number = None, row = None):
+    def __init__(self, instructions, number = None, row = None, addToScene = True, createPLI = True):
 
         parentModel = instructions.mainModel
         if number is None and row is None:
             number = parentModel.pages[-1]._number + 1
             row = parentModel.pages[-1]._row + 1
-        Page. __init__(self, parentModel, instructions, number, row)
+        Page. __init__(self, parentModel, instructions, number, row, addToScene)
 
         self.numberItem._row = 0
-        self.pli = PartListPLI(self)
-
-    def initFullPartList(self):
-        for part in self.submodel.getFullPartList():
-            self.pli.addPart(part)
+        self.pli = PartListPLI(self) if createPLI else None
 
-    def initPartialItemList(self, itemList):
-        self.pli.pliItems = itemList
-        for item in itemList:
-            item.setParentItem(self.pli)
+    @staticmethod
+    def createForLoad(instructions, number, row):
+        # Page without a PLI and not yet in the scene: the loader reads in the PLI, then adds the page
+        return PartListPage(instructions, number, row, False, False)
 
     def initLayout(self):
         self.lockIcon.resetPosition()
@@ -790,13 +897,6 @@ class PartListPage(PartListPageTreeManager, Page):
         self.pli.doOverflowLayout()
         # TODO: Need to handle bumping items from page to page, so can do post-loaded auto-layouts
 
-    def doOverflowLayout(self):
-        overflowItems = self.pli.doOverflowLayout()
-        if overflowItems:
-            for item in overflowItems:
-                self.pli.pliItems.remove(item)
-        return overflowItems
-
     def glItemIterator(self):
         for pliItem in self.pli.pliItems:
             yield pliItem
@@ -817,20 +917,78 @@ class PartListPage(PartListPageTreeManager, Page):
         menu.addAction("Add Annotation", lambda: self.addAnnotationSignal(event.scenePos()))
         menu.exec_(event.screenPos())
 
-    def updatePartList(self):
+    def countParts(self):
+        # [(abstractPart, color, quantity)] for each different part in the model, in the order first found
+        counts = {}
+        partList = []
+        for part in self.submodel.getFullPartList():
+            key = PLI.itemKey(part.abstractPart.filename, part.color)
+            if key not in counts:
+                counts[key] = [part.abstractPart, part.color, 0]
+                partList.append(counts[key])
+            counts[key][2] += 1
+        return partList
+
+    def updatePartList(self, pageList = None):
+        """
+        Lay out the full part list across this and the rest of pageList, adding and removing Pages as
+        needed, and return the new list of Pages.  Existing PLIItems are kept, and re-initialized only
+        if their quantity changed.  All items are packed at once, then only Pages whose items or item
+        positions changed are updated, so a color change or an added part touches one or two Pages.
+        """
+
+        pageList = list(pageList or [self])
+        scene = self.scene()
+        self.pli.resetRect()
+
+        oldItems = {}
+        for page in pageList:
+            for item in page.pli.pliItems:
+                oldItems[PLI.itemKey(item.abstractPart.filename, item.color)] = item
+
+        partList = []
+        for abstractPart, color, quantity in self.countParts():
+            item = oldItems.pop(PLI.itemKey(abstractPart.filename, color), None)
+            if item is None:
+                item = PLIItem(self.pli, abstractPart, color, quantity)
+                item.initLayout()
+            elif item.quantity != quantity:
+                item.setQuantity(quantity)
+                item.initLayout()
+            partList.append(item)
+
+        for item in oldItems.values():  # Parts no longer in the model
+            item.parentItem().removePLIItem(item)
+            scene.removeItem(item)
+            item.setParentItem(None)
+
+        partList.sort(key = lambda x: (x.color.sortKey(), x.rect().width()))
+        sizes = [(item.rect().width(), item.rect().height()) for item in partList]
+        margin = (PLI.margin.x(), PLI.margin.y())
+        placements = LicPacking.packPages(sizes, self.pli.rect().width(), self.pli.rect().height(), margin, PartListPLI.packingMethod)
 
-        self.pli.removeAllParts()
-        self.initFullPartList()
-        pageList = [self]
-        overflowList = self.doOverflowLayout()
+        pageCount = max([page for page, pos in placements] + [0]) + 1
+        pageItems = [[] for unused in range(pageCount)]
+        for item, (page, pos) in zip(partList, placements):
+            pageItems[page].append((item, pos))
 
-        while overflowList != []:
+        while len(pageList) < pageCount:
             page = PartListPage(self.instructions, pageList[-1]._number + 1, pageList[-1]._row + 1)
-            page.initPartialItemList(overflowList)
+            page.pli.resetRect()
             pageList.append(page)
-            overflowList = page.doOverflowLayout()
 
-        return pageList
+        for page, itemList in zip(pageList, pageItems):
+            if [(item, (item.pos().x(), item.pos().y())) for item in page.pli.pliItems] == itemList:
+                continue  # Nothing on this page changed
+            for item, pos in itemList:
+                if item.parentItem() is not page.pli:
+                    item.setParentItem(page.pli)
+                item.setPos(*pos)
+            page.pli.setPLIItems([item for item, pos in itemList])
+
+        for page in pageList[pageCount:]:  # Now empty, since their items moved to earlier Pages
+            scene.removeItem(page)
+        return pageList[:pageCount]
 
     @staticmethod
     def createPartListPages(instructions):
@@ -881,11 +1039,17 @@ class EditableTextItem(QGraphicsSimpleTextItem):
 
 class TitlePage(TitlePageTreeManager, Page):
 
-    def __init__(self, instructions):
-        Page. __init__(self, instructions.mainModel, instructions, 1, 1)
+    hasStepGrid = False
+
+    def __init__(self, instructions, addToScene = True):
+        Page. __init__(self, instructions.mainModel, instructions, 1, 1, addToScene)
         self.labels = []
         self.numberItem.hide()
 
+    @staticmethod
+    def createForLoad(instructions):
+        return TitlePage(instructions, False)
+
     def addInitialContent(self):
 
         self.addSubmodelImage()
@@ -25,6 +25,7 @@ from LicCustomPages import Page
 
 import LicUndoActions
 import LicQtWrapper
+import LicSnapIndex
 
 class LicGraphicsView(QGraphicsView):
     def __init__(self, parent):
@@ -71,6 +72,9 @@ class LicGraphicsScene(QGraphicsScene):
 
     PageViewContinuous = -1
     PageViewContinuousFacing = -2
+
+    snapDistance = 20
+    snapMargin = 20
         
     def __init__(self, parent):
         QGraphicsScene.__init__(self, parent)
@@ -99,6 +103,7 @@ class LicGraphicsScene(QGraphicsScene):
         self.ySnapLine = self.createSnapLine()
         self.snapToGuides = True
         self.snapToItems = True
+        self.snapIndex = None  # LicSnapIndex.SnapIndex for the current drag
         self.renderMode = 'full' # Or "background" or "foreground"
 
     def createSnapLine(self):
@@ -398,110 +403,93 @@ class LicGraphicsScene(QGraphicsScene):
         if not self.snapToGuides and not self.snapToItems:
             return # User disabled snap
          
-        snapDistance = 20
-        margin = 20
-
         # Hide any existing snap guide lines
         self.xSnapLine.hide()
         self.ySnapLine.hide()
-        
-        # Build dict of all guides and page items and their [left, right, top, bottom] points
-        itemDict = {}
-        
-        if self.snapToGuides:
-            for guide in self.guides:
-                guidePt = guide.mapToScene(guide.line().p1())
-                itemDict[guide] = [guidePt.x(), guidePt.y()]
 
-        if self.snapToItems:
-            for pageItem in item.getPage().getAllChildItems():
-                if isinstance(pageItem, Step):
-                    continue
-                if item.isAncestorOf(pageItem):
-                    continue
-                if pageItem is item:
-                    continue
-                itemDict[pageItem] = pageItem.getSceneCornerList()
-                
-                if isinstance(pageItem, Page):  # Bump page points inwards so we snap to margin, not outside edge
-                    itemDict[pageItem][0] += margin
-                    itemDict[pageItem][1] += margin
-                    itemDict[pageItem][2] -= margin
-                    itemDict[pageItem][3] -= margin
+        # Built on the first move of each drag, then reused until the mouse is released
+        if self.snapIndex is None or self.snapIndex.item is not item:
+            self.snapIndex = self.buildSnapIndex(item)
+        index = self.snapIndex
+
+        for movingItem in index.movingItems:  # Other selected items move along with this one
+            index.moveTarget(movingItem, *self.getSnapCorners(movingItem))
 
-        if not itemDict:
+        if not index:
             return  # Nothing to snap to
         
         # Get top-left & bottom-right corners of target item
         tl, br = item.getSceneCorners()
-        
-        # Placeholders for current nearest corner & item
-        nearestX = dx = x = nearestY = dy = y = 100
-        newXItem = newYItem = None
-        
-        def snapEdge(targetEdge, itemEdge, nearest, dt, t, currentItem, newItem):
-            i = targetEdge - itemEdge
-            if abs(i) < nearest:
-                return abs(i), i, targetEdge, newItem
-            return nearest, dt, t, currentItem
-            
-        def snapX(targetEdge, itemEdge):
-            return snapEdge(targetEdge, itemEdge, nearestX, dx, x, newXItem, pageItem)
-
-        def snapY(targetEdge, itemEdge):
-            return snapEdge(targetEdge, itemEdge, nearestY, dy, y, newYItem, pageItem)
-
-        for pageItem, pts in itemDict.items():
-
-            if isinstance(pageItem, Guide):
-                left, top = pts
-                right, bottom = pts
-            else:
-                left, top, right, bottom = pts
-
-            nearestX, dx, x, newXItem = snapX(left, tl.x())   # Compare left edges
-            nearestX, dx, x, newXItem = snapX(right, br.x())  # Compare right edges
-                
-            nearestY, dy, y, newYItem = snapY(top, tl.y())     # Compare top edges
-            nearestY, dy, y, newYItem = snapY(bottom, br.y())  # Compare bottom edges
-            
-            if not isinstance(pageItem, Page):
-                
-                # Check if two items line up horizontally / vertically.  Snap with margin on opposite sides if so
-                if (top < tl.y() and bottom > br.y()) or (top > tl.y() and bottom < br.y()):
-                    nearestX, dx, x, newXItem = snapX(right + margin, tl.x())  # Snap item's left edge to right w. margin
-                    nearestX, dx, x, newXItem = snapX(left - margin, br.x())   # Snap item's right edge to left
-
-                if (left < tl.x() and right > br.x()) or (left > tl.x() and right < br.x()):
-                    nearestY, dy, y, newYItem = snapY(bottom + margin, tl.y()) # Snap item's bottom edge to top w. margin
-                    nearestY, dy, y, newYItem = snapY(top - margin, br.y())    # Snap item's top edge to bottom 
+        snapX, snapY = index.snap(tl.x(), tl.y(), br.x(), br.y(), LicGraphicsScene.snapDistance)
 
         # Snap item into position
-        if nearestX < snapDistance:
-            item.moveBy(dx, 0)
-        if nearestY < snapDistance:
-            item.moveBy(0, dy)
+        if snapX:
+            item.moveBy(snapX[0], 0)
+        if snapY:
+            item.moveBy(0, snapY[0])
 
         tl, br = item.getSceneCorners() # Get top-left & bottom-right corners of newly positioned item
     
         # Position a little snap guide line between item & snapped-to item
-        if nearestX < snapDistance:
+        if snapX:
+            unused, x, newXItem = snapX
             if isinstance(newXItem, Guide):
                 top, bottom = tl.y() + 10, br.y() - 10
             else:
-                left, top, right, bottom = itemDict[newXItem]  # Look up item points to snap to
+                left, top, right, bottom = index.targetRect(newXItem)  # Look up item points to snap to
                 
             self.xSnapLine.setLine(x, min(top, tl.y()), x, max((bottom, br.y()))) # Position  snap guide line
             self.xSnapLine.show()
 
-        if nearestY < snapDistance:
+        if snapY:
+            unused, y, newYItem = snapY
             if isinstance(newYItem, Guide):
                 left, right = tl.x() + 10, br.x() - 10
             else:
-                left, top, right, bottom = itemDict[newYItem]  # Look up item points to snap to
+                left, top, right, bottom = index.targetRect(newYItem)  # Look up item points to snap to
                 
             self.ySnapLine.setLine(min(left, tl.x()), y, max((right, br.x())), y) # Position  snap guide line
             self.ySnapLine.show()
+
+    def getSnapCorners(self, pageItem):
+        left, top, right, bottom = pageItem.getSceneCornerList()
+        if isinstance(pageItem, Page):  # Bump page points inwards so we snap to margin, not outside edge
+            margin = LicGraphicsScene.snapMargin
+            return left + margin, top + margin, right - margin, bottom - margin
+        return left, top, right, bottom
+
+    def buildSnapIndex(self, item):
+        # Every guide and page item that item can snap to, and their [left, top, right, bottom] points
+        pageItems, movingItems = [], []
+        if self.snapToItems:
+            for pageItem in item.getPage().getAllChildItems():
+                if isinstance(pageItem, Step):
+                    continue
+                if item.isAncestorOf(pageItem):
+                    continue
+                if pageItem is item:
+                    continue
+                pageItems.append(pageItem)
+                if pageItem.isSelected() and (pageItem.flags() & QGraphicsItem.ItemIsMovable):
+                    movingItems.append(pageItem)
+
+            # Children of moving items move with them, so only the moving items themselves are tracked
+            def movesWithParent(pageItem):
+                return any([m.isAncestorOf(pageItem) for m in movingItems])
+            pageItems = [i for i in pageItems if not movesWithParent(i)]
+            movingItems = [i for i in movingItems if not movesWithParent(i)]
+
+        index = LicSnapIndex.SnapIndex(LicGraphicsScene.snapMargin, item, movingItems)
+
+        if self.snapToGuides:
+            for guide in self.guides:
+                guidePt = guide.mapToScene(guide.line().p1())
+                index.addTarget(guide, guidePt.x(), guidePt.y(), guidePt.x(), guidePt.y(), True)
+
+        for pageItem in pageItems:
+            index.addTarget(pageItem, *self.getSnapCorners(pageItem), isFrame = isinstance(pageItem, Page))
+
+        return index
     
     def mouseReleaseEvent(self, event):
 
@@ -512,6 +500,7 @@ class LicGraphicsScene(QGraphicsScene):
                 parts.append(item)
 
         QGraphicsScene.mouseReleaseEvent(self, event)
+        self.snapIndex = None  # Drag over
 
         selItems = self.selectedItems()
         for part in parts:
@@ -522,6 +511,8 @@ class LicGraphicsScene(QGraphicsScene):
         
     def mousePressEvent(self, event):
         
+        self.snapIndex = None  # Items may have changed since the last drag; rebuilt on first snap
+
         # Need to compare the selection list before and after selection, to deselect any selected parts
         parts = []
         for item in self.selectedItems():
@@ -18,6 +18,8 @@
     along with this program.  If not, see http://www.gnu.org/licenses/
 """
 
+import multiprocessing
+
 from PyQt4.QtCore import Qt, QPointF
 from PyQt4.QtGui import QPainterPath
 
@@ -68,9 +70,24 @@ class LicColorDict(dict):
         self[k] = black    # Store for future lookups - chances are, if one call failed, many more will
         return black
 
+modelVersion = 0  # Bumped by notifyModelChanged: cached model traversals built at an older version are stale
+
+def notifyModelChanged():
+    """ Call whenever pages, steps, callouts, submodels or parts are added, removed or moved between parents. """
+    global modelVersion
+    modelVersion += 1
+
 # lambda is bound dynamically to the last variable used, so we can't 
 # use it in a loop for creating menu actions.  Use this instead.
 # usage: menu.addAction("menu text", makeFunc(self.moveToCallout, callout))
+def workerCount(taskCount):
+    # Number of worker processes worth starting for taskCount independent tasks: one per CPU, at most
+    try:
+        count = multiprocessing.cpu_count()
+    except NotImplementedError:
+        count = 1
+    return max(1, min(count, taskCount))
+
 def makeFunc(func, arg):
     def f(): func(arg)
     return f
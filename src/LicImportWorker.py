@@ -0,0 +1,119 @@
+"""
+    Lic - Instruction Book Creation software
+    Copyright (C) 2010 Remi Gagne
+
+    This file (LicImportWorker.py) is part of Lic.
+
+    Lic is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Lic is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/
+"""
+
+# Reads and parses a model's LDraw files on a helper thread, before the import proper starts.
+# Progress comes back through a queue polled from the UI thread, and is re-emitted as Qt signals.
+#
+# Only file reading moves off the UI thread.  Bounding boxes, addInitialPagesAndSteps and layout
+# all create or measure scene items and GL display lists, so they still run in the generator
+# Instructions.importModel, pumped from the UI thread; cancelling those takes effect at its next
+# yield.  They do find every file they need already in memory.
+
+import threading
+import Queue
+
+from LicCommonImports import *
+
+from LicImporters import LDrawImporter
+
+class ImportWorker(QObject):
+
+    pollInterval = 50  # ms
+
+    def __init__(self, parent, filename):
+        QObject.__init__(self, parent)
+        self.filename = filename
+        self.cancelled = threading.Event()
+        self.results = Queue.Queue()
+        self.thread = None
+
+        self.timer = QTimer(self)
+        self.connect(self.timer, SIGNAL("timeout()"), self.poll)
+
+    def start(self):
+        LDrawImporter.fileCache.clear()
+        self.thread = threading.Thread(target = self.run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.timer.start(self.pollInterval)
+
+    def cancel(self):
+        # Takes effect after the file being read right now
+        self.cancelled.set()
+
+    def run(self):
+        def progress(filename, done, queued):
+            self.results.put(("progress", filename, done, queued))
+
+        try:
+            finished = LDrawImporter.prefetchFiles(self.filename, self.cancelled.isSet, progress)
+            self.results.put(("finished", finished))
+        except Exception, e:  # Anything else would kill the thread silently, leaving prefetchModelFiles waiting forever
+            self.results.put(("failed", e))
+
+    def poll(self):
+        while True:
+            try:
+                result = self.results.get_nowait()
+            except Queue.Empty:
+                return
+
+            if result[0] == "progress":
+                self.emit(SIGNAL("progress"), *result[1:])
+                continue
+
+            self.timer.stop()
+            self.thread = None
+            if result[0] == "failed" or not result[1]:
+                LDrawImporter.fileCache.clear()  # Let the import proper read files itself, and report any error
+            self.emit(SIGNAL("finished(bool)"), result[0] == "finished" and result[1])
+            return
+
+def prefetchModelFiles(parent, filename, progressDialog = None):
+    """
+    Read all of filename's LDraw files on a helper thread, keeping the UI responsive meanwhile.
+    Returns False if the user cancelled, True otherwise (even if reading failed: the import itself will report that).
+    progressDialog can be None, when there is no UI to report to.
+    """
+
+    worker = ImportWorker(parent, filename)
+    loop = QEventLoop()
+    state = {'cancelled': False}
+
+    def progress(fn, done, queued):
+        if progressDialog:
+            progressDialog.setLabelText("Reading %s (%d files)" % (os.path.basename(fn), done))
+
+    def cancel():
+        state['cancelled'] = True
+        worker.cancel()
+
+    parent.connect(worker, SIGNAL("progress"), progress)
+    parent.connect(worker, SIGNAL("finished(bool)"), loop.quit)
+    if progressDialog:
+        parent.connect(progressDialog, SIGNAL("canceled()"), cancel)
+
+    worker.start()
+    loop.exec_()
+
+    if progressDialog:
+        parent.disconnect(progressDialog, SIGNAL("canceled()"), cancel)
+    worker.deleteLater()
+    return not state['cancelled']
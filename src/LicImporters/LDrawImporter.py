@@ -23,8 +23,13 @@ from OpenGL import GL
 
 LDrawPath = None  # This will be set by the object calling this importer
 
+fileCache = {}  # {filename: LDrawFile}, filled by prefetchFiles ahead of an import, emptied once that import is done
+
 def importModel(filename, instructions):
-    LDrawImporter(filename, instructions)
+    try:
+        LDrawImporter(filename, instructions)
+    finally:
+        fileCache.clear()
 
 def importPart(filename, instructions, abstractPart):
     LDrawImporter(filename, instructions, abstractPart)
@@ -39,7 +44,7 @@ class LDrawImporter(object):
         self.filename = filename
         self.instructions = instructions
 
-        ldrawFile = LDrawFile(filename)
+        ldrawFile = getLDrawFile(filename)
         self.lineList = ldrawFile.lineList
         self.submodels = ldrawFile.getSubmodels(filename)
         if parent:
@@ -51,7 +56,7 @@ class LDrawImporter(object):
 
         filename, color, matrix = lineToPart(line)
 
-        if (filename not in self.submodels) and (LDrawFile.getPartFilePath(filename) is None):
+        if (filename not in self.submodels) and (filename not in fileCache) and (LDrawFile.getPartFilePath(filename) is None):
             print "Could not find Part File - ignoring: " + filename
             return None
 
@@ -68,7 +73,7 @@ class LDrawImporter(object):
         return part
     
     def loadAbstractPartFromFile(self, part, filename):
-        ldrawFile = LDrawFile(filename)
+        ldrawFile = getLDrawFile(filename)
         part.isPrimitive = ldrawFile.isPrimitive
         part.name = ldrawFile.name
         self.loadAbstractPartFromLineList(part, ldrawFile.lineList)
@@ -233,6 +238,42 @@ def createStepLine():
 def isRotStepLine(line):
     return (len(line) > 3) and (line[1] == Comment) and (line[2] == RotStepCommand)
 
+def getLDrawFile(filename):
+    if filename in fileCache:
+        return fileCache[filename]
+    return LDrawFile(filename)
+
+def prefetchFiles(filename, isCancelled = None, progress = None):
+    """
+    Read filename and every part file it references, directly or through other parts, into fileCache.
+    Only touches the file system and plain python lists, so is safe to run on a worker thread.
+    progress(filename, files read, files still queued) is called after each file.
+    Returns False if isCancelled() became True before all files were read.
+    """
+
+    pending, seen = [filename], set([filename])
+    while pending:
+        if isCancelled and isCancelled():
+            return False
+
+        fn = pending.pop()
+        if LDrawFile.getPartFilePath(fn) is None:
+            continue  # The importer will report this one
+        ldrawFile = LDrawFile(fn)
+        fileCache[fn] = ldrawFile
+
+        submodels = ldrawFile.getSubmodels(fn) if fn == filename else {}
+        for line in ldrawFile.lineList:
+            if isPartLine(line):
+                child = ' '.join(line[15:])
+                if child not in seen and child not in submodels:
+                    seen.add(child)
+                    pending.append(child)
+
+        if progress:
+            progress(fn, len(fileCache), len(pending))
+    return True
+
 class LDrawFile(object):
 
     def __init__(self, filename):
@@ -24,10 +24,11 @@ import Image
 
 from LicTemplateSettings import TemplateSettings
 from LicHelpers import LicColor, LicColorDict
-from LicCustomPages import Page, TitlePage
+from LicCustomPages import Page, TitlePage, PartListPage, PartListPLI
 from LicModel import *
 import LicImporters
 import LDrawColors
+import LicPacking
 
 class Instructions(QObject):
     itemClassName = "Instructions"
@@ -65,6 +66,9 @@ class Instructions(QObject):
         self.mainModel = None
         self.partDictionary = {}
         CSI.highlightNewParts = False
+        PLI.packingMethod = LicPacking.Rows
+        PartListPLI.packingMethod = LicPacking.Columns
+        AbstractPart.pendingGLListCount = 0
         LicGLHelpers.resetLightParameters()
         self.glContext.makeCurrent()
         
@@ -72,17 +76,10 @@ class Instructions(QObject):
         self.templateSettings = TemplateSettings()
 
     def importModel(self, filename):
+        # Each phase is its own method, so LicPerfHarness can time them one by one
 
-        self.mainModel = Mainmodel(self, self, filename)
-        self.mainModel.appendBlankPage()
-        self.mainModel.importModel()
-        
-        self.mainModel.syncPageNumbers()
-        self.mainModel.addInitialPagesAndSteps()
-        
+        pageList = self.readModel(filename)
         submodelCount = self.mainModel.submodelCount()
-        pageList = self.mainModel.getPageList()
-        pageList.sort(key = lambda x: x._number)
         totalCount = len(self.partDictionary) + len(self.mainModel.getCSIList()) + submodelCount  # Rough count only
 
         yield totalCount  # Special first value is maximum number of progression steps in load process
@@ -98,6 +95,26 @@ class Instructions(QObject):
         for label in self.initCSIDimensions():   # Calculate width and height of each CSI in this instruction book
             yield label
 
+        for label in self.layoutImportedPages(pageList):
+            yield label
+
+        for label in self.mergeImportedPages(pageList):
+            yield label
+
+    def readModel(self, filename):
+        # Build the main model, with one Step per Page.  Returns its Pages, in page order
+        self.mainModel = Mainmodel(self, self, filename)
+        self.mainModel.appendBlankPage()
+        self.mainModel.importModel()
+        
+        self.mainModel.syncPageNumbers()
+        self.mainModel.addInitialPagesAndSteps()
+        
+        pageList = self.mainModel.getPageList()
+        pageList.sort(key = lambda x: x._number)
+        return pageList
+
+    def layoutImportedPages(self, pageList):
         yield "Initializing Submodel Images"
         self.mainModel.addSubmodelImages()
 
@@ -105,6 +122,7 @@ class Instructions(QObject):
         for page in pageList:
             page.initLayout()
 
+    def mergeImportedPages(self, pageList):
         yield "Reconfiguring Page Layouts"
         self.mainModel.mergeInitialPages()
         self.mainModel.reOrderSubmodelPages()
@@ -115,6 +133,17 @@ class Instructions(QObject):
                 yield label
             page.resetPageNumberPosition()
 
+    def addTemplate(self, template):
+        # Last import step: apply template, then add the part list and title pages
+        template.filename = ""  # Do not preserve default template filename
+        yield "Adding Part List Page"
+        self.template = template
+        self.mainModel.partListPages = PartListPage.createPartListPages(self)
+        template.applyFullTemplate(False)  # Template should apply to part list but not title pages
+
+        yield "Adding Title Page"
+        self.mainModel.createNewTitlePage(False)
+
     def getQuantitativeSizeMeasure(self):  # Get some arbitrary measure of how big / complex this file is (useful for progress bars)
         count = len(self.partDictionary)
         count += self.mainModel.pageCount()
@@ -154,8 +183,7 @@ class Instructions(QObject):
         # Initialize all CSI display lists
         i = 0
         yield "Initializing CSI GL display lists"
-        csiList = self.mainModel.getCSIList()
-        for csi in csiList:
+        for csi in self.mainModel.iterCSIList():
             yield "Initializing CSI " + str(i)
             csi.createGLDisplayList()
             i += 1
@@ -236,11 +264,11 @@ class Instructions(QObject):
 
     def setAllCSIDirty(self):
         if (self.mainModel):
-            csiList = self.mainModel.getCSIList()
-            for csi in csiList:
+            for csi in self.mainModel.iterCSIList():
                 csi.isDirty = True
 
     def updateMainModel(self, updatePartList = True):
+        LicHelpers.notifyModelChanged()  # Called after parts are moved between models
         if self.mainModel.hasTitlePage():
             self.mainModel.titlePage.submodelItem.resetPixmap()
         if updatePartList:
@@ -285,7 +313,7 @@ class Instructions(QObject):
 
         self.glContext.makeCurrent()
 
-    def exportImages(self, scaleFactor = 1.0):
+    def exportImages(self, scaleFactor = 1.0, pageRange = None):
         
         pagesToDisplay = self.scene.pagesToDisplay
         self.scene.clearSelection()
@@ -294,6 +322,9 @@ class Instructions(QObject):
 
         # Build the list of pages that need to be exported
         pageList = self.mainModel.getFullPageList()
+        if pageRange is not None:  # Only export pages in [first, last], for sharded exports
+            first, last = pageRange
+            pageList = [p for p in pageList if first <= p._number <= last]
         pageList.sort(key = lambda x: x._number)
         yield len(pageList) # Special first value is number of steps in export process
 
@@ -378,6 +409,17 @@ class Instructions(QObject):
 
         yield 2 * exporter.next()
 
+        pageFilenameList = []
+        for pageFilename in exporter:
+            fn = os.path.splitext(os.path.basename(pageFilename))[0].replace('_', ' ')
+            yield "Rendering " + fn
+            pageFilenameList.append(pageFilename)
+
+        for label in self.combineImagesToPDF(filename, pageFilenameList):
+            yield label
+
+    def combineImagesToPDF(self, filename, pageFilenameList):
+
         printer = QPrinter(QPrinter.HighResolution)
         printer.setOutputFileName(filename)
         printer.setOutputFormat(QPrinter.PdfFormat)
@@ -385,12 +427,6 @@ class Instructions(QObject):
         printer.setResolution(Page.Resolution)
         printer.setPaperSize(QSizeF(Page.PageSize), QPrinter.DevicePixel)
 
-        pageFilenameList = []
-        for pageFilename in exporter:
-            fn = os.path.splitext(os.path.basename(pageFilename))[0].replace('_', ' ')
-            yield "Rendering " + fn
-            pageFilenameList.append(pageFilename)
-
         painter = QPainter()
         painter.begin(printer)
         for pageFilename in pageFilenameList:
@@ -467,6 +503,7 @@ class InstructionsProxy(object):
             parent = self.__instructions.mainModel
 
         parent.parts.append(part)
+        LicHelpers.notifyModelChanged()
 
         if parent.isSubmodel:
             parent.pages[-1].steps[-1].addPart(part)
@@ -478,6 +515,7 @@ class InstructionsProxy(object):
                 p.used = True
                 parent.pages[-1]._row += 1
                 parent.submodels.append(p)
+                parent.invalidatePageIndex()
 
     def addPrimitive(self, shape, colorCode, points, parent = None):
         if parent is None:
@@ -0,0 +1,225 @@
+"""
+    Lic - Instruction Book Creation software
+    Copyright (C) 2010 Remi Gagne
+
+    This file (LicInstrumentation.py) is part of Lic.
+
+    Lic is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Lic is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/
+"""
+
+# Timing hooks around Lic's known hot paths.  Hooks are only installed while instrumentation
+# is enabled: each hooked function is swapped for a timing wrapper on enable, and the original
+# put back on disable, so there is no cost at all while it is off.  While on, every call updates
+# that hook's counters, rolling mean and histogram, and adds an event to a trace that can be
+# exported in Chrome trace format (load it in chrome://tracing or any compatible trace viewer).
+# Hit and miss counts of LicLayoutEngine's layout caches are always kept, and shown alongside.
+
+import bisect
+import collections
+import json
+import thread
+import time
+
+from LicCommonImports import *
+
+import LicLayoutEngine
+
+HistogramBounds = [0.1, 0.3, 1, 3, 10, 30, 100, 300, 1000]  # Bucket upper bounds, in ms.  Last bucket is anything slower
+RollingWindow = 200       # Calls kept per hook for the rolling mean
+MaxTraceEvents = 200000   # Oldest trace events are dropped past this
+
+enabled = False
+stats = {}  # {hook name: HookStats}
+traceEvents = collections.deque(maxlen = MaxTraceEvents)  # [(hook name, start time, duration, thread id)]
+installed = []  # [(owner, attribute name, original)], while enabled
+
+class HookStats(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.recent = collections.deque(maxlen = RollingWindow)
+        self.histogram = [0] * (len(HistogramBounds) + 1)
+
+    def add(self, ms):
+        self.count += 1
+        self.total += ms
+        self.maximum = max(self.maximum, ms)
+        self.recent.append(ms)
+        self.histogram[bisect.bisect_left(HistogramBounds, ms)] += 1
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def rollingMean(self):
+        return sum(self.recent) / len(self.recent) if self.recent else 0.0
+
+def getHookPoints():
+    # [(class or module, attribute name, hook name)]
+    import LicCustomPages
+    import LicGraphicsWidget
+    import LicModel
+
+    return [(LicModel.CSI, 'resetPixmap', "CSI.resetPixmap"),
+            (LicModel.AbstractPart, 'createGLDisplayList', "AbstractPart.createGLDisplayList"),
+            (LicGLHelpers, '_getBounds', "LicGLHelpers._getBounds"),
+            (LicCustomPages.Page, 'initLayout', "Page.initLayout"),
+            (LicModel.PLI, 'initLayout', "PLI.initLayout"),
+            (LicGraphicsWidget.LicGraphicsScene, 'drawItems', "LicGraphicsScene.drawItems"),
+            (LicGraphicsWidget.LicGraphicsScene, 'snap', "LicGraphicsScene.snap")]
+
+def timed(name, function):
+    entry = stats[name]
+
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            duration = time.time() - start
+            entry.add(duration * 1000.0)
+            traceEvents.append((name, start, duration, thread.get_ident()))
+    return wrapper
+
+def setEnabled(enable):
+    global enabled
+    if enable == enabled:
+        return
+
+    if enable:
+        for owner, attribute, name in getHookPoints():
+            original = owner.__dict__[attribute]  # Not getattr: that would give an unbound method for classes
+            if name not in stats:
+                stats[name] = HookStats(name)
+            installed.append((owner, attribute, original))
+            setattr(owner, attribute, timed(name, original))
+    else:
+        while installed:
+            owner, attribute, original = installed.pop()
+            setattr(owner, attribute, original)
+    enabled = enable
+
+def reset():
+    for entry in stats.values():
+        entry.reset()
+    for cache in LicLayoutEngine.caches:
+        cache.resetCounts()
+    traceEvents.clear()
+
+def getCacheCounts():
+    # [(cache name, hits, misses)] for each of LicLayoutEngine's layout caches
+    return [(cache.name, cache.hits, cache.misses) for cache in LicLayoutEngine.caches]
+
+def exportTrace(filename):
+    # Chrome trace format: one complete ('X') event per call, times in microseconds
+    origin = traceEvents[0][1] if traceEvents else 0.0
+    pid = os.getpid()
+    events = []
+    for name, start, duration, threadID in traceEvents:
+        events.append({"name": name, "cat": "lic", "ph": "X", "pid": pid, "tid": threadID,
+                       "ts": (start - origin) * 1000000.0, "dur": duration * 1000000.0})
+
+    f = open(filename, 'w')
+    json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    f.close()
+    return len(events)
+
+class StatsDock(QDockWidget):
+
+    columns = ["Hook", "Calls", "Total (ms)", "Mean (ms)", "Recent mean (ms)", "Max (ms)", "Histogram"]
+    cacheColumns = ["Layout cache", "Hits", "Misses", "Hit rate"]
+    refreshInterval = 1000  # ms
+
+    def __init__(self, parent):
+        QDockWidget.__init__(self, "Performance Stats", parent)
+        self.setObjectName("StatsDock")
+
+        self.enableCheck = QCheckBox("&Enabled")
+        self.enableCheck.setChecked(enabled)
+        self.connect(self.enableCheck, SIGNAL("toggled(bool)"), self.setInstrumentation)
+
+        resetButton = QPushButton("&Reset")
+        self.connect(resetButton, SIGNAL("clicked()"), self.reset)
+        exportButton = QPushButton("E&xport Trace...")
+        self.connect(exportButton, SIGNAL("clicked()"), self.exportTrace)
+
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.verticalHeader().hide()
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        bounds = ["< %g" % b for b in HistogramBounds] + [">= %g" % HistogramBounds[-1]]
+        self.table.horizontalHeaderItem(len(self.columns) - 1).setToolTip("Calls in each bucket (ms): " + ", ".join(bounds))
+
+        self.cacheTable = QTableWidget(0, len(self.cacheColumns))
+        self.cacheTable.setHorizontalHeaderLabels(self.cacheColumns)
+        self.cacheTable.verticalHeader().hide()
+        self.cacheTable.setEditTriggers(QAbstractItemView.NoEditTriggers)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.enableCheck)
+        buttons.addStretch()
+        buttons.addWidget(resetButton)
+        buttons.addWidget(exportButton)
+
+        layout = QVBoxLayout()
+        layout.addLayout(buttons)
+        layout.addWidget(self.table)
+        layout.addWidget(self.cacheTable)
+        widget = QWidget()
+        widget.setLayout(layout)
+        self.setWidget(widget)
+
+        self.timer = QTimer(self)
+        self.connect(self.timer, SIGNAL("timeout()"), self.refresh)
+        self.timer.start(self.refreshInterval)
+
+    def setInstrumentation(self, enable):
+        setEnabled(enable)
+        self.refresh()
+
+    def reset(self):
+        reset()
+        self.refresh()
+
+    def refresh(self):
+        if not self.isVisible():
+            return
+
+        entries = sorted(stats.values(), key = lambda x: x.name)
+        self.table.setRowCount(len(entries))
+        for row, entry in enumerate(entries):
+            values = [entry.name, str(entry.count), "%.1f" % entry.total, "%.2f" % entry.mean(),
+                      "%.2f" % entry.rollingMean(), "%.2f" % entry.maximum, " ".join([str(x) for x in entry.histogram])]
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(value))
+        self.table.resizeColumnsToContents()
+
+        counts = getCacheCounts()
+        self.cacheTable.setRowCount(len(counts))
+        for row, (name, hits, misses) in enumerate(counts):
+            rate = "%.0f%%" % (100.0 * hits / (hits + misses)) if hits + misses else "-"
+            for column, value in enumerate([name, str(hits), str(misses), rate]):
+                self.cacheTable.setItem(row, column, QTableWidgetItem(value))
+        self.cacheTable.resizeColumnsToContents()
+
+    def exportTrace(self):
+        filename = unicode(QFileDialog.getSaveFileName(self, "Lic - Export Trace", "lic_trace.json", "Trace files (*.json)"))
+        if filename:
+            count = exportTrace(filename)
+            self.parent().statusBar().showMessage("Exported %d trace events to %s" % (count, filename), 3000)
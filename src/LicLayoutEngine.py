@@ -0,0 +1,415 @@
+"""
+    Lic - Instruction Book Creation software
+    Copyright (C) 2010 Remi Gagne
+
+    This file (LicLayoutEngine.py) is part of Lic.
+
+    Lic is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Lic is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/
+"""
+
+# Layout arithmetic for Pages, Steps, PLIs and Callouts, on plain numbers.  Rects are (x, y, width, height)
+# and sizes (width, height) tuples; nothing here knows about Qt or the scene.  GridLayout, Step and PLI
+# read their items' sizes into records, get every position from here in one go, then apply them to
+# the scene; LicPagination uses the same functions to try out layouts without touching the scene.
+# Results only depend on the arguments, so recent ones are kept in LRU caches keyed by those
+# arguments, and identical Steps, PLIs and Page grids are only laid out once.  Callers must treat
+# results as read only, since they may be shared.
+
+import collections
+import math
+
+import LicPacking
+
+Horizontal = 0
+Vertical = 1
+
+GridMargin = 15
+
+caches = []  # Every LRUCache, for LicInstrumentation
+
+class LRUCache(object):
+    """ The most recent results of one layout function, with hit & miss counts. """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.entries = collections.OrderedDict()  # Least recently used first
+        self.hits = self.misses = 0
+        caches.append(self)
+
+    def lookup(self, key, function, *args):
+        try:
+            value = self.entries.pop(key)
+            self.hits += 1
+        except KeyError:
+            value = function(*args)
+            self.misses += 1
+            if len(self.entries) >= self.size:
+                self.entries.popitem(last = False)
+        self.entries[key] = value
+        return value
+
+    def clear(self):
+        self.entries.clear()
+
+    def resetCounts(self):
+        self.hits = self.misses = 0
+
+gridCache = LRUCache("gridLayout", 1024)
+crossCache = LRUCache("crossLayout", 1024)
+insideOutCache = LRUCache("insideOutLayout", 1024)
+pliCache = LRUCache("packPLI", 4096)
+stepCache = LRUCache("layoutStep", 4096)
+
+class StepRecord(object):
+    """ Size of everything in a Step that affects its layout.  See Step.getLayoutRecord. """
+
+    def __init__(self, csi, number = None, rotateIcon = None, callouts = None, pliItems = None, hasSubmodel = False,
+                 pliPacking = LicPacking.Rows):
+        self.csi = csi
+        self.number = number
+        self.rotateIcon = rotateIcon
+        self.callouts = callouts or []
+        self.pliItems = pliItems or []  # In the order the PLI places them
+        self.hasSubmodel = hasSubmodel
+        self.pliPacking = pliPacking  # LicPacking method
+
+class StepLayout(object):
+    """ Positions of everything in a Step, in Step coordinates.  See layoutStep. """
+
+    def __init__(self):
+        self.pliSize = (0.0, 0.0)
+        self.pliPositions = []
+        self.numberPos = None
+        self.csiPos = None
+        self.calloutPositions = []
+        self.rotateIconPos = None
+        self.bounds = None  # Bounding rect of all the above, which Step.resetRect makes the Step's rect
+
+def maxSafe(s):
+    return max(s) if s else 0.0
+
+def orientedSize(size, orientation):
+    return size[0] if orientation == Horizontal else size[1]
+
+def rowColCount(count, orientation, rowCount = -1, colCount = -1):
+    if rowCount != -1 and colCount != -1:
+        return (min(count, rowCount), min(count, colCount))
+
+    x = int(math.ceil(math.sqrt(count)))
+    y = count // x  # This needs to be integer division
+    if count % x:
+        y += 1
+    return (y, x) if orientation == Horizontal else (x, y)
+
+def gridLayout(rect, members, orientation, rows, cols, margin = GridMargin):
+    """
+    Divide rect into rows & columns, and return the rect each member is laid out in.  members holds
+    the rect of each fixed size member and None for the rest; non-fixed members share out what the
+    fixed ones leave.  Also returns [(member index, x, y)], where a separator follows each row but the last.
+    """
+    key = (rect, tuple(members), orientation, rows, cols, margin)
+    return gridCache.lookup(key, _gridLayout, rect, members, orientation, rows, cols, margin)
+
+def _gridLayout(rect, members, orientation, rows, cols, margin):
+    rx, ry, rw, rh = rect
+    if orientation == Vertical:
+        cols, rows = rows, cols
+
+    length = orientedSize((rw, rh), orientation)
+    across = orientedSize((rw, rh), not orientation)
+
+    # Size of each row: the biggest fixed member in it, or a fair share of what's left
+    sizeList = []
+    for i in range(0, len(members), cols):
+        fixed = [m[2:] for m in members[i : i + cols] if m is not None]
+        sizeList.append(maxSafe([orientedSize(m, not orientation) + margin * 2 for m in fixed]))
+
+    eachRowHeight = across / rows  # size if no members are fixed
+    if any(i == 0 for i in sizeList):  # Have fixed members
+        nonFixedHeight = (across - sum(sizeList)) / sizeList.count(0)  # size of non-fixed rows
+        eachRowHeight = min(eachRowHeight, nonFixedHeight)
+    sizeList = [max(i, eachRowHeight) for i in sizeList]
+
+    cells, separators = [], []
+    sx, sy = rx, ry
+    for i in range(0, len(members), cols):
+        rowMembers = members[i : i + cols]
+        size = sizeList[i // cols]
+
+        rowLength = length
+        fixedCount = 0
+        for m in [m for m in rowMembers if m is not None]:
+            rowLength -= orientedSize(m[2:], orientation) + margin * 2
+            fixedCount += 1
+        rowLength = rowLength / (len(rowMembers) - fixedCount) if len(rowMembers) > fixedCount else 0.0
+        width, height = (rowLength, size) if orientation == Horizontal else (size, rowLength)
+
+        # Each member sits beside its predecessor, shrunk by margin
+        x, y = sx, sy
+        for m in rowMembers:
+            if m is not None:  # Fixed member's rect is moved so its top left is the row's start: bottom right stays put
+                w, h = m[0] + m[2] + margin * 2 - sx, m[1] + m[3] + margin * 2 - sy
+            else:
+                w, h = width, height
+            cells.append((x + margin, y + margin, w - margin * 2, h - margin * 2))
+            if orientation == Horizontal:
+                x += w
+            else:
+                y += h
+
+        sx, sy = (rx, sy + size) if orientation == Horizontal else (sx + size, ry)
+        if i + cols < len(members):
+            separators.append((i + len(rowMembers) - 1, sx, sy))
+
+    return cells, separators
+
+def crossLayout(rect, sizes, margin = GridMargin):
+    # Position of each member in a cross that fits inside rect.  Max 9 members:
+    # -5- -3- -6-
+    # -2- -0- -1-
+    # -7- -4- -8-
+    return crossCache.lookup((rect, tuple(sizes), margin), _crossLayout, rect, sizes, margin)
+
+def _crossLayout(rect, sizes, margin):
+    indices = [(1,1), (1,2), (1,0), (0,1), (2,1), (0,0), (0,2), (2,0), (2,2)]
+    rowHeights, colWidths = [[], [], []], [[], [], []]
+
+    # Store the size of each member in the appropriate row col spot, and use only the biggest in each
+    for i, (w, h) in enumerate(sizes):
+        row, col = indices[i]
+        rowHeights[row].append(h + margin * 2)
+        colWidths[col].append(w + margin * 2)
+    rowHeights = [maxSafe(row) for row in rowHeights]
+    colWidths = [maxSafe(col) for col in colWidths]
+
+    # Enlarge each row / col so overall cross fits tight inside rect
+    dx = (rect[2] - sum(colWidths)) / 3.0
+    dy = (rect[3] - sum(rowHeights)) / 3.0
+    colWidths = [x + dx for x in colWidths]
+    rowHeights = [y + dy for y in rowHeights]
+
+    positions = []
+    for i, (w, h) in enumerate(sizes):
+        row, col = indices[i]
+        x = sum(colWidths[:col]) + rect[0]
+        y = sum(rowHeights[:row]) + rect[1]
+
+        # Move to center of cell, if necessary
+        dx = (colWidths[col] - w) / 2.0
+        dy = (rowHeights[row] - h) / 2.0
+        if dx > 0 or dy > 0:
+            x, y = x + dx, y + dy
+        positions.append((x, y))
+    return positions
+
+def insideOutLayout(sizes, rows, cols, margin = GridMargin):
+    # Position of each member in a grid just big enough for them all, filled column by column
+    return insideOutCache.lookup((tuple(sizes), rows, cols, margin), _insideOutLayout, sizes, rows, cols, margin)
+
+def _insideOutLayout(sizes, rows, cols, margin):
+    rowHeights = [maxSafe([s[1] for s in sizes[i::rows]]) for i in range(rows)]
+    colWidths = [maxSafe([s[0] for s in sizes[i * rows : (i * rows) + rows]]) for i in range(cols)]
+
+    positions = []
+    for i, (w, h) in enumerate(sizes):
+        row, col = i % rows, i // rows
+        x = sum(colWidths[:col]) + (margin * (col + 1))
+        y = sum(rowHeights[:row]) + (margin * (row + 1))
+
+        # Move to center of cell, if necessary
+        dx = (colWidths[col] - w) / 2.0
+        dy = (rowHeights[row] - h) / 2.0
+        if dx > 0 or dy > 0:
+            x, y = x + dx, y + dy
+        positions.append((x, y))
+    return positions
+
+def packPLI(sizes, maxWidth, margin, method = LicPacking.Rows):
+    """
+    Place PLI items, given their sizes in placing order (see PLI.getLayoutOrder), in rows no wider than maxWidth,
+    or with one of LicPacking's packers.  Returns each item's position, and the PLI's size.
+    """
+    if method == LicPacking.Rows:
+        return pliCache.lookup((tuple(sizes), maxWidth, margin, method), _packPLI, sizes, maxWidth, margin)
+    return pliCache.lookup((tuple(sizes), maxWidth, margin, method), LicPacking.packStrip, sizes, maxWidth, margin, method)
+
+def _packPLI(sizes, maxWidth, margin):
+    xMargin, yMargin = margin
+    overallX = maxX = xMargin
+    overallY = maxY = yMargin
+    boxHeight = -1.0
+    positions = [None] * len(sizes)
+    partList = range(len(sizes))
+    prevItem = None  # (x, y, width, height)
+    remainingHeight = 0.0
+
+    while partList:
+
+        item = None
+        if prevItem:
+            remainingHeight = boxHeight - prevItem[1] - prevItem[3] - yMargin - yMargin
+
+        # Check if we can fit any parts under the last part without extending the PLI box vertically
+        if remainingHeight > 0:
+            for i, index in enumerate(partList):
+                if sizes[index][1] < remainingHeight:
+                    item = partList.pop(i)
+                    break
+
+        # Found an item that fits below the previous - put it there
+        if item is not None:
+            overallX = prevItem[0]
+            newWidth = prevItem[2]
+            x, y = overallX, prevItem[1] + prevItem[3] + yMargin
+
+        # Use last item in list (widest)
+        else:
+            item = partList.pop()
+            x, y = overallX, overallY
+            newWidth = sizes[item][0]
+
+        # Increase overall x, to make PLI box big enough for this part
+        overallX += newWidth + xMargin
+
+        # If this part pushes this PLI beyond the step's right edge, wrap to new line
+        if overallX > maxWidth:
+            overallX = xMargin
+            overallY = boxHeight
+            x, y = overallX, overallY
+            overallX += newWidth + xMargin
+
+        maxX = max(maxX, overallX)
+        maxY = max(maxY, overallY + sizes[item][1] + yMargin)
+        boxHeight = maxY
+        positions[item] = (x, y)
+        prevItem = (x, y) + sizes[item]
+
+    return positions, ((maxX, maxY) if sizes else (0.0, 0.0))
+
+def rotateIconPosition(csiPos, iconSize, pageMargin, pliBottom = None):
+    # Above and left of the CSI, or beside it if the PLI is in the way
+    x = csiPos[0] - iconSize[0] - pageMargin[0]
+    y = csiPos[1] - iconSize[1] - pageMargin[1]
+    if pliBottom is not None and y < pliBottom:
+        y = csiPos[1]  # Not enough space to place above CSI, so put beside
+        x -= pageMargin[0]
+    return (x, y)
+
+def layoutStep(record, width, height, pageMargin, pliMargin, margin = GridMargin):
+    # Lay out a Step whose rect is (0, 0, width, height): PLI in the top left, Step number beneath
+    # it, and CSI centered in the rest, or in a cross with the Step's Callouts around it
+    key = (record.csi, record.number, record.rotateIcon, tuple(record.callouts), tuple(record.pliItems), record.pliPacking,
+           width, height, pageMargin, pliMargin, margin)
+    return stepCache.lookup(key, _layoutStep, record, width, height, pageMargin, pliMargin, margin)
+
+def _layoutStep(record, width, height, pageMargin, pliMargin, margin):
+    layout = StepLayout()
+    children = []  # Rect of each child, for the Step's bounds
+
+    pliHeight = None
+    if record.pliItems:
+        layout.pliPositions, layout.pliSize = packPLI(record.pliItems, width, pliMargin, record.pliPacking)
+        pliHeight = layout.pliSize[1]
+        children.append((0.0, 0.0) + layout.pliSize)
+
+    if record.number:
+        layout.numberPos = (0.0, (pliHeight or 0.0) + pageMargin[1])
+        children.append(layout.numberPos + record.number)
+
+    top = pliHeight or 0.0
+    if record.callouts:
+        positions = crossLayout((0.0, top, width, height - top), [record.csi] + record.callouts, margin)
+        layout.csiPos = positions[0]
+        layout.calloutPositions = positions[1:]
+        children += [pos + size for pos, size in zip(layout.calloutPositions, record.callouts)]
+    else:
+        layout.csiPos = ((width - record.csi[0]) / 2.0, top + (height - top - record.csi[1]) / 2.0)
+    children.append(layout.csiPos + record.csi)
+
+    if record.rotateIcon:
+        layout.rotateIconPos = rotateIconPosition(layout.csiPos, record.rotateIcon, pageMargin, pliHeight)
+        children.append(layout.rotateIconPos + record.rotateIcon)
+
+    layout.bounds = boundingRect(children)
+    return layout
+
+def boundingRect(rects):
+    # Same as Step.resetRect: starts from (0, 0, 1, 1), and ignores empty rects
+    rects = [r for r in rects if r[2] and r[3]]
+    left = min([0.0] + [r[0] for r in rects])
+    top = min([0.0] + [r[1] for r in rects])
+    right = max([1.0] + [r[0] + r[2] for r in rects])
+    bottom = max([1.0] + [r[1] + r[3] for r in rects])
+    return (left, top, right - left, bottom - top)
+
+def stepOverlaps(record, layout, cell, pageSize):
+    # Same checks as Step.checkForLayoutOverlaps, for a Step laid out in cell (in Page coordinates)
+    left, top, stepWidth, stepHeight = layout.bounds
+    csiX, csiY = layout.csiPos[0] - left, layout.csiPos[1] - top  # Step.resetRect moves children so bounds start at (0, 0)
+    csiWidth, csiHeight = record.csi
+    pliWidth, pliHeight = layout.pliSize
+
+    if csiY < pliHeight and csiX < pliWidth:
+        return True
+    if csiY < 0:
+        return True
+    if csiWidth > stepWidth or pliWidth > stepWidth or csiY + csiHeight > stepHeight:
+        return True
+
+    x, y = cell[0] + left, cell[1] + top
+    if x < 0 or y < 0 or x + stepWidth > pageSize[0] or y + stepHeight > pageSize[1]:
+        return True
+    return False
+
+class PageRecord(object):
+    """ Page size and layout settings, its fixed size member (Submodel preview) if any, and its Steps. """
+
+    def __init__(self, insetRect, pageSize, pageMargin, pliMargin, steps, fixedMember = None,
+                 orientation = Vertical, rowCount = -1, colCount = -1):
+        self.insetRect = insetRect
+        self.pageSize = pageSize
+        self.pageMargin = pageMargin
+        self.pliMargin = pliMargin
+        self.steps = steps  # [StepRecord]
+        self.fixedMember = fixedMember
+        self.orientation = orientation
+        self.rowCount, self.colCount = rowCount, colCount
+
+class PageLayout(object):
+    """ Where everything on a Page goes.  See layoutPage. """
+
+    def __init__(self):
+        self.fixedCell = None
+        self.steps = []  # [(cell, StepLayout)], one for each Step
+        self.separators = []  # [(member index, x, y)], as gridLayout returns them
+
+def layoutPage(page, orientation = None):
+    # Lay out page's Steps in a grid, in page.orientation unless another orientation is given
+    orientation = page.orientation if orientation is None else orientation
+    members = ([page.fixedMember] if page.fixedMember else []) + [None] * len(page.steps)
+    rows, cols = rowColCount(len(members), orientation, page.rowCount, page.colCount)
+
+    layout = PageLayout()
+    cells, layout.separators = gridLayout(page.insetRect, members, orientation, rows, cols)
+    if page.fixedMember:
+        layout.fixedCell, cells = cells[0], cells[1:]
+
+    for record, cell in zip(page.steps, cells):
+        layout.steps.append((cell, layoutStep(record, cell[2], cell[3], page.pageMargin, page.pliMargin)))
+    return layout
+
+def layoutBook(pages):
+    # layoutPage for each of pages, in its own orientation
+    return [layoutPage(page) for page in pages]
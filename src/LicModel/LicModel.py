@@ -18,6 +18,7 @@
     along with this program.  If not, see http://www.gnu.org/licenses/
 """
 
+import bisect
 import colorsys
 
 from LicCommonImports import *
@@ -32,6 +33,11 @@ from LicUndoActions import *
 from LicTreeModel import *
 from LicQtWrapper import *
 
+import LicAutoStep
+import LicBookLayout
+import LicLayoutEngine
+import LicPacking
+import LicPagination
 import LicPartLengths
 import LicImporters
 import LicDialogs
@@ -294,6 +300,7 @@ class Callout(CalloutTreeManager, GraphicsRoundRectItem):
         self.arrow = CalloutArrow(self)
         self.steps = []
         self.mergedCallouts = []
+        self.partSignature = {}  # {(part filename, color code): count}, to find Callouts with the same parts
         self.number = number
         self.qtyLabel = None
         self.showStepNumbers = showStepNumbers
@@ -326,11 +333,13 @@ class Callout(CalloutTreeManager, GraphicsRoundRectItem):
         self.steps.insert(newStep._number - 1, newStep)
         newStep.setParentItem(self)
         self.syncStepNumbers()
+        LicHelpers.notifyModelChanged()
 
     def removeStep(self, step):
         self.scene().removeItem(step)
         self.steps.remove(step)
         self.syncStepNumbers()
+        LicHelpers.notifyModelChanged()
 
     def syncStepNumbers(self):
         for i, step in enumerate(self.steps):
@@ -353,6 +362,7 @@ class Callout(CalloutTreeManager, GraphicsRoundRectItem):
         if step is None:
             step = self.steps[-1]
         step.addPart(newPart)
+        self.countPart(newPart, 1)
 
     def removePart(self, part):
         newPart = part.calloutPart
@@ -360,6 +370,28 @@ class Callout(CalloutTreeManager, GraphicsRoundRectItem):
         part.calloutPart = None
         for step in self.steps:
             step.removePart(newPart)
+        self.countPart(newPart, -1)
+
+    @staticmethod
+    def partKey(part):
+        return (part.filename, part.color.ldrawCode if part.color else None)
+
+    def countPart(self, part, delta):
+        key = Callout.partKey(part)
+        count = self.partSignature.get(key, 0) + delta
+        if count > 0:
+            self.partSignature[key] = count
+        else:
+            self.partSignature.pop(key, None)
+
+    def resetPartSignature(self):
+        self.partSignature = {}
+        for part in self.getPartList():
+            self.countPart(part, 1)
+
+    def getPartSignature(self):
+        # Hashable, and equal for any two Callouts with the same number of each part in each color
+        return frozenset(self.partSignature.items())
 
     def getPartList(self):
         partList = []
@@ -546,26 +578,8 @@ class Callout(CalloutTreeManager, GraphicsRoundRectItem):
         if self.parentItem() != callout.parentItem():
             return False
 
-        c1Parts = self.getPartList()
-        c2Parts = callout.getPartList()
-        
-        if len(c1Parts) != len(c2Parts):
-            return False
-        
-        # Add a temporary equality check to Parts, to make the next step easier
-        Part.__eq__ = lambda self, other: self.color == other.color and self.filename == other.filename
-        
-        # Check if two callout part lists have basically the same parts
-        # Two parts are similar if they have the same filename & color (matrix is irrelevant here (__eq__ above))
-        for p1 in c1Parts:
-            if p1 in c2Parts:
-                c2Parts.remove(p1)
-            else:
-                del(Part.__eq__)
-                return False
-
-        del(Part.__eq__)
-        return True
+        # Two parts are similar if they have the same filename & color (matrix is irrelevant here)
+        return self.partSignature == callout.partSignature
     
     def mergeCalloutContextMenu(self, event):
         menu = QMenu(self.scene().views()[0])
@@ -773,17 +787,18 @@ class Step(StepTreeManager, QGraphicsRectItem):
     """ A single step in an Instruction book.  Contains one optional PLI and exactly one CSI. """
     itemClassName = "Step"
 
-    def __init__(self, parentPage, number, hasPLI = True, hasNumberItem = True):
+    def __init__(self, parentPage, number, hasPLI = True, hasNumberItem = True, createChildren = True):
         QGraphicsRectItem.__init__(self, parentPage)
 
         # Children
         self._number = number
         self.numberItem = None
-        self.csi = CSI(self)
-        self.pli = PLI(self) if hasPLI else None
+        self.csi = CSI(self) if createChildren else None
+        self.pli = PLI(self) if (hasPLI and createChildren) else None
         self._hasPLI = hasPLI
         self.callouts = []
         self.rotateIcon = None
+        self._prevStep = self._nextStep = None  # Neighbours by number, set by Submodel.getStepIndex
         
         self.maxRect = QRectF()
 
@@ -796,10 +811,18 @@ class Step(StepTreeManager, QGraphicsRectItem):
         self.setAcceptHoverEvents(True)
         self.setFlags(AllFlags)
 
+    @staticmethod
+    def createForLoad(parent, number, hasPLI, hasNumberItem):
+        # Step without a CSI or PLI, so the loader can create those directly from the file
+        return Step(parent, number, hasPLI, hasNumberItem, False)
+
     def _setNumber(self, number):
         self._number = number
         if self.numberItem:
             self.numberItem.setText("%d" % self._number)
+        parent = self.parentItem()
+        if parent and not self.isInCallout() and parent.submodel:
+            parent.submodel.invalidateStepIndex()
 
     def _getNumber(self):
         return self._number
@@ -837,10 +860,12 @@ class Step(StepTreeManager, QGraphicsRectItem):
     def addCallout(self, callout):
         callout.setParentItem(self)
         self.callouts.append(callout)
+        LicHelpers.notifyModelChanged()
     
     def removeCallout(self, callout):
         self.scene().removeItem(callout)
         self.callouts.remove(callout)
+        LicHelpers.notifyModelChanged()
 
     def addRotateIcon(self):
 
@@ -886,9 +911,13 @@ class Step(StepTreeManager, QGraphicsRectItem):
         return isinstance(self.parentItem(), Callout)
 
     def getNextStep(self):
+        if not self.isInCallout() and self.parentItem().submodel.getStepIndex().get(self._number) is self:
+            return self._nextStep
         return self.parentItem().getStepByNumber(self._number + 1)
 
     def getPrevStep(self):
+        if not self.isInCallout() and self.parentItem().submodel.getStepIndex().get(self._number) is self:
+            return self._prevStep
         return self.parentItem().getStepByNumber(self._number - 1)
 
     def enableNumberItem(self):
@@ -948,62 +977,68 @@ class Step(StepTreeManager, QGraphicsRectItem):
          
         if destRect is None:
             destRect = self.maxRect
-        else:
-            self.maxRect = destRect
-
-        self.setPos(destRect.topLeft())
-        self.setRect(0, 0, destRect.width(), destRect.height())
-        
-        if self.hasPLI():
-            self.pli.initLayout()  # Position PLI
-
-        # Position Step number label beneath the PLI
-        if self.numberItem:
-            self.numberItem.setPos(0, 0)
-            pliOffset = self.pli.rect().height() if self.hasPLI() else 0.0
-            self.numberItem.moveBy(0, pliOffset + self.getPage().margin.y())
-
-        self.positionInternalBits()
-        self.resetRect()
 
-    def positionInternalBits(self):
+        # Get everything to its final size, then lay it all out in one go
+        pliItems = self.prepareLayout()
+        margin = self.getPage().margin
+        layout = LicLayoutEngine.layoutStep(self.getLayoutRecord(pliItems), destRect.width(), destRect.height(),
+                                            (margin.x(), margin.y()), (PLI.margin.x(), PLI.margin.y()), LicLayout.GridLayout.margin)
+        self.applyLayout(layout, pliItems, destRect)
 
-        r = self.rect()
-        
-        if self.hasPLI():
-            r.setTop(self.pli.rect().height())
+    def prepareLayout(self):
+        # Bring the CSI, PLI items and Callouts to their final size, ready for LicLayoutEngine.layoutStep.
+        # Returns the PLI items in placing order, to be passed back to applyLayout
+        pliItems = self.pli.getLayoutOrder() if self.hasPLI() else []
 
         csiWidth = self.csi.rect().width()
         csiHeight = self.csi.rect().height()
         if self.csi.isDirty or csiWidth <= 0.0 or csiHeight <= 0.0:
             self.csi.resetPixmap()
-            csiWidth = self.csi.rect().width()
-            csiHeight = self.csi.rect().height()
-
-        if not self.callouts:
-            x = (r.width() - csiWidth) / 2.0
-            y = (r.height() - csiHeight) / 2.0
-            self.csi.setPos(x, r.top() + y)
-            self.positionRotateIcon()
-            return
 
         for callout in self.callouts:
             callout.initLayout()
+        return pliItems
+
+    def applyLayout(self, layout, pliItems, destRect):
+        # Move this Step to destRect, and everything in it to where LicLayoutEngine.layoutStep put it
+        self.maxRect = destRect
+        self.setPos(destRect.topLeft())
+        self.setRect(0, 0, destRect.width(), destRect.height())
 
-        LicLayout.GridLayout.initCrossLayout(r, [self.csi] + self.callouts)
+        if self.hasPLI():
+            self.pli.applyLayout(pliItems, layout.pliPositions, layout.pliSize)
+        if self.numberItem:
+            self.numberItem.setPos(*layout.numberPos)
+        self.csi.setPos(*layout.csiPos)
+        for callout, pos in zip(self.callouts, layout.calloutPositions):
+            callout.setPos(*pos)
+        if self.rotateIcon:
+            self.rotateIcon.setPos(*layout.rotateIconPos)
 
-        self.positionRotateIcon()
         for callout in self.callouts:
             callout.initEndPoints()
+        self.resetRect()
+
+    def getLayoutRecord(self, pliItems = None):
+        # Size of everything in this Step, for LicLayoutEngine.  pliItems are this Step's PLI items in placing order, if already known
+        if pliItems is None:
+            pliItems = self.pli.getLayoutOrder(False) if self.hasPLI() else []
+
+        sizeOf = lambda item: (item.rect().width(), item.rect().height())
+        return LicLayoutEngine.StepRecord(sizeOf(self.csi),
+                                          sizeOf(self.numberItem) if self.numberItem else None,
+                                          sizeOf(self.rotateIcon) if self.rotateIcon else None,
+                                          [sizeOf(c) for c in self.callouts],
+                                          [sizeOf(i) for i in pliItems],
+                                          any(p.isSubmodel for p in self.csi.getPartList()),
+                                          PLI.packingMethod)
 
     def positionRotateIcon(self):
         if self.rotateIcon:
             margin = self.getPage().margin
-            x = self.csi.pos().x() - self.rotateIcon.rect().width() - margin.x()
-            y = self.csi.pos().y() - self.rotateIcon.rect().height() - margin.y()
-            if self.hasPLI() and y < self.pli.rect().bottom():
-                y = self.csi.pos().y()  # Not enough space to place above CSI, so put beside
-                x -= margin.x()
+            pos, r = self.csi.pos(), self.rotateIcon.rect()
+            pliBottom = self.pli.rect().bottom() if self.hasPLI() else None
+            x, y = LicLayoutEngine.rotateIconPosition((pos.x(), pos.y()), (r.width(), r.height()), (margin.x(), margin.y()), pliBottom)
             self.rotateIcon.setPos(x, y)
 
     def glItemIterator(self):
@@ -1317,6 +1352,21 @@ class SubmodelPreview(SubmodelPreviewTreeManager, GraphicsRoundRectItem, RotateS
     def hasQuantity(self):
         return self.numberItem is not None and self.quantity > 0
 
+    def setQuantity(self, qty):
+        if qty > 1 and self.numberItem:
+            self.quantity = qty
+            self.numberItem.setText("%dx" % qty)
+            self.numberItem.data = lambda index: "Qty. Label (%dx)" % qty
+        elif qty > 1:
+            self.addQuantityLabel(qty)
+        elif self.numberItem:
+            if self.scene():
+                self.scene().removeItem(self.numberItem)
+            self.numberItem.setParentItem(None)
+            self.numberItem = None
+            self.quantity = 0
+        self.initLayout()
+
     def addQuantityLabel(self, qty):
         self.numberItem = QGraphicsSimpleTextItem("0x", self)
         self.numberItem.itemClassName = "SubmodelItem Quantity"
@@ -1372,6 +1422,7 @@ class PLIItem(PLIItemTreeManager, QGraphicsRectItem, RotateScaleSignalItem):
         fn = os.path.basename(filename)
         if fn and fn != originalFn:
             self.abstractPart = self.getInstructions().getAbstractPart(filename)
+            self.parentItem().reKeyPLIItem(self, originalFn)
             self.resetPixmap()
     
     def __getRotation(self):
@@ -1465,10 +1516,12 @@ class PLI(PLITreeManager, GraphicsRoundRectItem):
     itemClassName = "PLI"
 
     margin = QPointF(15, 15)
+    packingMethod = LicPacking.Rows  # Set by the template
 
     def __init__(self, parent):
         GraphicsRoundRectItem.__init__(self, parent)
-        self.pliItems = []  # {(part filename, color): PLIItem instance}
+        self.pliItems = []  # PLIItem instances, in tree model order
+        self.pliItemIndex = {}  # {(part filename, color code): PLIItem instance}
         self.data = lambda index: "PLI"
         self.setPos(0.0, 0.0)
         self.setFlags(AllFlags)
@@ -1482,27 +1535,52 @@ class PLI(PLITreeManager, GraphicsRoundRectItem):
         self.normalizePosition()
         self.parentItem().resetRect()
         
+    @staticmethod
+    def itemKey(filename, color):
+        return (filename, color.ldrawCode if color else None)
+
+    def addPLIItem(self, pliItem):
+        self.pliItems.append(pliItem)
+        self.pliItemIndex[PLI.itemKey(pliItem.abstractPart.filename, pliItem.color)] = pliItem
+
+    def removePLIItem(self, pliItem):
+        self.pliItems.remove(pliItem)
+        key = PLI.itemKey(pliItem.abstractPart.filename, pliItem.color)
+        if self.pliItemIndex.get(key) is pliItem:
+            del self.pliItemIndex[key]
+
+    def reKeyPLIItem(self, pliItem, oldFilename):
+        # pliItem's abstractPart changed from oldFilename
+        key = PLI.itemKey(oldFilename, pliItem.color)
+        if self.pliItemIndex.get(key) is pliItem:
+            del self.pliItemIndex[key]
+        self.pliItemIndex[PLI.itemKey(pliItem.abstractPart.filename, pliItem.color)] = pliItem
+
+    def setPLIItems(self, itemList):
+        self.pliItems = itemList
+        self.pliItemIndex = dict([(PLI.itemKey(i.abstractPart.filename, i.color), i) for i in itemList])
+
     def addPart(self, part):
 
-        for pliItem in self.pliItems:
-            if pliItem.color == part.color and pliItem.abstractPart.filename == part.abstractPart.filename:
-                return pliItem.addPart()
+        pliItem = self.pliItemIndex.get(PLI.itemKey(part.abstractPart.filename, part.color))
+        if pliItem is not None:
+            return pliItem.addPart()
 
         # If we're here, did not find an existing PLI, so create a new one
         pliItem = PLIItem(self, part.abstractPart, part.color)
         pliItem.addPart()
-        self.pliItems.append(pliItem)
+        self.addPLIItem(pliItem)
         
     def removePart(self, part):
         
-        for pliItem in self.pliItems:
-            if pliItem.color == part.color and pliItem.abstractPart.filename == part.abstractPart.filename:
-                pliItem.removePart()
-                break
+        pliItem = self.pliItemIndex.get(PLI.itemKey(part.abstractPart.filename, part.color))
+        if pliItem is None:
+            return
 
-        for pliItem in [i for i in self.pliItems if i.quantity <= 0]: # Check for & delete empty PLIItems
+        pliItem.removePart()
+        if pliItem.quantity <= 0:  # Delete now empty PLIItem
             self.scene().removeItem(pliItem)
-            self.pliItems.remove(pliItem)
+            self.removePLIItem(pliItem)
             pliItem.setParentItem(None)
 
     def removeAllParts(self):
@@ -1511,6 +1589,7 @@ class PLI(PLITreeManager, GraphicsRoundRectItem):
             scene.removeItem(pliItem.numberItem)
             scene.removeItem(pliItem)
         self.pliItems = []
+        self.pliItemIndex = {}
 
     def changePartColor(self, part, oldColor, newColor):
         part.color = oldColor
@@ -1529,7 +1608,7 @@ class PLI(PLITreeManager, GraphicsRoundRectItem):
     def initLayout(self):
         """
         Allocate space for all parts in this PLI, and choose a decent layout.
-        This is the initial algorithm used to layout a PLI.
+        Parts are placed with PLI.packingMethod, chosen in the template.
         """
 
         self.setPos(0.0, 0.0)
@@ -1539,10 +1618,20 @@ class PLI(PLITreeManager, GraphicsRoundRectItem):
             self.setRect(QRectF())
             return
 
-        # Initialize each visible item in this PLI, so they have good rects and properly positioned quantity labels
+        partList = self.getLayoutOrder()
+
+        sizes = [(i.rect().width(), i.rect().height()) for i in partList]
+        positions, size = LicLayoutEngine.packPLI(sizes, self.parentItem().rect().width(), (PLI.margin.x(), PLI.margin.y()), PLI.packingMethod)
+        self.applyLayout(partList, positions, size)
+
+    def getLayoutOrder(self, initialize = True):
+        # PLI items in the order initLayout places them
         partList = list(self.pliItems)
-        for item in partList:
-            item.initLayout()
+
+        # Initialize each visible item in this PLI, so they have good rects and properly positioned quantity labels
+        if initialize:
+            for item in partList:
+                item.initLayout()
 
         # Sort list of parts to lay out first by color (in reverse order), then by width (narrowest first), then remove tallest part, to be added first
         partList.sort(key = lambda i: i.color.sortKey(), reverse = True)  # Sort by color, reversed 
@@ -1550,86 +1639,15 @@ class PLI(PLITreeManager, GraphicsRoundRectItem):
         tallestPart = max(reversed(partList), key = lambda x: x.abstractPart.height)  # reverse list so we choose last part if two+ parts equally tall
         partList.remove(tallestPart)
         partList.append(tallestPart)
+        return partList
 
-        """
-        # Try rectangle packer instead
-        from RectanglePacker import CygonRectanglePacker
-
-        mx = self.margin.x()
-        mx2 = mx * 2.0
-        my = self.margin.y()
-        my2 = my * 2.0
-        rMaxWidth = self.parentItem().rect().width() / 2.0
-        rMaxHeight = (tallestPart.rect().height() * 1.5) + my2
-        rectanglePacker = CygonRectanglePacker(rMaxWidth, rMaxHeight)
-        
-        for pliItem in partList:
-            point = rectanglePacker.Pack(pliItem.rect().width() + mx, pliItem.rect().height() + my)
-            if point:
-                pliItem.setPos(point.x + self.margin.x(), point.y + self.margin.y())
-            else:
-                print "PLIItem doesn't fit!!!  DOOM!!!"
-                
-        rect = self.childrenBoundingRect().adjusted(-PLI.margin.x(), -PLI.margin.y(), PLI.margin.x(), PLI.margin.y())
-        self.setRect(rect)
-        
-        return
-        """
-    
-        # This rect will be enlarged as needed
-        pliBox = QRectF(0, 0, -1, -1)
-
-        overallX = maxX = xMargin = PLI.margin.x()
-        overallY = maxY = yMargin = PLI.margin.y()
+    def applyLayout(self, partList, positions, size):
+        # Place partList's items, as laid out by LicLayoutEngine.packPLI
+        self.setPos(0.0, 0.0)
+        for item, (x, y) in zip(partList, positions):
+            item.setPos(x, y)
+        self.setRect(QRectF(0.0, 0.0, size[0], size[1]))
 
-        prevItem = None
-        remainingHeight = 0.0
-        
-        while partList:
-            
-            item = None
-            
-            if prevItem:
-                remainingHeight = pliBox.height() - prevItem.pos().y() - prevItem.rect().height() - yMargin - yMargin 
-                
-            # Check if we can fit any parts under the last part without extending the PLI box vertically
-            if remainingHeight > 0:
-                for pliItem in partList:
-                    if pliItem.rect().height() < remainingHeight:
-                        item = pliItem
-                        break
-
-            # Found an item that fits below the previous - put it there
-            if item:
-                partList.remove(pliItem)
-                overallX = prevItem.pos().x()
-                newWidth = prevItem.rect().width()
-                y = prevItem.pos().y() + prevItem.rect().height() + yMargin
-                item.setPos(overallX, y)
-            
-            # Use last item in list (widest)
-            if not item:
-                item = partList.pop()
-                item.setPos(overallX, overallY)
-                newWidth = item.rect().width()
-
-            # Increase overall x, to make PLI box big enough for this part
-            overallX += newWidth + xMargin
- 
-            # If this part pushes this PLI beyond the step's right edge, wrap to new line           
-            if overallX > self.parentItem().rect().width():
-                overallX = xMargin
-                overallY = pliBox.height()
-                item.setPos(overallX, overallY)
-                overallX += newWidth + xMargin
-            
-            maxX = max(maxX, overallX)
-            maxY = max(maxY, overallY + item.rect().height() + yMargin)
-            pliBox.setWidth(maxX)
-            pliBox.setHeight(maxY)
-            self.setRect(pliBox)
-            prevItem = item
-            
         self.pliItems.sort(key = lambda i: i.pos().x())  # Sort pliITems so tree Model list roughly matches item paint order (left to right)
 
         # Need to nudge any PLIItems that have length indicators down, to accommodate placing indicators above part        
@@ -1654,9 +1672,12 @@ class CSI(CSITreeManager, QGraphicsRectItem, RotateScaleSignalItem):
         self.rotation = [0.0, 0.0, 0.0]
         self.scaling = 1.0
 
-        self.parts = []
+        self.parts = []  # PartTreeItem instances, sorted by name
+        self.partNames = []  # Names of self.parts, in the same order
+        self.partIndex = {}  # {part name: PartTreeItem instance}
         self.isDirty = True
         self.nextCSIIsDirty = False
+        self.partGLListsReady = False
 
     def getPartList(self):
         partList = []
@@ -1687,6 +1708,7 @@ class CSI(CSITreeManager, QGraphicsRectItem, RotateScaleSignalItem):
                     nextStep.csi.isDirty = nextStep.csi.nextCSIIsDirty = True
                 self.nextCSIIsDirty = False
 
+        self.initPendingGLDisplayLists()
         LicGLHelpers.pushAllGLMatrices()
 
         settings = self.getAllSettings()
@@ -1699,27 +1721,52 @@ class CSI(CSITreeManager, QGraphicsRectItem, RotateScaleSignalItem):
         GL.glCallList(self.glDispID)
         LicGLHelpers.popAllGLMatrices()
 
+    def initPendingGLDisplayLists(self):
+        # Parts loaded lazily from a .lic file compile their display lists on first draw.
+        # This CSI's list also draws every previous step, so walk back until we hit a ready CSI.
+        if AbstractPart.pendingGLListCount < 1:
+            return
+        step = self.parentItem()
+        while step and not step.csi.partGLListsReady:
+            for part in step.csi.getPartList():
+                part.abstractPart.initPendingGLDisplayLists()
+            step.csi.partGLListsReady = True
+            step = step.getPrevStep()
+
     def addPart(self, part):
-        for p in self.parts:
-            if p.name == part.abstractPart.name:
-                p.addPart(part)
-                return
+        self.partGLListsReady = False
+        name = part.abstractPart.name
+        p = self.partIndex.get(name)
+        if p is not None:
+            p.addPart(part)
+            return
             
-        p = PartTreeItem(self, part.abstractPart.name)
+        p = PartTreeItem(self, name)
         p.addPart(part)
-        self.parts.append(p)
-        self.parts.sort(key = lambda partItem: partItem.name)
+        row = bisect.bisect_right(self.partNames, name)  # Keep groups sorted by name, for the tree model
+        self.partNames.insert(row, name)
+        self.parts.insert(row, p)
+        self.partIndex[name] = p
 
     def removePart(self, part):
 
-        for p in self.parts:
-            if part in p.parts:
-                p.removePart(part)
-                break
+        p = self.partIndex.get(part.abstractPart.name)
+        if p is None or part not in p.parts:
+            p = None
+            for x in self.parts:  # Part was renamed since it was added
+                if part in x.parts:
+                    p = x
+                    break
+            if p is None:
+                return
 
-        for p in [x for x in self.parts if not x.parts]:  # Delete empty part item groups
+        p.removePart(part)
+        if not p.parts:  # Delete now empty part item group
             self.scene().removeItem(p)
-            self.parts.remove(p)
+            row = self.parts.index(p)
+            del self.parts[row]
+            del self.partNames[row]
+            del self.partIndex[p.name]
             p.setParentItem(None)
 
     def containsSubmodel(self):
@@ -1813,6 +1860,7 @@ class CSI(CSITreeManager, QGraphicsRectItem, RotateScaleSignalItem):
         if not self.parts:
             return result  # A CSI with no parts is already initialized
 
+        self.initPendingGLDisplayLists()
         settings = self.getAllSettings()
         params = LicGLHelpers.initImgSize(size, self.glDispID, filename, settings.CSI.scale * self.scaling, settings.CSI.rotation, self.rotation)
         if params is None:
@@ -1967,17 +2015,21 @@ class AbstractPart(object):
     everything inside 3001.dat.
     """
 
+    pendingGLListCount = 0  # Number of parts with reserved but not yet compiled display lists
+
     def __init__(self, filename = None):
 
         self.name = self.filename = filename
         self.invertNext = False
         self.winding = GL.GL_CCW
         self.parts = []
-        self.primitives = []
-        self.edges = []
+        self._primitives = []
+        self._edges = []
+        self.geometryLoader = None  # If set, called once to fill in primitives & edges on first use
         self.glDispID = LicGLHelpers.UNINIT_GL_DISPID
         self.glEdgeDispID = LicGLHelpers.UNINIT_GL_DISPID
         self.notCurrentDispID = LicGLHelpers.UNINIT_GL_DISPID
+        self.glListPending = False
         self.isPrimitive = False  # primitive here means sub-part or part that's internal to another part
         self.isSubmodel = False
         self._boundingBox = None
@@ -1988,7 +2040,50 @@ class AbstractPart(object):
         self.width = self.height = -1
         self.leftInset = self.bottomInset = -1
         self.center = QPointF()
-        
+
+    def loadGeometry(self):
+        if self.geometryLoader:
+            loader, self.geometryLoader = self.geometryLoader, None
+            loader(self)
+
+    def _getPrimitives(self):
+        if self.geometryLoader:
+            self.loadGeometry()
+        return self._primitives
+
+    def _setPrimitives(self, primitives):
+        self._primitives = primitives
+
+    primitives = property(_getPrimitives, _setPrimitives)
+
+    def _getEdges(self):
+        if self.geometryLoader:
+            self.loadGeometry()
+        return self._edges
+
+    def _setEdges(self, edges):
+        self._edges = edges
+
+    edges = property(_getEdges, _setEdges)
+
+    def reserveGLDisplayList(self):
+        # Allocate display list IDs now, so CSI lists can call them, but only compile them when first drawn
+        if self.glDispID == LicGLHelpers.UNINIT_GL_DISPID:
+            self.glDispID = GL.glGenLists(1)
+            self.glEdgeDispID = GL.glGenLists(1)
+            self.notCurrentDispID = GL.glGenLists(1)
+            self.glListPending = True
+            AbstractPart.pendingGLListCount += 1
+
+    def initPendingGLDisplayLists(self):
+        # Must not be called while another display list is being compiled
+        if AbstractPart.pendingGLListCount < 1:
+            return
+        for part in self.parts:
+            part.abstractPart.initPendingGLDisplayLists()
+        if self.glListPending:
+            self.createGLDisplayList(True)
+
     def addPrimitive(self, primitive):
         if primitive.type == GL.GL_LINES:
             self.edges.append(primitive)
@@ -2019,9 +2114,13 @@ class AbstractPart(object):
         # Ensure any parts in this part have been initialized
         if not skipPartInit:
             for part in self.parts:
-                if part.abstractPart.glDispID == LicGLHelpers.UNINIT_GL_DISPID:
+                if part.abstractPart.glDispID == LicGLHelpers.UNINIT_GL_DISPID or part.abstractPart.glListPending:
                     part.abstractPart.createGLDisplayList()
 
+        if self.glListPending:
+            self.glListPending = False
+            AbstractPart.pendingGLListCount -= 1
+
         # Create a display list for this part's sub-parts and polygons (everything but edges)
         if self.glDispID == LicGLHelpers.UNINIT_GL_DISPID:
             self.glDispID = GL.glGenLists(1)
@@ -2111,6 +2210,7 @@ class AbstractPart(object):
         # TODO: If a part is rendered at a size > 256, draw it smaller in the PLI - this sounds like a great way to know when to shrink a PLI image...
         rotation = templateSettings.SubmodelPreview.rotation if self.isSubmodel else templateSettings.PLI.rotation
         scaling = templateSettings.SubmodelPreview.scale if self.isSubmodel else templateSettings.PLI.scale
+        self.initPendingGLDisplayLists()  # Lazily loaded parts may not have compiled their lists yet
         params = LicGLHelpers.initImgSize(size, self.glDispID, self.filename, scaling * extraScale, rotation, extraRotation)
         if params is None:
             return False
@@ -2120,6 +2220,7 @@ class AbstractPart(object):
 
     def paintGL(self, dx, dy, templateSettings, rotation = [0.0, 0.0, 0.0], scaling = 1.0, color = None):
 
+        self.initPendingGLDisplayLists()
         LicGLHelpers.pushAllGLMatrices()
 
         dr = templateSettings.SubmodelPreview.rotation if self.isSubmodel else templateSettings.PLI.rotation
@@ -2256,6 +2357,10 @@ class Submodel(SubmodelTreeManager, AbstractPart):
 
         self.pages = []
         self.submodels = []
+        self._stepIndex = None  # {step number: Step}, for this submodel's own pages.  None until next needed
+        self._pageIndex = None  # {page number: Page}, for this submodel's pages and all its submodels' pages
+        self._traversals = {}   # {name: list}, built at LicHelpers.modelVersion _traversalVersion
+        self._traversalVersion = -1
 
         self._row = 0
         self._parent = parent
@@ -2308,94 +2413,25 @@ class Submodel(SubmodelTreeManager, AbstractPart):
             self.deleteEmptyPagesSteps()
             return
 
-        # Add one step for every 5 parts, and one page per step
+        # Split parts into steps of a few parts each, and one page per step
         # At this point, if model had no steps (assumed for now), we have one page per submodel
-        PARTS_PER_STEP_MAX = 5
-        
-        csi  = self.pages[0].steps[0].csi
-        while csi.partCount() > 0:
-            
-            partList = csi.getPartList()
-            #partList.sort(key = lambda x: x.xyzSortOrder())
-            partList.sort(cmp = LicHelpers.compareParts)
-            
-            part = partList[0]
-            y, dy = part.by(), part.ySize()
-            currentPartIndex = 1
-            
-            if len(partList) > 1:
-                
-                # Advance part list splice point forward until we find the next 'layer' of parts
-                nextPart = partList[currentPartIndex]
-                while y == nextPart.by() and abs(dy - nextPart.ySize()) <= 4.0:
-                    currentPartIndex += 1
-                    if currentPartIndex >= len(partList):
-                        break
-                    nextPart = partList[currentPartIndex]
-                    
-                # Here, currentPartIndex points to the next potential splice point
-                if currentPartIndex > PARTS_PER_STEP_MAX:
-                    
-                    # Have lots of parts in this layer: keep most popular part here, bump rest to next step
-                    partCounts = {}
-                    for part in partList[:currentPartIndex]:
-                        if part.abstractPart.name in partCounts:
-                            partCounts[part.abstractPart.name] += 1
-                        else:
-                            partCounts[part.abstractPart.name] = 1
-                    popularPartName = max(partCounts, key = partCounts.get)
-                    partList = [x for x in partList[:currentPartIndex] if x.abstractPart.name != popularPartName] + partList[currentPartIndex:]
-                    currentPartIndex = 0
-                    
-                elif currentPartIndex == 1 and not partList[0].isSubmodel:
-                    
-                    # Have only one part in this layer: search forward until we hit a layer with several parts
-                    part = partList[0]
-                    nextPart = partList[1]
-                    while (abs(part.by2() - nextPart.by()) <= 4.0) and \
-                          (currentPartIndex < PARTS_PER_STEP_MAX - 1) and \
-                          (currentPartIndex < len(partList) - 1):
-                        part = partList[currentPartIndex]
-                        nextPart = partList[currentPartIndex + 1]
-                        currentPartIndex += 1
-                        
-                    if currentPartIndex > 1:
-                        # Add an up displacement to last part, if it's basically above previous part
-                        p1 = partList[currentPartIndex - 1]
-                        p2 = partList[currentPartIndex]
-                        px1, pz1, px2, pz2 = p1.x(), p1.z(), p2.x(), p2.z()
-                        if abs(px1 - px2) < 2 and abs(pz1 - pz2) < 2:
-                            p2.addNewDisplacement(Qt.Key_PageUp)
-                        currentPartIndex += 1
-            
-            if len(partList[currentPartIndex: ]) == 0:
-                break  # All done
+        step = self.pages[0].steps[0]
+        stepList, displacedParts = LicAutoStep.partitionSteps(step.csi.getPartList())
 
-            # Create a new page, give it a step, then push all remaining parts to that step
+        for part in displacedParts:
+            part.addNewDisplacement(Qt.Key_PageUp)
+
+        # First step's parts stay where they are; move every other step's parts straight to their own new page
+        for partList in stepList[1:]:
             newPage = self.instructions.spawnNewPage(self, self.pages[-1]._number + 1, self.pages[-1]._row + 1)
             newPage.addBlankStep()
             self.addPage(newPage)
 
-            # Want submodels to be inserted in their own Step, so split those off
-            submodelList = [part for part in partList[:currentPartIndex] if part.isSubmodel]
-            if submodelList and len(submodelList) != currentPartIndex:
-                partList = submodelList + partList[currentPartIndex:]
-                currentPartIndex = 0
-            
-            # Want all identical submodels inserted in same step, so group them all
-            if partList[0].isSubmodel and currentPartIndex > 0:
-                partList = [part for part in partList if part.filename != partList[0].filename]
-                currentPartIndex = 0
-            
-            # Here, partList is all parts not yet allocated to a Step, and currentPartIndex is an index into  
-            # that list; parts before currentPartIndex stay in this Step, parts after get bumped to next Step
-            for part in partList[currentPartIndex: ]:  # Move all but the first x parts to next step
-                currentStep = part.getStep()
+            newStep = newPage.steps[-1]
+            for part in partList:
                 part.setParentItem(newPage)
-                currentStep.removePart(part)
-                newPage.steps[-1].addPart(part)
-
-            csi = newPage.steps[-1].csi
+                step.removePart(part)
+                newStep.addPart(part)
 
     def mergeInitialPages(self):
         
@@ -2405,44 +2441,18 @@ class Submodel(SubmodelTreeManager, AbstractPart):
         if len(self.pages) < 2:
             return
         
-        currentPage = self.pages[0]
-        nextPage = self.pages[1]
-        
-        while True:   # yeah yeah, nested infinite loops of nastiness
-            while True:
-
-                nextStep = nextPage.steps[0]
-                partList = nextStep.csi.getPartList()
-                submodelList = [p for p in partList if p.isSubmodel]
-                if submodelList:  # Check if next Step has any Submodels
-                    nextPage.initLayout()
-                    break
-
-                nextStep.moveToPage(currentPage) # Move step on next page to current page
-
-                currentLayout = currentPage.layout.orientation
-                currentPage.useHorizontalLayout()  # Try horizontal layout
-                if currentPage.checkForLayoutOverlaps(): 
-
-                    currentPage.useVerticalLayout()  # Try vertical layout
-                    if currentPage.checkForLayoutOverlaps():
-
-                        currentPage.steps[-1].moveToPage(nextPage)  # move Step back & redo layouts
-                        currentPage.layout.orientation = currentLayout
-                        currentPage.initLayout()
-                        nextPage.initLayout()
-                        break  # This page is full: move on to the next
-                    
-                tmp = nextPage.nextPage()  # No overlap - delete empty page & move on
+        # Work out every page break first, from the size of each step's parts, then move steps just once
+        pages = list(self.pages)
+        for start, end, orientation in LicPagination.paginate(pages):
+            page = pages[start]
+            for nextPage in pages[start + 1 : end]:
+                for step in list(nextPage.steps):
+                    step.moveToPage(page)
                 self.deletePage(nextPage)
-                if tmp is None:  # At last page - all done
-                    return
-                nextPage = tmp
-                    
-            currentPage = nextPage
-            nextPage = nextPage.nextPage()
-            if nextPage is None:  # At last page - all done
-                return
+
+            if orientation is not None:
+                page.layout.orientation = orientation
+            page.initLayout()
 
     def reOrderSubmodelPages(self):
         """ Reorder the tree so a submodel is right before the page it's used on """
@@ -2483,6 +2493,8 @@ class Submodel(SubmodelTreeManager, AbstractPart):
             submodel._parent = self
             submodel._row = self.rowCount()
             self.submodels.append(submodel)
+            self.invalidatePageIndex()
+            LicHelpers.notifyModelChanged()
             self.reOrderSubmodelPages()
             self.instructions.mainModel.syncPageNumbers()
             for page in submodel.pages:
@@ -2492,6 +2504,8 @@ class Submodel(SubmodelTreeManager, AbstractPart):
     def removeSubmodel(self, submodel):
         self.removeRow(submodel._row)
         self.submodels.remove(submodel)
+        self.invalidatePageIndex()
+        LicHelpers.notifyModelChanged()
         for page in submodel.pages:
             page.scene().removeItem(page)
         self.instructions.mainModel.syncPageNumbers()
@@ -2514,6 +2528,7 @@ class Submodel(SubmodelTreeManager, AbstractPart):
                 
         for page in self.pages:
             page.steps.sort(key = lambda x: x._number)
+        self.invalidateStepIndex()
     
     def syncPageNumbers(self, firstPageNumber = 1):
 
@@ -2542,6 +2557,8 @@ class Submodel(SubmodelTreeManager, AbstractPart):
         for p in self.pages[page._row : ]:
             p._row += 1
         self.pages.insert(page._row, page)
+        self.invalidatePageIndex()
+        LicHelpers.notifyModelChanged()
         page.addBlankStep()
         return page
 
@@ -2560,6 +2577,9 @@ class Submodel(SubmodelTreeManager, AbstractPart):
 
         index = len([p for p in self.pages if p._row < page._row])
         self.pages.insert(index, page)
+        self.invalidateStepIndex()
+        self.invalidatePageIndex()
+        LicHelpers.notifyModelChanged()
 
         if page in self.instructions.scene.items():
             self.instructions.scene.removeItem(page)  # Need to re-add page to trigger scene page layout
@@ -2577,6 +2597,9 @@ class Submodel(SubmodelTreeManager, AbstractPart):
 
         page.scene().removeItem(page)
         self.pages.remove(page)
+        self.invalidateStepIndex()
+        self.invalidatePageIndex()
+        LicHelpers.notifyModelChanged()
         self.instructions.updatePageNumbers(page.number, -1)
 
     def resetStepSet(self, minStepNum, maxStepNum):
@@ -2602,6 +2625,7 @@ class Submodel(SubmodelTreeManager, AbstractPart):
             for s in p.steps:
                 if s.number >= newNumber:
                     s.number += increment
+        self.invalidateStepIndex()
 
     def updatePageNumbers(self, newNumber, increment = 1):
         
@@ -2618,12 +2642,68 @@ class Submodel(SubmodelTreeManager, AbstractPart):
             del(page)
         for submodel in self.submodels:
             submodel.deleteAllPages(scene)
-
-    def getStepByNumber(self, stepNumber):
+        LicHelpers.notifyModelChanged()
+
+    def invalidateStepIndex(self):
+        self._stepIndex = None
+
+    def invalidatePageIndex(self):
+        # Page numbers run across the whole book, so every model above this one indexes its pages too
+        model = self
+        while isinstance(model, Submodel):
+            model._pageIndex = None
+            model = model._parent
+
+    def getStepIndex(self):
+        if self._stepIndex is None:
+            index = {}
+            for page in self.pages:
+                for step in page.steps:
+                    index.setdefault(step._number, step)
+            for step in index.values():
+                step._prevStep = index.get(step._number - 1)
+                step._nextStep = index.get(step._number + 1)
+            self._stepIndex = index
+        return self._stepIndex
+
+    def getPageIndex(self):
+        if self._pageIndex is None:
+            index = {}
+            for page in self.iterPageList():
+                index.setdefault(page._number, page)
+            self._pageIndex = index
+        return self._pageIndex
+
+    def findIndexErrors(self):
+        """ Compare this model's (and its submodels') step and page indices against a full scan.  Returns a list of problems found. """
+        errors = []
+
+        steps = {}
         for page in self.pages:
             for step in page.steps:
-                if step.number == stepNumber:
-                    return step
+                if step._number in steps:
+                    errors.append("%s: duplicate step number %d" % (self.filename, step._number))
+                steps.setdefault(step._number, step)
+        if self._stepIndex is not None and self._stepIndex != steps:
+            errors.append("%s: step index is stale" % self.filename)
+        for number, step in self.getStepIndex().items():
+            if step._prevStep is not steps.get(number - 1) or step._nextStep is not steps.get(number + 1):
+                errors.append("%s: step %d has wrong neighbours" % (self.filename, number))
+
+        pages = {}
+        for page in self.iterPageList():
+            pages.setdefault(page._number, page)
+        if self._pageIndex is not None and self._pageIndex != pages:
+            errors.append("%s: page index is stale" % self.filename)
+
+        for submodel in self.submodels:
+            errors += submodel.findIndexErrors()
+        return errors
+
+    def getStepByNumber(self, stepNumber):
+        step = self.getStepIndex().get(stepNumber)
+        if step:
+            return step
                 
         for submodel in self.submodels:
             step = submodel.getStepByNumber(stepNumber)
@@ -2633,14 +2713,7 @@ class Submodel(SubmodelTreeManager, AbstractPart):
         return None
 
     def getPage(self, pageNumber):
-        for page in self.pages:
-            if page.number == pageNumber:
-                return page
-        for submodel in self.submodels:
-            page = submodel.getPage(pageNumber)
-            if page:
-                return page
-        return None
+        return self.getPageIndex().get(pageNumber)
 
     def getFirstPLIItem(self):
         for page in self.pages:
@@ -2658,7 +2731,16 @@ class Submodel(SubmodelTreeManager, AbstractPart):
     def createBlankPart(self):
         return Part(self.filename, matrix = LicGLHelpers.IdentityMatrix())
 
-    def getCSIList(self):
+    def getTraversal(self, name, build):
+        # Cached result of build(), until the model next changes.  Never modify the returned list
+        if self._traversalVersion != LicHelpers.modelVersion:
+            self._traversals = {}
+            self._traversalVersion = LicHelpers.modelVersion
+        if name not in self._traversals:
+            self._traversals[name] = build()
+        return self._traversals[name]
+
+    def buildCSIList(self):
         csiList = []
         for page in self.pages:
             for step in page.steps:
@@ -2668,10 +2750,16 @@ class Submodel(SubmodelTreeManager, AbstractPart):
                         csiList.append(step2.csi)
 
         for submodel in self.submodels:
-            csiList += submodel.getCSIList()
+            csiList += submodel.getTraversal('csis', submodel.buildCSIList)
 
         return csiList
 
+    def getCSIList(self):
+        return list(self.getTraversal('csis', self.buildCSIList))
+
+    def iterCSIList(self):
+        return iter(self.getTraversal('csis', self.buildCSIList))
+
     def showHidePLIs(self, show, doLayout = False):
         for page in self.pages:
             for step in page.steps:
@@ -2679,15 +2767,14 @@ class Submodel(SubmodelTreeManager, AbstractPart):
             if doLayout:
                 page.initLayout()
 
-    def initAllPLILayouts(self):
-        for page in self.pages:
+    def initAllPLILayouts(self, otherPages = None):
+        # otherPages (part list pages) have no Steps, and are laid out in the same batch as the Step pages
+        pages = self.getPageList()
+        for page in pages:
             for step in page.steps:
-                if step.pli:
-                    step.pli.initLayout()
-            page.initLayout()
-
-        for submodel in self.submodels:
-            submodel.initAllPLILayouts()
+                if step.pli and not step.hasPLI():
+                    step.pli.initLayout()  # Page layout only lays out PLIs that are shown
+        LicBookLayout.relayoutPages(pages + (otherPages or []))
 
     def initSubmodelImages(self):
         for page in self.pages:
@@ -2705,6 +2792,17 @@ class Submodel(SubmodelTreeManager, AbstractPart):
             res += submodel._genericIterator(attr, op)
         return res
 
+    def buildPartSignature(self):
+        signature = {}
+        for part in self.parts:
+            key = (part.filename, part.color.ldrawCode if part.color else None)
+            signature[key] = signature.get(key, 0) + 1
+        return frozenset(signature.items())
+
+    def getPartSignature(self):
+        # Hashable, and equal for any two Submodels with the same number of each part in each color
+        return self.getTraversal('signature', self.buildPartSignature)
+
     def submodelInstanceCount(self, submodelName):
         count = len([p for p in self.parts if p.filename == submodelName])
         for submodel in self.submodels:
@@ -2712,21 +2810,31 @@ class Submodel(SubmodelTreeManager, AbstractPart):
         return count
 
     def submodelCount(self):
-        return self._genericIterator('submodels', len)
+        return self.getTraversal('submodelCount', lambda: self._genericIterator('submodels', len))
 
     def pageCount(self):
-        return self._genericIterator('pages', len)
+        return len(self.getTraversal('pages', lambda: self._genericIterator('pages', list)))
 
     def getPageList(self):
-        return self._genericIterator('pages', list)
+        return list(self.getTraversal('pages', lambda: self._genericIterator('pages', list)))
 
-    def getFullPartList(self):
+    def iterPageList(self):
+        return iter(self.getTraversal('pages', lambda: self._genericIterator('pages', list)))
+
+    def buildFullPartList(self):
         partList = [] 
         for part in [p for p in self.parts if p.isSubmodel]:
-            partList += part.abstractPart.getFullPartList()
+            model = part.abstractPart
+            partList += model.getTraversal('parts', model.buildFullPartList)
         partList += [p for p in self.parts if not p.isSubmodel]
         return partList
 
+    def getFullPartList(self):
+        return list(self.getTraversal('parts', self.buildFullPartList))
+
+    def iterFullPartList(self):
+        return iter(self.getTraversal('parts', self.buildFullPartList))
+
     def addSubmodelImages(self):
         count = self.instructions.mainModel.submodelInstanceCount(self.filename)
         self.pages[0].addSubmodelImage(count)
@@ -2843,6 +2951,76 @@ class Mainmodel(MainModelTreeManager, Submodel):
         pages = [self.titlePage] if self.titlePage else []
         return pages + Submodel.getPageList(self) + self.partListPages
 
+    def buildCalloutIndex(self):
+        index = {}
+        for page in self.iterPageList():
+            for step in page.steps:
+                for callout in step.callouts:
+                    if callout.partSignature:
+                        index.setdefault(callout.getPartSignature(), []).append(callout)
+        return dict([(k, v) for k, v in index.items() if len(v) > 1])
+
+    def findIdenticalCallouts(self):
+        # {part signature: [Callouts]}, for each set of parts found in more than one Callout in the book.  Never modify the returned dict
+        return self.getTraversal('identicalCallouts', self.buildCalloutIndex)
+
+    def buildSubmodelIndex(self):
+        index = {}
+        stack = list(self.submodels)
+        while stack:
+            submodel = stack.pop()
+            stack += submodel.submodels
+            if submodel.parts:
+                index.setdefault(submodel.getPartSignature(), []).append(submodel)
+        return dict([(k, v) for k, v in index.items() if len(v) > 1])
+
+    def findIdenticalSubmodels(self):
+        # {part signature: [Submodels]}, for each set of parts found in more than one Submodel in the book.  Never modify the returned dict
+        return self.getTraversal('identicalSubmodels', self.buildSubmodelIndex)
+
+    def mergeIdenticalCallouts(self):
+        # Merge each set of identical Callouts in the same Step into one Callout with a quantity label
+        mergeList = []
+        for callouts in self.findIdenticalCallouts().values():
+            steps = {}
+            for callout in callouts:
+                steps.setdefault(callout.parentItem(), []).append(callout)
+            mergeList += [c for c in steps.values() if len(c) > 1]
+
+        if mergeList:
+            stack = self.instructions.scene.undoStack
+            stack.beginMacro("Merge identical Callouts")
+            for callouts in mergeList:
+                stack.push(MergeCalloutsCommand(callouts[0], callouts[1:], True))
+            stack.endMacro()
+        return len(mergeList)
+
+    def mergeIdenticalSubmodels(self):
+        # Replace each set of identical Submodels by its first one, which gets a quantity label for all their instances.
+        # Submodels holding other Submodels are left alone, since their children's pages live under them
+        mergeList = []
+        for submodels in self.findIdenticalSubmodels().values():
+            submodels = [s for s in submodels if not s.submodels]
+            if len(submodels) > 1:
+                submodels.sort(key = lambda x: x.pages[0]._number if x.pages else 0)
+                mergeList.append(submodels)
+
+        if mergeList:
+            stack = self.instructions.scene.undoStack
+            stack.beginMacro("Merge identical Submodels")
+            for submodels in mergeList:
+                stack.push(MergeSubmodelsCommand(submodels[0], submodels[1:]))
+            stack.endMacro()
+        return len(mergeList)
+
+    def iterFullPageList(self):
+        if self.titlePage:
+            yield self.titlePage
+        for page in self.iterPageList():
+            yield page
+        for page in list(self.partListPages):
+            yield page
+
     def addPage(self, page):
         for p in self.partListPages:
             if p._row >= page._row: 
@@ -2856,9 +3034,7 @@ class Mainmodel(MainModelTreeManager, Submodel):
         Submodel.deletePage(self, page)
 
     def initAllPLILayouts(self):
-        Submodel.initAllPLILayouts(self)
-        for page in self.partListPages:
-            page.initLayout()
+        Submodel.initAllPLILayouts(self, list(self.partListPages))
 
     def updatePageNumbers(self, newNumber, increment = 1):
         for p in self.partListPages:
@@ -2870,11 +3046,7 @@ class Mainmodel(MainModelTreeManager, Submodel):
         p1 = self.partListPages[0]
         scene = p1.scene()
         scene.emit(SIGNAL("layoutAboutToBeChanged()"))
-        if len(self.partListPages) > 1:
-            for page in self.partListPages[1:]:
-                scene.removeItem(page)
-                del(page)
-        self.partListPages = p1.updatePartList()
+        self.partListPages = p1.updatePartList(self.partListPages)  # Only changed pages are touched
         scene.emit(SIGNAL("layoutChanged()"))
         
     def syncPageNumbers(self, firstPageNumber = 1):
@@ -3276,6 +3448,7 @@ class Part(PartTreeManager, QGraphicsRectItem):
             submodel.parts.remove(part)
 
             self.abstractPart.parts.append(part)
+        LicHelpers.notifyModelChanged()
     
         self.abstractPart.resetPixmap(self.getContext(), self.getAllSettings(), skipPartInit = True)
         page.instructions.updateMainModel()
@@ -3415,7 +3588,12 @@ class Part(PartTreeManager, QGraphicsRectItem):
         dialog.exec_()
 
     def changeColor(self, newColor):
+        callout = self.getStep().parentItem() if self.originalPart else None  # Part is in Callout
+        if callout:
+            callout.countPart(self, -1)
         self.color = newColor
+        if callout:
+            callout.countPart(self, 1)
         self.getCSI().isDirty = True
         self.getCSI().nextCSIIsDirty = True
         self._dataString = None
@@ -3431,11 +3609,15 @@ class Part(PartTreeManager, QGraphicsRectItem):
 
         step = self.getStep()
 
+        if self.originalPart:  # Part is in Callout
+            step.parentItem().countPart(self, -1)
         self.setParentItem(None) # Temporarily set part's parent, so it doesn't get deleted by Qt
         step.removePart(self)
 
         self.filename = filename
         self.abstractPart = step.getInstructions().getAbstractPart(filename)
+        if self.originalPart:
+            step.parentItem().countPart(self, 1)
 
         if self.calloutPart:
             self.calloutPart.changeAbstractPart(filename)
@@ -0,0 +1,223 @@
+"""
+    Lic - Instruction Book Creation software
+    Copyright (C) 2010 Remi Gagne
+
+    This file (LicModelGenerator.py) is part of Lic.
+
+    Lic is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Lic is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/
+"""
+
+# Reproducible synthetic LDraw models, for scale testing import, layout and export.
+# Models only reference parts from a small stand-in part library, which this module can
+# also write out, so they import with LDrawImporter without a full LDraw install.
+#
+# Run with:  python Lic.py --generate-model [options] model.mpd
+
+import optparse
+import os
+import random
+
+import LDrawColors
+
+GenerateFlag = "--generate-model"
+
+# Stand-in library parts: {filename: (description, width, height, depth)}, all in LDraw units.
+StandInParts = {
+    "bench1x1.dat": ("Bench Brick 1 x 1", 20, 24, 20),
+    "bench1x2.dat": ("Bench Brick 1 x 2", 40, 24, 20),
+    "bench2x2.dat": ("Bench Brick 2 x 2", 40, 24, 40),
+    "bench2x4.dat": ("Bench Brick 2 x 4", 80, 24, 40),
+    "bench1x4.dat": ("Bench Brick 1 x 4", 80, 24, 20),
+    "benchp1x2.dat": ("Bench Plate 1 x 2", 40, 8, 20),
+    "benchp2x4.dat": ("Bench Plate 2 x 4", 80, 8, 40),
+    "benchp4x4.dat": ("Bench Plate 4 x 4", 80, 8, 80),
+}
+StandInStud = "benchstud.dat"  # Primitive, in P, used by every stand-in part
+
+# Default colour distribution: (LDraw color code, relative weight)
+DefaultColors = [(4, 6), (15, 5), (0, 5), (1, 4), (14, 4), (7, 3), (8, 3), (2, 2), (19, 1), (25, 1)]
+
+def boxLines(x1, y1, z1, x2, y2, z2, color = 16, edgeColor = 24):
+    # 6 quads and 12 edge lines of an axis aligned box
+    c = [(x1, y1, z1), (x2, y1, z1), (x2, y1, z2), (x1, y1, z2), (x1, y2, z1), (x2, y2, z1), (x2, y2, z2), (x1, y2, z2)]
+    faces = [(0, 1, 2, 3), (7, 6, 5, 4), (0, 4, 5, 1), (1, 5, 6, 2), (2, 6, 7, 3), (3, 7, 4, 0)]
+    edges = [(0, 1), (1, 2), (2, 3), (3, 0), (4, 5), (5, 6), (6, 7), (7, 4), (0, 4), (1, 5), (2, 6), (3, 7)]
+
+    lines = []
+    for face in faces:
+        lines.append("4 %d " % color + " ".join(["%g %g %g" % c[i] for i in face]))
+    for a, b in edges:
+        lines.append("2 %d %g %g %g %g %g %g" % ((edgeColor,) + c[a] + c[b]))
+    return lines
+
+def writeLines(path, lines):
+    f = open(path, 'w')
+    f.write("\n".join(lines) + "\n")
+    f.close()
+
+def writeStandInLibrary(root):
+    """ Write the stand-in part library (PARTS, P, MODELS and LDConfig.ldr) to root, which must exist. """
+
+    for folder in ['PARTS', 'P', 'MODELS']:
+        path = os.path.join(root, folder)
+        if not os.path.isdir(path):
+            os.mkdir(path)
+
+    lines = ["0 Bench Stud", "0 Name: " + StandInStud, "0 BFC CERTIFY CCW"] + boxLines(-6, -4, -6, 6, 0, 6)
+    writeLines(os.path.join(root, 'P', StandInStud), lines)
+
+    for filename, (name, x, y, z) in StandInParts.items():
+        lines = ["0 " + name, "0 Name: " + filename, "0 BFC CERTIFY CCW"]
+        lines += boxLines(-x / 2.0, 0, -z / 2.0, x / 2.0, y, z / 2.0)
+        for i in range(x // 20):
+            for j in range(z // 20):
+                lines.append("1 16 %g 0 %g 1 0 0 0 1 0 0 0 1 %s" % (i * 20 - x / 2.0 + 10, j * 20 - z / 2.0 + 10, StandInStud))
+        writeLines(os.path.join(root, 'PARTS', filename), lines)
+
+    lines = ["0 LDraw.org Configuration File (Lic stand-in library)", "0 Name: LDConfig.ldr"]
+    for code, color in sorted(LDrawColors.colors.items()):
+        if color[0] is None:
+            continue
+        r, g, b, a, name = color[:5]
+        rgb = "#%02X%02X%02X" % (int(r * 255), int(g * 255), int(b * 255))
+        line = "0 !COLOUR %s CODE %d VALUE %s EDGE #333333" % (name.replace(' ', '_'), code, rgb)
+        if a < 1.0:
+            line += " ALPHA %d" % int(a * 256)
+        lines.append(line)
+    writeLines(os.path.join(root, 'LDConfig.ldr'), lines)
+
+class ModelGenerator(object):
+    """
+    Generates one synthetic model.  partCount parts are spread over a main model and a
+    tree of submodels depth levels deep, each model with branching child submodels.
+    Every model starts a new STEP after about partsPerStep parts, and roughly
+    invertRatio of all part references are preceded by a BFC INVERTNEXT.
+    The same seed always gives the same model.
+    """
+
+    def __init__(self, partCount = 100, depth = 0, branching = 2, partsPerStep = 4, colors = None, invertRatio = 0.0, seed = 0):
+        self.partCount = partCount
+        self.depth = depth
+        self.branching = branching
+        self.partsPerStep = max(1, partsPerStep)
+        self.colors = colors if colors else DefaultColors
+        self.invertRatio = invertRatio
+        self.random = random.Random(seed)
+        self.partNames = sorted(StandInParts.keys())
+
+    def modelNames(self):
+        # Main model first, then each submodel, breadth first: [(name, [child names])]
+        models, level = [], [("main.ldr", 0)]
+        while level:
+            nextLevel = []
+            for name, depth in level:
+                children = []
+                if depth < self.depth:
+                    children = ["%s_%d.ldr" % (name[:-4], i) for i in range(self.branching)]
+                    nextLevel += [(child, depth + 1) for child in children]
+                models.append((name, children))
+            level = nextLevel
+        return models
+
+    def pickColor(self):
+        total = sum([weight for unused, weight in self.colors])
+        n = self.random.uniform(0, total)
+        for code, weight in self.colors:
+            n -= weight
+            if n <= 0:
+                return code
+        return self.colors[-1][0]
+
+    def partLines(self, index):
+        # One part reference, placed on a grid so parts don't overlap, 10 x 10 parts per layer
+        lines = []
+        if self.random.random() < self.invertRatio:
+            lines.append("0 BFC INVERTNEXT")
+        x, y, z = (index % 10) * 80, -(index // 100) * 24, ((index // 10) % 10) * 80
+        name = self.partNames[self.random.randrange(len(self.partNames))]
+        lines.append("1 %d %d %d %d 1 0 0 0 1 0 0 0 1 %s" % (self.pickColor(), x, y, z, name))
+        return lines
+
+    def modelLines(self, name, partCount, children):
+        lines = ["0 FILE " + name, "0 " + name[:-4], "0 Name: " + name]
+        for i in range(partCount):
+            if i and i % self.partsPerStep == 0:
+                lines.append("0 STEP")
+            lines += self.partLines(i)
+
+        for i, child in enumerate(children):  # Each submodel gets its own step
+            if partCount or i:
+                lines.append("0 STEP")
+            lines.append("1 16 %d -%d 0 1 0 0 0 1 0 0 0 1 %s" % (i * 400, 200, child))
+        return lines
+
+    def lines(self):
+        models = self.modelNames()
+        share, extra = divmod(self.partCount, len(models))
+        lines = []
+        for i, (name, children) in enumerate(models):
+            partCount = share + (1 if i < extra else 0)
+            if partCount == 0 and not children:
+                partCount = 1  # An empty submodel is no use to anyone
+            lines += self.modelLines(name, partCount, children)
+        return lines
+
+    def write(self, filename):
+        """ Write this model to filename: an .mpd, or an .ldr if there are no submodels. """
+        lines = self.lines()
+        if filename.lower().endswith('.ldr'):
+            if self.depth > 0:
+                raise ValueError, "Models with submodels must be written to an .mpd file"
+            lines = lines[1:]  # Single model .ldr files have no FILE line
+        writeLines(filename, lines)
+
+def writeModel(filename, **kwargs):
+    ModelGenerator(**kwargs).write(filename)
+
+def parseColors(text):
+    # "4:6,15:5,0:5" -> [(4, 6), (15, 5), (0, 5)]
+    colors = []
+    for item in text.split(','):
+        code, unused, weight = item.partition(':')
+        colors.append((int(code), float(weight) if weight else 1.0))
+    return colors
+
+def runGenerator(args):
+
+    parser = optparse.OptionParser(usage = "python Lic.py %s [options] model.mpd" % GenerateFlag)
+    parser.add_option("--parts", type = "int", default = 100, help = "total number of parts [%default]")
+    parser.add_option("--depth", type = "int", default = 0, help = "submodel nesting depth [%default]")
+    parser.add_option("--branching", type = "int", default = 2, help = "submodels in each model above the deepest level [%default]")
+    parser.add_option("--parts-per-step", type = "int", dest = "partsPerStep", default = 4, help = "parts in each STEP [%default]")
+    parser.add_option("--colors", default = None, help = "color distribution, as code:weight,... [common LEGO colors]")
+    parser.add_option("--invert", type = "float", dest = "invertRatio", default = 0.0, help = "fraction of parts preceded by BFC INVERTNEXT [%default]")
+    parser.add_option("--seed", type = "int", default = 0, help = "random seed [%default]")
+    parser.add_option("--library", default = None, help = "also write the stand-in part library to this folder")
+    options, paths = parser.parse_args(args)
+
+    if len(paths) != 1:
+        parser.error("need exactly one model filename")
+
+    if options.library:
+        if not os.path.isdir(options.library):
+            os.makedirs(options.library)
+        writeStandInLibrary(options.library)
+
+    colors = parseColors(options.colors) if options.colors else None
+    try:
+        writeModel(paths[0], partCount = options.parts, depth = options.depth, branching = options.branching,
+                   partsPerStep = options.partsPerStep, colors = colors, invertRatio = options.invertRatio, seed = options.seed)
+    except ValueError, e:
+        parser.error(str(e))
+    return 0
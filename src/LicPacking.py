@@ -0,0 +1,285 @@
+"""
+    Lic - Instruction Book Creation software
+    Copyright (C) 2010 Remi Gagne
+
+    This file (LicPacking.py) is part of Lic.
+
+    Lic is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Lic is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/
+"""
+
+# Packing methods for PLIs and part list pages, chosen in the template (PLI.packingMethod and
+# PartListPLI.packingMethod).  Rows is the original Step PLI layout (LicLayoutEngine.packPLI)
+# and Columns the original part list layout; Skyline and MaxRects are RectanglePacker packers.
+# Works on (width, height) tuples only, like LicLayoutEngine.
+
+import collections
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+from RectanglePacker import RectanglePacker, Point
+
+Rows = "Rows"
+Columns = "Columns"
+Skyline = "Skyline"
+MaxRects = "MaxRects"
+
+PLIMethods = [Rows, Skyline, MaxRects]
+PartListMethods = [Columns, Skyline, MaxRects]
+
+class SkylinePacker(RectanglePacker):
+    """
+    Bottom-left skyline packer.  The skyline - the top edge of everything packed so far - is kept in
+    two arrays of segment starts and heights.  Finding the lowest spot for a rectangle is one pass
+    over the segments with a sliding window maximum, and updating the skyline is a bisect and a slice.
+    Each segment enters and leaves the window once, so a placement takes time linear in the number
+    of segments, not logarithmic.
+    """
+
+    def __init__(self, packingAreaWidth, packingAreaHeight):
+        RectanglePacker.__init__(self, packingAreaWidth, packingAreaHeight)
+        self.xs = array('d', [0.0])  # Segment i runs from xs[i] to xs[i + 1], or the packing area's right edge
+        self.ys = array('d', [0.0])  # Height of each segment
+
+    def TryPack(self, rectangleWidth, rectangleHeight):
+        if rectangleWidth > self.packingAreaWidth or rectangleHeight > self.packingAreaHeight:
+            return None
+
+        placement = self.findPlacement(rectangleWidth, rectangleHeight)
+        if placement:
+            self.integrateRectangle(placement.x, rectangleWidth, placement.y + rectangleHeight)
+        return placement
+
+    def findPlacement(self, width, height):
+        # Lowest position for the rectangle with its left edge on a segment start, leftmost on ties
+        xs, ys = self.xs, self.ys
+        count = len(xs)
+        window = collections.deque()  # Segments under the rectangle, highest first, in decreasing height
+        best = None
+        end = 0
+
+        for start in range(count):
+            right = xs[start] + width
+            if right > self.packingAreaWidth:
+                break
+
+            while end < count and xs[end] < right:
+                while window and ys[window[-1]] <= ys[end]:
+                    window.pop()
+                window.append(end)
+                end += 1
+            while window[0] < start:
+                window.popleft()
+
+            y = ys[window[0]]
+            if y + height <= self.packingAreaHeight and (best is None or y < best.y):
+                best = Point(xs[start], y)
+
+        return best
+
+    def integrateRectangle(self, left, width, top):
+        xs, ys = self.xs, self.ys
+        right = left + width
+
+        first = bisect_right(xs, left) - 1  # Segment left is in
+        last = bisect_left(xs, right)  # First segment at or past right
+        returnHeight = ys[last - 1]
+
+        newXs, newYs = [left], [top]
+        if right < self.packingAreaWidth and (last == len(xs) or xs[last] != right):
+            newXs.append(right)
+            newYs.append(returnHeight)
+
+        if xs[first] < left:
+            first += 1  # Keep the part of the first segment left of the rectangle
+        xs[first:last] = array('d', newXs)
+        ys[first:last] = array('d', newYs)
+
+        # Merge neighbours of equal height, to keep the skyline short
+        i = max(1, first)
+        while i < len(xs) and i <= first + len(newXs):
+            if ys[i] == ys[i - 1]:
+                del xs[i]
+                del ys[i]
+            else:
+                i += 1
+
+class MaxRectsPacker(RectanglePacker):
+    """
+    Keeps a list of maximal free rectangles: each packed rectangle goes into the free rectangle that
+    fits it best, then every free rectangle it overlaps is split around it, and free rectangles
+    inside others are dropped.
+    """
+
+    BestShortSideFit = 0  # Free rectangle that leaves the least spare width or height
+    BottomLeft = 1  # Lowest position, then leftmost
+
+    def __init__(self, packingAreaWidth, packingAreaHeight, rule = BestShortSideFit):
+        RectanglePacker.__init__(self, packingAreaWidth, packingAreaHeight)
+        self.rule = rule
+        self.freeRects = [(0.0, 0.0, packingAreaWidth, packingAreaHeight)]
+
+    def TryPack(self, rectangleWidth, rectangleHeight):
+        best = bestScore = None
+        for x, y, w, h in self.freeRects:
+            if rectangleWidth <= w and rectangleHeight <= h:
+                if self.rule == MaxRectsPacker.BottomLeft:
+                    score = (y + rectangleHeight, x)
+                else:
+                    dw, dh = w - rectangleWidth, h - rectangleHeight
+                    score = (min(dw, dh), max(dw, dh))
+                if bestScore is None or score < bestScore:
+                    best, bestScore = Point(x, y), score
+
+        if best:
+            self.integrateRectangle(best.x, best.y, rectangleWidth, rectangleHeight)
+        return best
+
+    def integrateRectangle(self, left, top, width, height):
+        right, bottom = left + width, top + height
+        freeRects = []
+        for r in self.freeRects:
+            x, y, w, h = r
+            if left >= x + w or right <= x or top >= y + h or bottom <= y:
+                freeRects.append(r)
+                continue
+
+            # Split r into the parts left, right, above and below the new rectangle
+            if left > x:
+                freeRects.append((x, y, left - x, h))
+            if right < x + w:
+                freeRects.append((right, y, x + w - right, h))
+            if top > y:
+                freeRects.append((x, y, w, top - y))
+            if bottom < y + h:
+                freeRects.append((x, bottom, w, y + h - bottom))
+
+        # Drop free rectangles inside another: biggest first, so each only needs checking against those kept
+        freeRects.sort(key = lambda r: r[2] * r[3], reverse = True)
+        self.freeRects = []
+        for r in freeRects:
+            x, y, w, h = r
+            for k in self.freeRects:
+                if x >= k[0] and y >= k[1] and x + w <= k[0] + k[2] and y + h <= k[1] + k[3]:
+                    break
+            else:
+                self.freeRects.append(r)
+
+def createPacker(method, width, height, rule = MaxRectsPacker.BestShortSideFit):
+    if method == Skyline:
+        return SkylinePacker(width, height)
+    if method == MaxRects:
+        return MaxRectsPacker(width, height, rule)
+    raise ValueError, "Unknown packing method: %s" % method
+
+def packOrder(sizes):
+    # Tallest first, then widest: the usual order for both packers
+    return sorted(range(len(sizes)), key = lambda i: (-sizes[i][1], -sizes[i][0]))
+
+def packArea(sizes, width, height, margin, method):
+    # Pack sizes into a width x height area, with margin between items and around the edge.
+    # Returns each item's position, or None for those that didn't fit
+    if method == Columns:
+        return packColumns(sizes, width, height, margin)
+
+    mx, my = margin
+    positions = [None] * len(sizes)
+    packer = createPacker(method, width - mx, height - my)
+    for i in packOrder(sizes):
+        point = packer.TryPack(sizes[i][0] + mx, sizes[i][1] + my)
+        if point:
+            positions[i] = (point.x + mx, point.y + my)
+    return positions
+
+def packPages(sizes, width, height, margin, method):
+    # Pack sizes onto as few width x height pages as needed, all pages in one pass.  Columns keeps
+    # the given order, flowing from column to column and page to page; Skyline and MaxRects take the
+    # tallest items first, each onto the first page with room for it.  Returns (page, position) for
+    # each item.  Items too big for an empty page are still placed, at the top left of a page
+    mx, my = margin
+    placements = [None] * len(sizes)
+
+    if method == Columns:
+        page, x, y, columnWidth = 0, mx, my, 0
+        for i, (w, h) in enumerate(sizes):
+            if y > my and y + h + my > height:  # Start new column
+                x, y, columnWidth = x + (columnWidth + mx * 2), my, 0
+            if x > mx and x + w > width:  # Start new page
+                page, x, y, columnWidth = page + 1, mx, my, 0
+            placements[i] = (page, (x, y))
+            y += h + my
+            columnWidth = max(columnWidth, w)
+        return placements
+
+    packers = []  # One per page; None once a page is taken by an oversized item
+    for i in packOrder(sizes):
+        w, h = sizes[i][0] + mx, sizes[i][1] + my
+        for page, packer in enumerate(packers):
+            point = packer and packer.TryPack(w, h)
+            if point:
+                break
+        else:
+            page = len(packers)
+            packer = createPacker(method, width - mx, height - my)
+            point = packer.TryPack(w, h)
+            if point is None:
+                point, packer = Point(0, 0), None
+            packers.append(packer)
+        placements[i] = (page, (point.x + mx, point.y + my))
+    return placements
+
+def packStrip(sizes, maxWidth, margin, method):
+    # Pack sizes into a strip no wider than maxWidth (or the widest item), as short as possible.
+    # Returns each item's position and the strip's size, like LicLayoutEngine.packPLI
+    if not sizes:
+        return [], (0.0, 0.0)
+
+    mx, my = margin
+    width = max(maxWidth - mx, max([w for w, h in sizes]) + mx)
+    height = sum([h + my for w, h in sizes]) + my
+    positions = [None] * len(sizes)
+
+    packer = createPacker(method, width, height, MaxRectsPacker.BottomLeft)
+    for i in packOrder(sizes):
+        point = packer.TryPack(sizes[i][0] + mx, sizes[i][1] + my)
+        positions[i] = (point.x + mx, point.y + my)
+
+    right = max([x + w for (x, y), (w, h) in zip(positions, sizes)])
+    bottom = max([y + h for (x, y), (w, h) in zip(positions, sizes)])
+    return positions, (right + mx, bottom + my)
+
+def packColumns(sizes, width, height, margin):
+    # Part list columns: top to bottom, then left to right, in the given order.  The first item that
+    # runs off the right edge, and every item after it, is left out (None)
+    mx, my = margin
+    positions = [None] * len(sizes)
+    columnWidth = 0
+    x, y = mx, my
+
+    for i, (w, h) in enumerate(sizes):
+        newHeight = h + my
+
+        if y + newHeight > height:  # Start new column
+            x += columnWidth + (mx * 2)
+            y = my
+            columnWidth = w
+
+        if x + w > width:  # This item overflowed the right edge of page - abort
+            break
+
+        positions[i] = (x, y)
+        y += newHeight
+        columnWidth = max(columnWidth, w)
+
+    return positions
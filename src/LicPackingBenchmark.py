@@ -0,0 +1,168 @@
+"""
+    Lic - Instruction Book Creation software
+    Copyright (C) 2010 Remi Gagne
+
+    This file (LicPackingBenchmark.py) is part of Lic.
+
+    Lic is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Lic is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/
+"""
+
+# Compares LicPacking's methods on real PLI contents.  Loads .lic files (and / or builds a synthetic
+# book, as LicBenchmark does), collects the item sizes and available width of every Step PLI, and
+# the items and page area of the part list, then packs them all with each method.  Reports packing
+# time and area efficiency - item area over the area used - for Step PLIs, and pages needed for
+# the part list.
+#
+# Needs a display for its GL context, like LicBenchmark; without one, run under a virtual X server.
+#
+# Run with:  python Lic.py --pack-benchmark [options] [file.lic | folder ...]
+# or:        xvfb-run -a python Lic.py --pack-benchmark [options] [file.lic | folder ...]
+
+import optparse
+import shutil
+import tempfile
+import time
+
+from LicCommonImports import *
+
+import LicBenchmark
+import LicLayoutEngine
+import LicModelGenerator
+import LicPacking
+
+PackBenchmarkFlag = "--pack-benchmark"
+
+class PackingInputs(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.plis = []  # [([(width, height)] in placing order, available width)]
+        self.partList = []  # [(width, height)], in part list order
+        self.partListArea = None  # (width, height) of a part list page's PLI
+
+def collectInputs(name, instructions):
+    from LicModel import PLI
+
+    inputs = PackingInputs(name)
+    mainModel = instructions.mainModel
+    for page in mainModel.getPageList():
+        for step in page.steps:
+            if step.hasPLI():
+                items = step.pli.getLayoutOrder(False)
+                inputs.plis.append(([(i.rect().width(), i.rect().height()) for i in items], step.rect().width()))
+
+    items = []
+    for page in mainModel.partListPages:
+        items += page.pli.pliItems
+        inputs.partListArea = (page.pli.rect().width(), page.pli.rect().height())
+    items.sort(key = lambda x: (x.color.sortKey(), x.rect().width()))
+    inputs.partList = [(i.rect().width(), i.rect().height()) for i in items]
+    inputs.margin = (PLI.margin.x(), PLI.margin.y())
+    return inputs
+
+def packStepPLI(method, sizes, width, margin):
+    if method == LicPacking.Rows:
+        return LicLayoutEngine._packPLI(sizes, width, margin)  # Not through the cache, which would skew timings
+    return LicPacking.packStrip(sizes, width, margin, method)
+
+def benchmarkStepPLIs(inputs, method, repeat):
+    times = []
+    for unused in range(repeat):
+        start = time.time()
+        results = [packStepPLI(method, sizes, width, inputs.margin) for sizes, width in inputs.plis]
+        times.append(time.time() - start)
+
+    itemArea = usedArea = height = 0.0
+    for (sizes, width), (positions, size) in zip(inputs.plis, results):
+        itemArea += sum([w * h for w, h in sizes])
+        usedArea += size[0] * size[1]
+        height += size[1]
+    count = max(1, len(inputs.plis))
+    return min(times), itemArea / usedArea if usedArea else 0.0, height / count
+
+def benchmarkPartList(inputs, method, repeat):
+    # Pages needed for the whole part list, as PartListPage.updatePartList packs it
+    width, height = inputs.partListArea
+    times = []
+    for unused in range(repeat):
+        start = time.time()
+        placements = LicPacking.packPages(inputs.partList, width, height, inputs.margin, method)
+        times.append(time.time() - start)
+    pages = max([page for page, pos in placements] + [0]) + 1
+
+    itemArea = sum([w * h for w, h in inputs.partList])
+    efficiency = itemArea / (pages * width * height)
+    return min(times), efficiency, pages
+
+def report(inputs, repeat):
+    print "\n%s: %d Step PLIs, %d part list items" % (inputs.name, len(inputs.plis), len(inputs.partList))
+    print "  %-22s %9s %12s %11s %14s" % ("Method", "Time (ms)", "us / PLI", "Efficiency", "Mean height")
+    for method in LicPacking.PLIMethods:
+        best, efficiency, height = benchmarkStepPLIs(inputs, method, repeat)
+        perPLI = best * 1000000.0 / len(inputs.plis) if inputs.plis else 0.0
+        print "  %-22s %9.2f %12.1f %10.1f%% %14.1f" % ("Step PLI, " + method, best * 1000.0, perPLI, efficiency * 100.0, height)
+
+    if inputs.partList and inputs.partListArea:
+        print "  %-22s %9s %12s %11s %14s" % ("Method", "Time (ms)", "", "Efficiency", "Pages")
+        for method in LicPacking.PartListMethods:
+            best, efficiency, pages = benchmarkPartList(inputs, method, repeat)
+            print "  %-22s %9.2f %12s %10.1f%% %14s" % ("Part list, " + method, best * 1000.0, "", efficiency * 100.0, pages)
+
+def runPackingBenchmark(args, FileVersion, MagicNumber):
+
+    parser = optparse.OptionParser(usage = "python Lic.py %s [options] [file.lic | folder ...]" % PackBenchmarkFlag)
+    parser.add_option("--parts", type = "int", default = 500, help = "parts in the synthetic book [%default]")
+    parser.add_option("--steps", type = "int", default = 60, help = "steps in the synthetic book [%default]")
+    parser.add_option("--repeat", type = "int", default = 5, help = "times to repeat each packing run [%default]")
+    parser.add_option("--no-synthetic", action = "store_false", dest = "synthetic", default = True, help = "only use the given .lic files")
+    parser.add_option("--ldraw", default = LicBenchmark.savedLDrawPath(), help = "LDraw library, for loading .lic files [%default]")
+    options, paths = parser.parse_args(args)
+
+    import LicBinaryReader
+
+    app, glWidget = LicBenchmark.createGLWidget(PackBenchmarkFlag)
+    if glWidget is None:
+        return 1
+
+    workDir = tempfile.mkdtemp(prefix = "lic_pack_benchmark_")
+    try:
+        if options.synthetic:
+            libraryDir = os.path.join(workDir, "LDraw")
+            os.mkdir(libraryDir)
+            LicModelGenerator.writeStandInLibrary(libraryDir)
+            LicBenchmark.setLDrawPath(libraryDir)
+
+            modelFilename = os.path.join(workDir, "synthetic.mpd")
+            LicModelGenerator.writeModel(modelFilename, partCount = options.parts, partsPerStep = max(1, options.parts // max(1, options.steps)))
+            instructions = LicBenchmark.createInstructions(glWidget)
+            LicConfig.filename = modelFilename
+            LicBenchmark.importSyntheticBook(instructions, modelFilename, FileVersion, MagicNumber)
+            report(collectInputs("Synthetic book: %d parts" % options.parts, instructions), options.repeat)
+
+        LicBenchmark.setLDrawPath(options.ldraw)
+        for filename in LicBenchmark.findLicFiles(paths):
+            instructions = LicBenchmark.createInstructions(glWidget)
+            LicConfig.filename = filename
+            try:
+                for unused in LicBinaryReader.loadLicFile(filename, instructions, FileVersion, MagicNumber):
+                    pass
+            except IOError, e:
+                print "\n%s: FAILED to load: %s" % (filename, e)
+                continue
+            report(collectInputs(filename, instructions), options.repeat)
+    finally:
+        shutil.rmtree(workDir, True)
+
+    del app
+    return 0
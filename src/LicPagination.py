@@ -0,0 +1,151 @@
+"""
+    Lic - Instruction Book Creation software
+    Copyright (C) 2010 Remi Gagne
+
+    This file (LicPagination.py) is part of Lic.
+
+    Lic is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Lic is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/
+"""
+
+# Chooses which Steps share a Page, for freshly imported models that start with one Step per Page.
+# Works from the CSI, PLI, label and Callout sizes each Step already has: LicLayoutEngine lays
+# Steps out on plain numbers, with the same arithmetic GridLayout, PLI and Step use on the scene,
+# to predict whether a set of Steps fits on one Page without overlaps.  Page breaks are then
+# picked for all Pages at once, by dynamic programming, and nothing in the scene changes until
+# the result is applied.
+
+import LicLayoutEngine
+
+from LicLayoutEngine import Horizontal, Vertical
+
+STEPS_PER_PAGE_MIN = 1  # Pages with fewer Steps are avoided, when possible
+STEPS_PER_PAGE_MAX = 9
+BREAK_BEFORE_SUBMODEL_STEPS = True  # A Step that adds a Submodel always starts a new Page
+FACING_PAGES = False  # Prefer an even number of Pages per Submodel, so each one fills whole spreads
+
+def sizeOf(rect):
+    return (rect.width(), rect.height())
+
+def stepFits(record, cell, pageSize, pageMargin, pliMargin):
+    # Would a Step laid out in cell (x, y, width, height) pass Step.checkForLayoutOverlaps
+    layout = LicLayoutEngine.layoutStep(record, cell[2], cell[3], pageMargin, pliMargin)
+    return not LicLayoutEngine.stepOverlaps(record, layout, cell, pageSize)
+
+class PageModel(object):
+    """ What pagination needs to know about the Pages of one Submodel, and about the Page layout. """
+
+    def __init__(self, pages):
+        page = pages[0]
+        inset = page.insetRect()
+        self.insetRect = (inset.x(), inset.y(), inset.width(), inset.height())
+        self.pageSize = sizeOf(page.rect())
+        self.pageMargin = (page.margin.x(), page.margin.y())
+        self.pliMargin = (0.0, 0.0)
+        self.layouts = [(p.layout.rowCount, p.layout.colCount) for p in pages]
+        self.fixedMembers = []  # Each Page's fixed size member (its Submodel preview), if any, as a rect() tuple
+        self.mergeable = []  # Each Page's Step can share a Page with others
+        self.steps = []  # LicLayoutEngine.StepRecord of each Page's Step, or None
+
+        for p in pages:
+            item = p.submodelItem
+            r = item.rect() if item else None
+            self.fixedMembers.append((r.x(), r.y(), r.width(), r.height()) if item else None)
+            self.mergeable.append(len(p.steps) == 1 and not p.isLocked())
+            self.steps.append(p.steps[0].getLayoutRecord() if len(p.steps) == 1 else None)
+            if len(p.steps) == 1 and p.steps[0].pli:
+                self.pliMargin = (p.steps[0].pli.margin.x(), p.steps[0].pli.margin.y())
+
+        self.fitCache = {}  # {(step index, cell): fits}
+
+    def canJoin(self, index):
+        # Can Page index's Step move onto the Page before it
+        if not self.mergeable[index]:
+            return False
+        return not (BREAK_BEFORE_SUBMODEL_STEPS and self.steps[index].hasSubmodel)
+
+    def fits(self, start, end):
+        # Orientation to lay out Steps start to end - 1 on Page start in, or None if they don't fit
+        fixed = self.fixedMembers[start]
+        members = ([fixed] if fixed else []) + [None] * (end - start)
+        rowCount, colCount = self.layouts[start]
+
+        for orientation in [Horizontal, Vertical]:
+            rows, cols = LicLayoutEngine.rowColCount(len(members), orientation, rowCount, colCount)
+            cells, unused = LicLayoutEngine.gridLayout(self.insetRect, members, orientation, rows, cols)
+            if fixed:
+                cells = cells[1:]
+            for index, cell in zip(range(start, end), cells):
+                key = (index, cell)
+                if key not in self.fitCache:
+                    self.fitCache[key] = stepFits(self.steps[index], cell, self.pageSize, self.pageMargin, self.pliMargin)
+                if not self.fitCache[key]:
+                    break
+            else:
+                return orientation
+        return None
+
+def findPageBreaks(model, count, minSteps = None, maxSteps = None, facingPages = None):
+    """
+    Choose the fewest Pages for count Pages' worth of Steps, preferring Pages with at least minSteps
+    Steps and then Steps spread evenly over Pages.  Returns [(start, end, orientation)]: Pages start
+    to end - 1 become one Page, laid out in orientation (None to leave a single Page's layout as is).
+    """
+
+    minSteps = STEPS_PER_PAGE_MIN if minSteps is None else minSteps
+    maxSteps = STEPS_PER_PAGE_MAX if maxSteps is None else maxSteps
+    facingPages = FACING_PAGES if facingPages is None else facingPages
+
+    # best[parity][i]: (cost, previous break, orientation) of the best split of the first i Pages
+    # into an even (parity 0) or odd (parity 1) number of Pages.  Cost is (Pages, short Pages, sum of squared Steps per Page)
+    best = [[None] * (count + 1), [None] * (count + 1)]
+    best[0][0] = ((0, 0, 0), None, None)
+
+    for start in range(count):
+        for parity in [0, 1]:
+            if best[parity][start] is None:
+                continue
+            cost = best[parity][start][0]
+
+            for end in range(start + 1, min(count, start + max(1, maxSteps)) + 1):
+                size = end - start
+                orientation = None
+                if size > 1:
+                    if not (model.mergeable[start] and model.canJoin(end - 1)):
+                        break
+                    orientation = model.fits(start, end)
+                    if orientation is None:
+                        continue  # A bigger grid may still fit, with a different shape
+
+                newCost = (cost[0] + 1, cost[1] + (size < minSteps), cost[2] + size * size)
+                entry = best[1 - parity][end]
+                if entry is None or newCost < entry[0]:
+                    best[1 - parity][end] = (newCost, (parity, start), orientation)
+
+    choices = [best[p][count] for p in [0, 1] if best[p][count] is not None]
+    if facingPages and best[0][count] is not None:
+        choices = [best[0][count]]
+    parity = [p for p in [0, 1] if best[p][count] is min(choices)][0]
+
+    breaks = []
+    end = count
+    while end:
+        unused, (previousParity, start), orientation = best[parity][end]
+        breaks.append((start, end, orientation))
+        parity, end = previousParity, start
+    breaks.reverse()
+    return breaks
+
+def paginate(pages, minSteps = None, maxSteps = None, facingPages = None):
+    # Page breaks for pages, as findPageBreaks returns them
+    return findPageBreaks(PageModel(pages), len(pages), minSteps, maxSteps, facingPages)
@@ -0,0 +1,197 @@
+"""
+    Lic - Instruction Book Creation software
+    Copyright (C) 2010 Remi Gagne
+
+    This file (LicParallelExport.py) is part of Lic.
+
+    Lic is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Lic is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/
+"""
+
+# Sharded export: split the book's pages into contiguous ranges, and hand each range
+# to a separate Lic process.  Each worker loads the saved .lic file once, renders its
+# pages with its own GL context, and reports each finished page on stdout.
+
+import subprocess
+import threading
+import Queue
+
+from LicCommonImports import *
+
+ShardFlag = "--export-shard"
+PagePrefix = "PAGE "
+
+def splitPageRanges(pageNumbers, shardCount):
+    # Split sorted page numbers into shardCount contiguous (first, last) ranges of near equal size
+    pageNumbers = sorted(pageNumbers)
+    shardCount = max(1, min(shardCount, len(pageNumbers)))
+    size, extra = divmod(len(pageNumbers), shardCount)
+    ranges, start = [], 0
+    for i in range(shardCount):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append((pageNumbers[start], pageNumbers[end - 1]))
+        start = end
+    return ranges
+
+class ExportShard(object):
+
+    def __init__(self, pageRange, pageNumbers):
+        self.pageRange = pageRange
+        self.pending = set(pageNumbers)  # Pages this shard still needs to deliver
+        self.attempts = 0
+        self.process = None
+        self.reader = None
+
+    def start(self, command, licFilename, scaleFactor, resultQueue):
+        self.attempts += 1
+        first, last = self.pageRange
+        args = command + [ShardFlag, licFilename, str(first), str(last), str(scaleFactor), LicConfig.LDrawPath]
+        self.process = subprocess.Popen(args, stdout = subprocess.PIPE, cwd = os.getcwd())
+        self.reader = threading.Thread(target = self.readOutput, args = (resultQueue,))
+        self.reader.setDaemon(True)
+        self.reader.start()
+
+    def readOutput(self, resultQueue):
+        # Runs on a helper thread, so a slow worker never blocks the UI thread
+        for line in iter(self.process.stdout.readline, ''):
+            line = line.strip()
+            if line.startswith(PagePrefix):
+                number, filename = line[len(PagePrefix):].split(' ', 1)
+                resultQueue.put((self, int(number), filename))
+        self.process.wait()
+        resultQueue.put((self, None, None))  # Shard finished, successfully or not
+
+    def nextRange(self):
+        # Narrow this shard down to the pages it failed to deliver, for a retry
+        pages = sorted(self.pending)
+        self.pageRange = (pages[0], pages[-1])
+
+    def kill(self):
+        if self.process is not None and self.process.poll() is None:
+            try:
+                self.process.kill()
+            except OSError:
+                pass  # Process already gone
+
+class ShardedExporter(object):
+
+    maxRetries = 2
+    pollInterval = 0.1
+
+    def __init__(self, instructions, licFilename, command, shardCount = None):
+        self.instructions = instructions
+        self.licFilename = licFilename
+        self.command = command  # Command that launches Lic itself, ie: [python, Lic.py]
+        self.shardCount = shardCount
+
+    def exportImages(self, scaleFactor = 1.0):
+
+        pageList = self.instructions.mainModel.getFullPageList()
+        pageNumbers = sorted(p._number for p in pageList)
+        yield len(pageNumbers)  # Special first value is number of steps in export process
+
+        shardCount = self.shardCount if self.shardCount else LicHelpers.workerCount(len(pageNumbers))
+        shards = []
+        for first, last in splitPageRanges(pageNumbers, shardCount):
+            shards.append(ExportShard((first, last), [n for n in pageNumbers if first <= n <= last]))
+
+        resultQueue = Queue.Queue()
+        results = {}
+        running = len(shards)
+        try:
+            for shard in shards:
+                shard.start(self.command, self.licFilename, scaleFactor, resultQueue)
+
+            while running:
+                try:
+                    shard, number, filename = resultQueue.get(True, self.pollInterval)
+                except Queue.Empty:
+                    yield None  # Nothing new, but give caller a chance to process events & cancel
+                    continue
+
+                if number is not None:
+                    shard.pending.discard(number)
+                    results[number] = filename
+                    yield filename
+                    continue
+
+                running -= 1
+                if shard.pending:
+                    if shard.attempts > self.maxRetries:
+                        raise IOError, "Failed to export pages %d - %d" % shard.pageRange
+                    shard.nextRange()
+                    shard.start(self.command, self.licFilename, scaleFactor, resultQueue)
+                    running += 1
+        finally:
+            for shard in shards:
+                shard.kill()
+
+        self.pageFilenameList = [results[n] for n in pageNumbers]  # Final images in page order
+
+    def exportToPDF(self):
+
+        filename = os.path.join(LicConfig.pdfCachePath(), os.path.basename(self.instructions.mainModel.filename)[:-3] + "pdf")
+        yield filename
+
+        exporter = self.exportImages(2.0 if sys.platform.startswith('darwin') else 3.0)
+        yield 2 * exporter.next()
+
+        for pageFilename in exporter:
+            if pageFilename is None:
+                yield None
+            else:
+                fn = os.path.splitext(os.path.basename(pageFilename))[0].replace('_', ' ')
+                yield "Rendering " + fn
+
+        for label in self.instructions.combineImagesToPDF(filename, self.pageFilenameList):
+            yield label
+
+def runExportShard(args, FileVersion, MagicNumber):
+    # Worker entry point: load one .lic file, export one page range, report each page on stdout
+    import LicGraphicsWidget
+    import LicInstructions
+    import LicBinaryReader
+    import LicImporters
+
+    licFilename, first, last, scaleFactor = args[0], int(args[1]), int(args[2]), float(args[3])
+
+    # Instructions loads LDConfig from the LDraw library, so its path must be set before anything
+    # else: the parent's, or else the one saved in Lic's settings, as the main window does
+    LDrawPath = args[4] if len(args) > 4 and args[4] else ""
+    if not LDrawPath:
+        settings = QSettings(QString(os.path.join(os.path.dirname(sys.argv[0]), 'Lic.ini')), QSettings.IniFormat)
+        LDrawPath = str(settings.value("LDrawPath").toString()) or LicConfig.LDrawPath
+    LicConfig.LDrawPath = LDrawPath
+    LicImporters.LDrawImporter.LDrawPath = LicConfig.LDrawPath
+
+    app = QApplication(sys.argv)
+    glWidget = QGLWidget(LicGLHelpers.getGLFormat())
+    scene = LicGraphicsWidget.LicGraphicsScene(None)
+    scene.undoStack = QUndoStack()
+    instructions = LicInstructions.Instructions(None, scene, glWidget)
+
+    LicConfig.filename = licFilename
+    for unused in LicBinaryReader.loadLicFile(licFilename, instructions, FileVersion, MagicNumber):
+        pass
+
+    scene.selectPage(1)
+    glWidget.makeCurrent()
+    pageNumbers = sorted(p._number for p in instructions.mainModel.getFullPageList() if first <= p._number <= last)
+    exporter = instructions.exportImages(scaleFactor, (first, last))
+    exporter.next()
+    for number in pageNumbers:  # exportImages yields one filename per page, in page order
+        sys.stdout.write("%s%d %s\n" % (PagePrefix, number, exporter.next()))
+        sys.stdout.flush()
+
+    del app
+    return 0
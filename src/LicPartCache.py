@@ -0,0 +1,184 @@
+"""
+    Lic - Instruction Book Creation software
+    Copyright (C) 2010 Remi Gagne
+
+    This file (LicPartCache.py) is part of Lic.
+
+    Lic is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Lic is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/
+"""
+
+# Cache of parsed LDraw library parts, used to resolve parts that a .lic file
+# stores only as a library reference + checksum instead of full geometry.
+# Parsed parts are kept in memory, and pickled to disk keyed by checksum, so
+# each library file is only ever parsed once.
+
+import cPickle
+import hashlib
+import logging
+
+from LicCommonImports import *
+
+from LicModel import Part, Primitive
+from LicImporters import LDrawImporter
+
+__checksums = {}    # {full path: ((mtime, size), checksum)}
+__parsedParts = {}  # {checksum: ParsedPart}
+
+class ParsedPart(object):
+    """ Plain data version of one LDraw part file: everything needed to rebuild its AbstractPart. """
+
+    def __init__(self):
+        self.name = ""
+        self.winding = GL.GL_CCW
+        self.primitives = []  # [(color code, type, winding, points)]
+        self.parts = []       # [(filename, color code, matrix, inverted, isBlackened)]
+
+class PartRecorder(object):
+    """ Stand-in for InstructionsProxy: records one part file's lines without touching any part dictionary. """
+
+    def __init__(self, parsedPart):
+        self.parsedPart = parsedPart
+
+    def createPart(self, fn, colorCode, matrix, invert = False):
+        part = RecordedPart(fn, colorCode, matrix, invert)
+        part.abstractPart = fn  # Anything but None, so the importer doesn't recurse into sub-parts
+        return part
+
+    def addPart(self, part, parent = None):
+        self.parsedPart.parts.append((part.filename, part.colorCode, part.matrix, part.inverted, part.isBlackened))
+
+    def addPrimitive(self, shape, colorCode, points, parent = None):
+        self.parsedPart.primitives.append((colorCode, shape, parent.winding, points))
+
+    def addBlankPage(self, parent):
+        pass
+
+class RecordedPart(object):
+
+    def __init__(self, filename, colorCode, matrix, invert):
+        self.filename = filename
+        self.colorCode = colorCode
+        self.matrix = matrix
+        self.inverted = invert
+        self.isBlackened = False
+
+    def setInversion(self, invert):
+        det = LicHelpers.determinant3x3([self.matrix[0:3], self.matrix[4:7], self.matrix[8:11]])
+        self.inverted = (True if det < 0 else False) ^ invert
+
+    def toBlack(self):
+        self.isBlackened = True
+
+class RecordedAbstractPart(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.name = filename
+        self.invertNext = False
+        self.winding = GL.GL_CCW
+
+def partCachePath():
+    return LicConfig.checkPath('Parts', LicConfig.rootCachePath())
+
+def getLibraryPath(filename):
+    """ Returns the full path to filename if it resolves inside the LDraw library's PARTS or P folders, None otherwise. """
+    LDrawImporter.LDrawPath = LicConfig.LDrawPath
+    path = LDrawImporter.LDrawFile.getPartFilePath(filename)
+    if path is None:
+        return None
+
+    path = os.path.normcase(os.path.abspath(path))
+    for folder in ['PARTS', 'P']:
+        root = os.path.normcase(os.path.abspath(os.path.join(LicConfig.LDrawPath, folder)))
+        if path.startswith(root + os.path.sep):
+            return path
+    return None
+
+def getChecksum(path):
+    stat = os.stat(path)
+    key = (stat.st_mtime, stat.st_size)
+    if path in __checksums and __checksums[path][0] == key:
+        return __checksums[path][1]
+
+    f = open(path, 'rb')
+    checksum = hashlib.md5(f.read()).hexdigest()
+    f.close()
+    __checksums[path] = (key, checksum)
+    return checksum
+
+def getLibraryChecksum(filename):
+    """ Returns the checksum of filename's library file, or None if filename is not an official library part. """
+    path = getLibraryPath(filename)
+    return getChecksum(path) if path else None
+
+def getParsedPart(filename, checksum):
+
+    if checksum in __parsedParts:
+        return __parsedParts[checksum]
+
+    cacheFile = os.path.join(partCachePath(), checksum + ".pkl")
+    if os.path.isfile(cacheFile):
+        try:
+            f = open(cacheFile, 'rb')
+            parsedPart = cPickle.load(f)
+            f.close()
+            __parsedParts[checksum] = parsedPart
+            return parsedPart
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            pass  # Corrupt cache file - just parse the part again
+
+    parsedPart = ParsedPart()
+    abstractPart = RecordedAbstractPart(filename)
+    LDrawImporter.importPart(filename, PartRecorder(parsedPart), abstractPart)
+    parsedPart.name = abstractPart.name
+    parsedPart.winding = abstractPart.winding
+
+    __parsedParts[checksum] = parsedPart
+    try:
+        f = open(cacheFile, 'wb')
+        cPickle.dump(parsedPart, f, cPickle.HIGHEST_PROTOCOL)
+        f.close()
+    except IOError:
+        pass  # Can't write the cache - not fatal, we'll just parse again next session
+    return parsedPart
+
+def loadLibraryPart(abstractPart, checksum, colorDict):
+    """
+    Fill in abstractPart's sub-parts and primitives from the LDraw library.
+    Sub-parts are created right away, so they can be linked to their own AbstractParts;
+    primitives are only created when first needed.
+    """
+
+    path = getLibraryPath(abstractPart.filename)
+    if path is None:
+        raise IOError, "Cannot find LDraw library part %s - check your LDraw path" % abstractPart.filename
+
+    currentChecksum = getChecksum(path)
+    if currentChecksum != checksum:
+        logging.warning("LDraw library part %s has changed since this file was saved", abstractPart.filename)
+
+    parsedPart = getParsedPart(abstractPart.filename, currentChecksum)
+    abstractPart.winding = parsedPart.winding
+    abstractPart.libraryChecksum = currentChecksum
+
+    for filename, colorCode, matrix, inverted, isBlackened in parsedPart.parts:
+        part = Part(filename, colorDict[colorCode], list(matrix), inverted)
+        if isBlackened:
+            part.toBlack()
+        abstractPart.parts.append(part)
+
+    def loader(part):
+        for colorCode, type, winding, points in parsedPart.primitives:
+            part.addPrimitive(Primitive(colorDict[colorCode], list(points), type, winding))
+    abstractPart.geometryLoader = loader
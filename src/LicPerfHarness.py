@@ -0,0 +1,333 @@
+"""
+    Lic - Instruction Book Creation software
+    Copyright (C) 2010 Remi Gagne
+
+    This file (LicPerfHarness.py) is part of Lic.
+
+    Lic is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Lic is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/
+"""
+
+# End to end performance harness.  Takes a few fixed synthetic models (see LicModelGenerator)
+# through every stage of making a book - reading LDraw files, import, GL display lists, part and
+# CSI dimensions, page layout, page merging, template, save, load and export - timing each stage
+# as its own phase.  Phases call the same Instructions methods a real import does.  Wall time,
+# CPU time, peak memory and GL call counts for each phase are written to a JSON file, and
+# compared against a stored baseline JSON file: any phase that got slower than the baseline by
+# more than the allowed threshold fails the run.
+#
+# Each input runs in a fresh Lic process, so one input's peak memory never hides the next one's.
+# Peak memory only ever grows within a process, so each phase records both the peak after it ran
+# and how much it raised that peak.
+#
+# Needs a display for its GL context, like LicBenchmark; without one, run under a virtual X server.
+#
+# Run with:  python Lic.py --perf [options]
+# or:        xvfb-run -a python Lic.py --perf [options]
+
+import json
+import optparse
+import shutil
+import subprocess
+import tempfile
+import time
+
+from LicCommonImports import *
+
+import LicBenchmark
+import LicModelGenerator
+
+PerfFlag = "--perf"
+
+# Fixed inputs: {name: LicModelGenerator.ModelGenerator arguments}.  Never change these
+# once baselines exist, or every stored baseline becomes meaningless - add new inputs instead.
+FixedInputs = {
+    "small": dict(partCount = 60, depth = 0, partsPerStep = 3, seed = 1),
+    "medium": dict(partCount = 400, depth = 1, branching = 3, partsPerStep = 5, seed = 2),
+    "large": dict(partCount = 2000, depth = 2, branching = 3, partsPerStep = 6, invertRatio = 0.05, seed = 3),
+}
+
+# Phases faster than this (in seconds) are too noisy to compare against a baseline
+MinimumComparableTime = 0.05
+
+# Phases that raise peak memory by less than this (in MB) are too noisy to compare against a baseline
+MinimumComparableMemory = 5.0
+
+class GLCallCounter(object):
+    """
+    Counts calls to every OpenGL function, by swapping each one in the GL and GLU modules
+    for a counting wrapper.  Most of Lic calls these as GL.glFoo(), which picks up the
+    wrappers as is; LicGLHelpers imports them by name, so its copies are swapped too.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.originals = []  # [(module, name, original function)]
+
+    def install(self):
+        from OpenGL import GL, GLU
+        wrappers = {}  # {id(original function): wrapper}
+        for module, prefix in [(GL, 'gl'), (GLU, 'glu')]:
+            for name in dir(module):
+                function = getattr(module, name)
+                if name.startswith(prefix) and callable(function):
+                    wrapper = wrappers.setdefault(id(function), self.wrap(function))
+                    self.originals.append((module, name, function))
+                    setattr(module, name, wrapper)
+
+        for name, function in LicGLHelpers.__dict__.items():
+            if id(function) in wrappers:
+                self.originals.append((LicGLHelpers, name, function))
+                setattr(LicGLHelpers, name, wrappers[id(function)])
+
+    def uninstall(self):
+        for module, name, function in self.originals:
+            setattr(module, name, function)
+        self.originals = []
+
+    def wrap(self, function):
+        def counted(*args, **kwargs):
+            self.count += 1
+            return function(*args, **kwargs)
+        return counted
+
+class PhaseTimer(object):
+
+    def __init__(self, glCounter):
+        self.glCounter = glCounter
+        self.phases = []  # [{name, wall, cpu, peakRSS, peakGrowth, glCalls}], in the order they ran
+        self.current = None
+
+    def cpuTime(self):
+        t = os.times()
+        return t[0] + t[1]
+
+    def start(self, name):
+        self.current = (name, time.time(), self.cpuTime(), LicBenchmark.peakMemory(), self.glCounter.count)
+
+    def stop(self):
+        name, wall, cpu, peak, glCalls = self.current
+        newPeak = LicBenchmark.peakMemory()
+        self.phases.append({"name": name,
+                            "wall": time.time() - wall,
+                            "cpu": self.cpuTime() - cpu,
+                            "peakRSS": newPeak,
+                            "peakGrowth": newPeak - peak if newPeak is not None else None,
+                            "glCalls": self.glCounter.count - glCalls})
+        self.current = None
+
+def drain(generator):
+    for unused in generator:
+        pass
+
+def runPhases(timer, modelFilename, workDir, glWidget, FileVersion, MagicNumber, export):
+    # The steps LicWindow.importModel takes, one phase at a time
+    import LicBinaryReader
+    import LicBinaryWriter
+    import LicImportWorker
+
+    instructions = LicBenchmark.createInstructions(glWidget)
+    LicConfig.filename = modelFilename
+
+    timer.start("read files")
+    LicImportWorker.prefetchModelFiles(instructions, modelFilename)
+    timer.stop()
+
+    timer.start("import")
+    pageList = instructions.readModel(modelFilename)
+    timer.stop()
+
+    timer.start("GL display lists")
+    drain(instructions.initGLDisplayLists())
+    timer.stop()
+
+    timer.start("part dimensions")
+    drain(instructions.initPartDimensions())
+    timer.stop()
+
+    timer.start("CSI dimensions")
+    drain(instructions.initCSIDimensions())
+    timer.stop()
+
+    timer.start("page layout")
+    drain(instructions.layoutImportedPages(pageList))
+    timer.stop()
+
+    timer.start("page merging")
+    drain(instructions.mergeImportedPages(pageList))
+    timer.stop()
+
+    timer.start("template")
+    template = LicBinaryReader.loadLicTemplate(":/default_template", instructions, FileVersion, MagicNumber)
+    drain(instructions.addTemplate(template))
+    timer.stop()
+
+    licFilename = os.path.join(workDir, os.path.splitext(os.path.basename(modelFilename))[0] + ".lic")
+    timer.start("save")
+    LicBinaryWriter.saveLicFile(licFilename, instructions, FileVersion, MagicNumber)
+    timer.stop()
+
+    loaded = LicBenchmark.createInstructions(glWidget)
+    LicConfig.filename = licFilename
+    timer.start("load")
+    drain(LicBinaryReader.loadLicFile(licFilename, loaded, FileVersion, MagicNumber))
+    timer.stop()
+
+    if export:
+        LicConfig.filename = modelFilename
+        instructions.scene.selectPage(1)
+        glWidget.makeCurrent()
+        timer.start("export")
+        drain(instructions.exportImages())
+        timer.stop()
+
+def compareToBaseline(results, baseline, threshold):
+    # Returns a list of regressions, as text.  Phases or inputs missing from either side are skipped.
+    regressions = []
+    for inputName, phases in sorted(results["inputs"].items()):
+        oldPhases = dict([(p["name"], p) for p in baseline.get("inputs", {}).get(inputName, [])])
+        for phase in phases:
+            old = oldPhases.get(phase["name"])
+            if old is None:
+                continue
+            for key in ["wall", "cpu"]:
+                if old[key] < MinimumComparableTime and phase[key] < MinimumComparableTime:
+                    continue
+                if phase[key] > old[key] * (1.0 + threshold):
+                    regressions.append("%s, %s: %s time %.3fs, baseline %.3fs" % (inputName, phase["name"], key, phase[key], old[key]))
+            if phase["glCalls"] > old["glCalls"] * (1.0 + threshold):
+                regressions.append("%s, %s: %d GL calls, baseline %d" % (inputName, phase["name"], phase["glCalls"], old["glCalls"]))
+            growth, oldGrowth = phase.get("peakGrowth"), old.get("peakGrowth")  # Older baselines have no peakGrowth
+            if growth is None or oldGrowth is None or growth < MinimumComparableMemory:
+                continue
+            if growth > max(oldGrowth, MinimumComparableMemory) * (1.0 + threshold):
+                regressions.append("%s, %s: peak memory grew %.0f MB, baseline %.0f MB" % (inputName, phase["name"], growth, oldGrowth))
+    return regressions
+
+def report(results):
+    for inputName, phases in sorted(results["inputs"].items()):
+        print "\n%s" % inputName
+        print "  %-18s %9s %9s %10s %10s %10s" % ("Phase", "Wall (s)", "CPU (s)", "Peak (MB)", "Grew (MB)", "GL calls")
+        for phase in phases:
+            peak = "%.0f" % phase["peakRSS"] if phase["peakRSS"] is not None else "-"
+            growth = "%.0f" % phase["peakGrowth"] if phase["peakGrowth"] is not None else "-"
+            print "  %-18s %9.3f %9.3f %10s %10s %10d" % (phase["name"], phase["wall"], phase["cpu"], peak, growth, phase["glCalls"])
+
+def licCommand():
+    # How to launch another Lic process, as LicWindow.getShardedExporter does
+    if getattr(sys, 'frozen', False):
+        return [sys.executable]
+    return [sys.executable, os.path.abspath(sys.argv[0])]
+
+def runInput(options, FileVersion, MagicNumber):
+    # Child process side: run one input's phases, and write them to options.json
+    app, glWidget = LicBenchmark.createGLWidget(PerfFlag)
+    if glWidget is None:
+        return 1
+
+    glCounter = GLCallCounter()
+    if options.countGL:
+        glCounter.install()
+
+    cwd = os.getcwd()
+    os.chdir(options.workDir)  # Keep the image cache export writes to out of the user's cache
+    try:
+        LicBenchmark.setLDrawPath(os.path.join(options.workDir, "LDraw"))
+        modelFilename = os.path.join(options.workDir, options.runInput + ".mpd")
+        timer = PhaseTimer(glCounter)
+        runPhases(timer, modelFilename, options.workDir, glWidget, FileVersion, MagicNumber, options.export)
+    finally:
+        glCounter.uninstall()
+        os.chdir(cwd)
+
+    f = open(options.json, 'w')
+    json.dump(timer.phases, f)
+    f.close()
+
+    del app
+    return 0
+
+def runHarness(args, FileVersion, MagicNumber):
+
+    parser = optparse.OptionParser(usage = "python Lic.py %s [options]" % PerfFlag)
+    parser.add_option("--input", action = "append", dest = "inputs", default = None,
+                      help = "fixed input to run, one of %s; repeat for more [all]" % ", ".join(sorted(FixedInputs)))
+    parser.add_option("--json", default = "lic_perf.json", help = "write results to this file [%default]")
+    parser.add_option("--baseline", default = None, help = "compare against this results file")
+    parser.add_option("--threshold", type = "float", default = 0.2, help = "allowed slowdown against the baseline, as a fraction [%default]")
+    parser.add_option("--no-export", action = "store_false", dest = "export", default = True, help = "skip the export phase")
+    parser.add_option("--no-gl-count", action = "store_false", dest = "countGL", default = True, help = "don't count GL calls")
+    parser.add_option("--keep", action = "store_true", default = False, help = "keep the generated files")
+    parser.add_option("--run-input", dest = "runInput", default = None, help = optparse.SUPPRESS_HELP)
+    parser.add_option("--work-dir", dest = "workDir", default = None, help = optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args(args)
+
+    if options.runInput:
+        return runInput(options, FileVersion, MagicNumber)
+
+    inputNames = options.inputs or sorted(FixedInputs)
+    for name in inputNames:
+        if name not in FixedInputs:
+            parser.error("unknown input '%s'" % name)
+
+    baseline = None
+    if options.baseline:
+        f = open(options.baseline, 'r')
+        baseline = json.load(f)
+        f.close()
+
+    jsonFilename = os.path.abspath(options.json)
+    workDir = tempfile.mkdtemp(prefix = "lic_perf_")
+    results = {"fileVersion": FileVersion, "platform": sys.platform, "time": time.time(), "inputs": {}}
+    try:
+        libraryDir = os.path.join(workDir, "LDraw")
+        os.mkdir(libraryDir)
+        LicModelGenerator.writeStandInLibrary(libraryDir)
+
+        for name in inputNames:
+            LicModelGenerator.writeModel(os.path.join(workDir, name + ".mpd"), **FixedInputs[name])
+            phaseFilename = os.path.join(workDir, name + "_phases.json")
+            command = licCommand() + [PerfFlag, "--run-input", name, "--work-dir", workDir, "--json", phaseFilename]
+            if not options.export:
+                command.append("--no-export")
+            if not options.countGL:
+                command.append("--no-gl-count")
+            if subprocess.call(command) != 0:
+                print "Input '%s' FAILED" % name
+                return 1
+
+            f = open(phaseFilename, 'r')
+            results["inputs"][name] = json.load(f)
+            f.close()
+    finally:
+        if options.keep:
+            print "Generated files kept in " + workDir
+        else:
+            shutil.rmtree(workDir, True)
+
+    f = open(jsonFilename, 'w')
+    json.dump(results, f, indent = 2, sort_keys = True)
+    f.close()
+
+    report(results)
+    print "\nResults written to " + jsonFilename
+
+    failed = False
+    if baseline is not None:
+        regressions = compareToBaseline(results, baseline, options.threshold)
+        for regression in regressions:
+            print "  REGRESSION: " + regression
+        print "\n%d regression(s) against %s (threshold %d%%)" % (len(regressions), options.baseline, options.threshold * 100)
+        failed = bool(regressions)
+
+    return 1 if failed else 0
@@ -0,0 +1,122 @@
+"""
+    Lic - Instruction Book Creation software
+    Copyright (C) 2010 Remi Gagne
+
+    This file (LicSnapIndex.py) is part of Lic.
+
+    Lic is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Lic is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/
+"""
+
+# Edges a dragged item can snap to, for LicGraphicsScene.snap.  Built once per drag from the
+# guides and the items on the dragged item's page, so each mouse move only searches the index
+# rather than every item on the page.  Works on plain numbers; targets are keyed by whatever the
+# caller likes (the scene uses the items themselves).
+
+from bisect import bisect_left, bisect_right
+
+# Kinds of edges, each matched against one edge of the dragged item
+Left, Right, Top, Bottom = range(4)  # Target's edge lines up with the same edge of the item
+LeftMargin, RightMargin, TopMargin, BottomMargin = range(4, 8)  # Item sits margin away from the target, on that side
+
+class SnapIndex(object):
+    """
+    Target edges are kept in one sorted list per kind, so the nearest edge to a point is a bisect
+    away.  Margin edges only count when the target and the item span one another across the other
+    axis, so those searches step outwards from the bisect until they find one that does.
+    """
+
+    def __init__(self, margin, item = None, movingItems = None):
+        self.margin = margin
+        self.item = item  # Item being dragged, if any
+        self.movingItems = movingItems or []  # Targets that move along with item; see moveTarget
+        self.targets = {}  # {key: (left, top, right, bottom, isFrame)}
+        self.edges = [([], []) for unused in range(8)]  # For each kind, sorted edge positions and their keys
+
+    def __len__(self):
+        return len(self.targets)
+
+    def targetEdges(self, left, top, right, bottom, isFrame):
+        # [(kind, position)] for one target.  Frames (Pages and guides) don't get margin edges
+        edges = [(Left, left), (Right, right), (Top, top), (Bottom, bottom)]
+        if not isFrame:
+            m = self.margin
+            edges += [(LeftMargin, right + m), (RightMargin, left - m), (TopMargin, bottom + m), (BottomMargin, top - m)]
+        return edges
+
+    def addTarget(self, key, left, top, right, bottom, isFrame = False):
+        self.targets[key] = (left, top, right, bottom, isFrame)
+        for kind, position in self.targetEdges(left, top, right, bottom, isFrame):
+            positions, keys = self.edges[kind]
+            i = bisect_right(positions, position)
+            positions.insert(i, position)
+            keys.insert(i, key)
+
+    def removeTarget(self, key):
+        left, top, right, bottom, isFrame = self.targets.pop(key)
+        for kind, position in self.targetEdges(left, top, right, bottom, isFrame):
+            positions, keys = self.edges[kind]
+            i = bisect_left(positions, position)
+            while keys[i] is not key:
+                i += 1
+            del positions[i]
+            del keys[i]
+
+    def moveTarget(self, key, left, top, right, bottom):
+        # For targets that move during the drag, like other selected items
+        isFrame = self.targets[key][4]
+        if self.targets[key][:4] != (left, top, right, bottom):
+            self.removeTarget(key)
+            self.addTarget(key, left, top, right, bottom, isFrame)
+
+    def targetRect(self, key):
+        return self.targets[key][:4]
+
+    def nearest(self, kind, position, distance, accept = None):
+        # (offset, edge, key) of the edge of kind nearest position, closer than distance, or None.
+        # accept(key) can turn down edges
+        positions, keys = self.edges[kind]
+        after = bisect_left(positions, position)
+        before = after - 1
+
+        while True:
+            below = position - positions[before] if before >= 0 else distance
+            above = positions[after] - position if after < len(positions) else distance
+            if below >= distance and above >= distance:
+                return None
+            if below <= above:
+                i, before = before, before - 1
+            else:
+                i, after = after, after + 1
+            if accept is None or accept(keys[i]):
+                return positions[i] - position, positions[i], keys[i]
+
+    def snap(self, left, top, right, bottom, distance):
+        # Nearest snap for an item with these edges, along each axis: (offset, edge, key) or None
+        def spansY(key):
+            t, b = self.targets[key][1], self.targets[key][3]
+            return (t < top and b > bottom) or (t > top and b < bottom)
+
+        def spansX(key):
+            l, r = self.targets[key][0], self.targets[key][2]
+            return (l < left and r > right) or (l > left and r < right)
+
+        def best(*candidates):
+            candidates = [c for c in candidates if c is not None]
+            return min(candidates, key = lambda c: abs(c[0])) if candidates else None
+
+        x = best(self.nearest(Left, left, distance), self.nearest(Right, right, distance),
+                 self.nearest(LeftMargin, left, distance, spansY), self.nearest(RightMargin, right, distance, spansY))
+        y = best(self.nearest(Top, top, distance), self.nearest(Bottom, bottom, distance),
+                 self.nearest(TopMargin, top, distance, spansX), self.nearest(BottomMargin, bottom, distance, spansX))
+        return x, y
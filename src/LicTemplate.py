@@ -25,8 +25,11 @@ from LicUndoActions import *
 from LicQtWrapper import *
 from LicModel import *
 
+import LicBookLayout
+import LicCustomPages
 import LicGradientDialog
 import LicDialogs
+import LicPacking
 
 class TemplateLineItem(object):
 
@@ -235,6 +238,7 @@ class TemplatePage(TemplateRectItem, Page):
             newPart = part.duplicate()
             step.addPart(newPart)
             self.submodelPart.parts.append(newPart)
+        LicHelpers.notifyModelChanged()
 
         self.submodelPart.createGLDisplayList()
         self.initGLDimension(self.submodelPart, glContext)
@@ -372,9 +376,10 @@ class TemplatePage(TemplateRectItem, Page):
         w, h = newPageSize.width(), newPageSize.height()
         self.setRect(0, 0, w, h)
         self.initLayout()
-        for page in self.instructions.getPageList():
+        pageList = self.instructions.getPageList()
+        for page in pageList:
             page.setRect(0, 0, w, h)
-            page.initLayout()
+        LicBookLayout.relayoutPages(pageList)
         self.scene().refreshView()
 
     def contextMenuEvent(self, event):
@@ -620,12 +625,22 @@ class TemplatePLI(TemplateRectItem, PLI, TemplateRotateScaleSignalItem):
         actions = [action,
                    (None, None),
                    ("Change Default PLI Rotation", self.rotateDefaultSignal),
-                   ("Change Default PLI Scale", self.scaleDefaultSignal)]
+                   ("Change Default PLI Scale", self.scaleDefaultSignal),
+                   (None, None),
+                   ("Change PLI Packing", lambda: self.changePackingMethod(PLI, LicPacking.PLIMethods, "PLI")),
+                   ("Change Part List Packing", lambda: self.changePackingMethod(LicCustomPages.PartListPLI, LicPacking.PartListMethods, "Part List"))]
         menu = TemplateRectItem.getContextMenu(self, actions)
         menu.exec_(event.screenPos())
 
     def setIncludeSubmodels(self, include = True):
         self.scene().undoStack.push(ShowHideSubmodelsInPLICommand(self, include))
+
+    def changePackingMethod(self, pliClass, methods, label):
+        current = methods.index(pliClass.packingMethod) if pliClass.packingMethod in methods else 0
+        method, ok = QInputDialog.getItem(self.scene().views()[0], "Change %s Packing" % label, "Pack parts with:", methods, current, False)
+        method = str(method)
+        if ok and method != pliClass.packingMethod:
+            self.scene().undoStack.push(SetPackingMethodCommand(self, pliClass, pliClass.packingMethod, method))
     
 class TemplateSubmodelPreview(TemplateRectItem, SubmodelPreview, TemplateRotateScaleSignalItem):
 
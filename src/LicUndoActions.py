@@ -278,6 +278,7 @@ class SwapStepsCommand(QUndoCommand):
 
         i1, i2 = p1.steps.index(s1), p2.steps.index(s2)
         p1.steps[i1], p2.steps[i2] = p2.steps[i2], p1.steps[i1]
+        LicHelpers.notifyModelChanged()
 
         s1.number, s2.number = s2.number, s1.number
         s1.csi.isDirty, s2.csi.isDirty = True, True
@@ -319,6 +320,7 @@ class AddRemovePartCommand(QUndoCommand):
             self.part.setParentItem(None)
             step.removePart(self.part)
             submodel.parts.remove(self.part)
+        LicHelpers.notifyModelChanged()
 
         step.scene().emit(SIGNAL("layoutChanged()"))
 
@@ -396,6 +398,26 @@ class ShowHideSubmodelsInPLICommand(QUndoCommand):
 
         self.templatePLI.scene().emit(SIGNAL("layoutChanged()"))
 
+class SetPackingMethodCommand(QUndoCommand):
+
+    _id = getNewCommandID()
+
+    def __init__(self, templatePLI, pliClass, oldMethod, newMethod):
+        QUndoCommand.__init__(self, "change %s packing" % ("Part List" if pliClass.itemClassName == "PartListPLI" else "PLI"))
+        self.templatePLI, self.pliClass, self.oldMethod, self.newMethod = templatePLI, pliClass, oldMethod, newMethod
+
+    def doAction(self, redo):
+        self.pliClass.packingMethod = self.newMethod if redo else self.oldMethod
+        template = self.templatePLI.getPage()
+        mainModel = template.instructions.mainModel
+
+        if self.pliClass.itemClassName == "PartListPLI":
+            if mainModel.partListPages:
+                mainModel.updatePartList()  # Items may now fit on more or fewer pages
+        else:
+            template.initLayout()
+            mainModel.initAllPLILayouts()
+
 class ShowHideStepSeparatorCommand(QUndoCommand):
 
     _id = getNewCommandID()
@@ -1155,6 +1177,7 @@ class SubmodelToCalloutCommand(QUndoCommand):
                 self.targetStep.removePart(part)
                 targetModel.parts.remove(part)
                 self.submodelInstanceList.append(part)
+        LicHelpers.notifyModelChanged()
 
         calloutDone = False
         for submodelPart in self.submodelInstanceList:
@@ -1177,6 +1200,7 @@ class SubmodelToCalloutCommand(QUndoCommand):
                         self.targetCallout.addBlankStep(False)
                             
             calloutDone = True
+        LicHelpers.notifyModelChanged()
         
         if len(self.submodelInstanceList) > 1:
             self.targetCallout.setQuantity(len(self.submodelInstanceList))
@@ -1220,6 +1244,69 @@ class SubmodelToCalloutCommand(QUndoCommand):
         self.submodel.pages[0].setSelected(True)
         scene.emit(SIGNAL("sceneClick"))
 
+class MergeSubmodelsCommand(QUndoCommand):
+
+    _id = getNewCommandID()
+
+    def __init__(self, submodel, duplicateList):
+        QUndoCommand.__init__(self, "Merge identical Submodels")
+        self.submodel, self.duplicateList = submodel, duplicateList
+        self.parentList = [d._parent for d in duplicateList]
+        self.instanceList = []  # [(Part, duplicate Submodel it was an instance of)]
+
+    def findInstances(self):
+        instanceList = []
+        models = [self.submodel.instructions.mainModel]
+        while models:
+            model = models.pop()
+            models += model.submodels
+            for part in model.parts:
+                if part.abstractPart in self.duplicateList:
+                    instanceList.append((part, part.abstractPart))
+        return instanceList
+
+    def resetQuantity(self):
+        instructions = self.submodel.instructions
+        item = self.submodel.pages[0].submodelItem if self.submodel.pages else None
+        if item:
+            item.setQuantity(instructions.mainModel.submodelInstanceCount(self.submodel.filename))
+            item.parentItem().initLayout()
+
+    def redo(self):
+        instructions = self.submodel.instructions
+        scene = instructions.scene
+        scene.clearSelection()
+        scene.emit(SIGNAL("layoutAboutToBeChanged()"))
+
+        self.instanceList = self.findInstances()
+        for part, duplicate in self.instanceList:
+            part.changeAbstractPart(self.submodel.filename)
+
+        for duplicate, parent in zip(self.duplicateList, self.parentList):
+            parent.removeSubmodel(duplicate)
+            instructions.partDictionary.pop(duplicate.filename)
+
+        self.resetQuantity()
+        scene.emit(SIGNAL("layoutChanged()"))
+        instructions.updateMainModel()
+
+    def undo(self):
+        instructions = self.submodel.instructions
+        scene = instructions.scene
+        scene.clearSelection()
+        scene.emit(SIGNAL("layoutAboutToBeChanged()"))
+
+        for duplicate in self.duplicateList:
+            instructions.partDictionary[duplicate.filename] = duplicate
+        for part, duplicate in self.instanceList:
+            part.changeAbstractPart(duplicate.filename)
+        for duplicate, parent in zip(self.duplicateList, self.parentList):
+            parent.addSubmodel(duplicate)  # Needs its instances back in place first, to find its Step
+
+        self.resetQuantity()
+        scene.emit(SIGNAL("layoutChanged()"))
+        instructions.updateMainModel()
+
 class CalloutToSubmodelCommand(SubmodelToCalloutCommand):
 
     _id = getNewCommandID()
@@ -1244,6 +1331,7 @@ class CalloutToSubmodelCommand(SubmodelToCalloutCommand):
             submodel.parts.append(part)
             submodel.pages[0].steps[0].addPart(part)
             self.targetStep.removePart(part)
+        LicHelpers.notifyModelChanged()
 
         submodel.addInitialPagesAndSteps()
         submodel.mergeInitialPages()
@@ -22,7 +22,17 @@ class Point(object):
  
     def __cmp__(self, other):
         """Compares the starting position of height slices"""
-        return self.x - other.x
+        return cmp(self.x, other.x)
+
+def binarySearch(slices, point, lo = 0, hi = None):
+    """Index of the slice starting at point.x, like .NET's List.BinarySearch
+
+    Returns the bitwise complement of the index point would be inserted at
+    if no slice starts there"""
+    index = bisect_left(slices, point, lo, len(slices) if hi is None else hi)
+    if index < len(slices) and slices[index].x == point.x:
+        return index
+    return ~index
  
 class RectanglePacker(object):
     """Base class for rectangle packing algorithms
@@ -199,7 +209,7 @@ class CygonRectanglePacker(RectanglePacker):
         width: Width of the rectangle
         bottom: Position of the rectangle's lower side"""
         # Find the first slice that is touched by the rectangle
-        startSlice = bisect_left(self.heightSlices, Point(left, 0))
+        startSlice = binarySearch(self.heightSlices, Point(left, 0))
  
         # Did we score a direct hit on an existing slice start?
         if startSlice >= 0:
@@ -226,11 +236,11 @@ class CygonRectanglePacker(RectanglePacker):
             if right < self.packingAreaWidth:
                 self.heightSlices.append(Point(right, firstSliceOriginalHeight))
         else: # The rectangle doesn't start on the last slice
-            endSlice = bisect_left(self.heightSlices, Point(right,0), \
+            endSlice = binarySearch(self.heightSlices, Point(right,0), \
             startSlice, len(self.heightSlices))
  
             # Another direct hit on the final slice's end?
-            if endSlice > 0:
+            if endSlice >= 0:
                 del self.heightSlices[startSlice:endSlice]
             else: # No direct hit, rectangle ends inside another slice
                 # Make index from negative bisect_left() result